@@ -0,0 +1,354 @@
+"""Pluggable engines for the page operations.
+
+Every engine implements the same small interface:
+
+    open(path)             -> document, parsed once and reused
+    page_count(document)   -> number of pages
+    page(document, index)  -> reference to one page
+    geometry(page)         -> (left, bottom, right, top, rotation) of the page
+    write(pages, output_path, progress=None)
+                           -> write page references, from any documents and
+                              in any order (reorder, extract, merge)
+    overlay(path, overlay_for, output_path, progress=None)
+                           -> draw overlay_for(geometry), the PDF bytes of a
+                              one-page overlay, on top of every page of path
+
+'pypdf' is pure Python and always available, and is the default. The
+C-backed 'pikepdf' and 'pymupdf' engines are used when those packages
+are installed. Pick one with the PDF_EDITOR_BACKEND environment
+variable, a --backend option or set_default(). progress, when given, is
+called as progress(pages_done, total).
+"""
+import importlib.util
+import os
+from collections import OrderedDict
+from io import BytesIO
+
+import merging
+from instrument import count, span
+from page_model import PageList
+from pdf_backend import PdfReader, PdfWriter, open_reader
+from reader_pool import reader_pool
+from stamping import FormStamper, page_geometry
+
+DEFAULT_BACKEND = 'pypdf'
+
+
+def _open_cached(documents, retired, path, open_document, max_open=8):
+    """Reuse an open document while the file is unchanged, retiring the least recently used beyond max_open.
+
+    Retired documents, and those of files rewritten since they were
+    opened, are moved to the retired list rather than closed: pages handed
+    out earlier may still be waiting to be written. _close_retired closes
+    them once they have been.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    document = documents.pop(key, None)
+    if document is None:
+        for stale in [open_key for open_key in documents if open_key[0] == key[0]]:
+            retired.append(documents.pop(stale))
+        with span('reader.open', path=os.path.basename(path)):
+            document = open_document(path)
+        count('bytes_read', stat.st_size)
+    documents[key] = document
+    while len(documents) > max_open:
+        retired.append(documents.popitem(last=False)[1])
+    return document
+
+
+def _close_retired(retired):
+    while retired:
+        retired.pop().close()
+
+
+def _timed_save(save, output_path):
+    with span('writer.write'):
+        save(output_path)
+    count('bytes_written', os.path.getsize(output_path))
+
+
+class PdfBackend:
+    name = None
+    module = None  # package the engine needs, checked without importing it
+
+    @classmethod
+    def available(cls):
+        return cls.module is None or importlib.util.find_spec(cls.module) is not None
+
+    def open(self, path):
+        raise NotImplementedError
+
+    def page_count(self, document):
+        raise NotImplementedError
+
+    def page(self, document, index):
+        raise NotImplementedError
+
+    def geometry(self, page):
+        raise NotImplementedError
+
+    def write(self, pages, output_path, progress=None):
+        raise NotImplementedError
+
+    def overlay(self, path, overlay_for, output_path, progress=None):
+        raise NotImplementedError
+
+    def snapshot_pages(self, entries):
+        """Page references for the (source, page index) entries of a PageList snapshot.
+
+        Raises ValueError if a source's file was rewritten since it was
+        added: its page indices would point at other pages.
+        """
+        documents = {}
+        pages = []
+        for source, page_index in entries:
+            if source.path not in documents:
+                source.check_unchanged()
+                documents[source.path] = self.open(source.path)
+            pages.append(self.page(documents[source.path], page_index))
+        return pages
+
+    def reorder(self, path, order, output_path, progress=None):
+        """Write the pages of path in the given order of 0-based indices."""
+        document = self.open(path)
+        return self.write([self.page(document, index) for index in order], output_path, progress=progress)
+
+    def merge(self, paths, output_path, progress=None, skip=None):
+        """Write every page of paths in order, leaving out the 0-based indices in skip's set for each path."""
+        skip = skip or [()] * len(paths)
+        pages = []
+        for path, skipped in zip(paths, skip):
+            document = self.open(path)
+            pages.extend(self.page(document, index) for index in range(self.page_count(document)) if index not in skipped)
+        return self.write(pages, output_path, progress=progress)
+
+
+class PypdfBackend(PdfBackend):
+    name = 'pypdf'
+
+    def open(self, path):
+        return reader_pool.get(path)
+
+    def page_count(self, document):
+        return len(document.pages)
+
+    def page(self, document, index):
+        return document.pages[index]
+
+    def snapshot_pages(self, entries):
+        # Each source's own reader, parsed from the file as it was when the pages were added
+        return list(PageList.resolve_snapshot(entries))
+
+    def geometry(self, page):
+        return page_geometry(page)
+
+    def write(self, pages, output_path, progress=None):
+        return merging.write_pages(pages, output_path, total=len(pages), progress=progress)
+
+    def merge(self, paths, output_path, progress=None, skip=None):
+        # Streams one input at a time instead of collecting every page first
+        return merging.merge_pdfs(paths, output_path, progress=progress, open_reader=reader_pool.get, skip=skip)
+
+    def overlay(self, path, overlay_for, output_path, progress=None):
+        # A private reader: adding pages to a writer must not touch the pooled one
+        reader = open_reader(path)
+        writer = PdfWriter()
+        stamper = FormStamper(writer)
+        overlays = {}
+        total = len(reader.pages)
+        for page_num, base_page in enumerate(reader.pages, 1):
+            geometry = page_geometry(base_page)
+            if geometry not in overlays:
+                overlays[geometry] = PdfReader(BytesIO(overlay_for(geometry))).pages[0]
+            with span('page.add'):
+                page = writer.add_page(base_page)
+            with span('stamp.xobject'):
+                stamper.stamp(page, overlays[geometry], geometry)
+            count('pages')
+            if progress is not None:
+                progress(page_num, total)
+        _timed_save(writer.write, output_path)
+        return total
+
+
+class PikepdfBackend(PdfBackend):
+    name = 'pikepdf'
+    module = 'pikepdf'
+
+    def __init__(self):
+        import pikepdf
+        self.pikepdf = pikepdf
+        self.documents = OrderedDict()
+        self.retired = []  # documents _open_cached let go of, closed after the next write
+
+    def open(self, path):
+        return _open_cached(self.documents, self.retired, path, self.pikepdf.open)
+
+    def page_count(self, document):
+        return len(document.pages)
+
+    def page(self, document, index):
+        return document.pages[index]
+
+    def geometry(self, page):
+        left, bottom, right, top = (float(v) for v in page.mediabox)
+        return (min(left, right), min(bottom, top), max(left, right), max(bottom, top), int(page.obj.get('/Rotate', 0)) % 360)
+
+    def write(self, pages, output_path, progress=None):
+        output = self.pikepdf.new()
+        total = len(pages)
+        for page_num, page in enumerate(pages, 1):
+            with span('page.add'):
+                output.pages.append(page)
+            count('pages')
+            if progress is not None:
+                progress(page_num, total)
+        _timed_save(output.save, output_path)
+        _close_retired(self.retired)
+        return total
+
+    def overlay(self, path, overlay_for, output_path, progress=None):
+        pikepdf = self.pikepdf
+        with pikepdf.open(path) as document:
+            forms = {}
+            streams = {'q': document.make_stream(b"q\n")}
+            opened = []
+            total = len(document.pages)
+            for page_num, page in enumerate(document.pages, 1):
+                geometry = self.geometry(page)
+                if geometry not in forms:
+                    overlay = pikepdf.open(BytesIO(overlay_for(geometry)))
+                    opened.append(overlay)
+                    form = overlay.pages[0].as_form_xobject()
+                    # The overlay's drawing is placed for this page's box, wherever its origin is
+                    form.BBox = pikepdf.Array(geometry[:4])
+                    forms[geometry] = document.copy_foreign(form)
+                with span('stamp.xobject'):
+                    name = page.add_resource(forms[geometry], pikepdf.Name.XObject, prefix='Stamp')
+                    # Same q/Q wrapper as the pypdf engine, with the small streams shared between pages
+                    if name not in streams:
+                        streams[name] = document.make_stream(f"\nQ q {name} Do Q\n".encode('ascii'))
+                    page.contents_add(streams['q'], prepend=True)
+                    page.contents_add(streams[name])
+                count('pages')
+                if progress is not None:
+                    progress(page_num, total)
+            _timed_save(document.save, output_path)
+            for overlay in opened:
+                overlay.close()
+        return total
+
+
+class PymupdfBackend(PdfBackend):
+    name = 'pymupdf'
+    module = 'pymupdf'
+
+    def __init__(self):
+        import pymupdf
+        self.pymupdf = pymupdf
+        self.documents = OrderedDict()
+        self.retired = []  # documents _open_cached let go of, closed after the next write
+
+    def open(self, path):
+        return _open_cached(self.documents, self.retired, path, self.pymupdf.open)
+
+    def page_count(self, document):
+        return document.page_count
+
+    def page(self, document, index):
+        return (document, index)
+
+    def geometry(self, page):
+        document, index = page
+        page = document[index]
+        kind, value = document.xref_get_key(page.xref, 'MediaBox')
+        if kind == 'array':
+            # The box as written in the file, so the geometry matches the other engines exactly
+            left, bottom, right, top = (float(v) for v in value.strip('[]').split())
+        else:
+            # Inherited box; MuPDF's mediabox has the same size but a top-down origin
+            box = page.mediabox
+            left, bottom, right, top = box.x0, box.y0, box.x0 + box.width, box.y0 + box.height
+        return (min(left, right), min(bottom, top), max(left, right), max(bottom, top), page.rotation % 360)
+
+    def write(self, pages, output_path, progress=None):
+        output = self.pymupdf.open()
+        total = len(pages)
+        written = 0
+        # Copy runs of consecutive pages from the same document in one call
+        run_start = 0
+        for position in range(1, total + 1):
+            if position < total:
+                (document, index), (previous_document, previous_index) = pages[position], pages[position - 1]
+                if document is previous_document and index == previous_index + 1:
+                    continue
+            document, first = pages[run_start]
+            with span('page.add', pages=position - run_start):
+                output.insert_pdf(document, from_page=first, to_page=first + position - run_start - 1)
+            count('pages', position - run_start)
+            written += position - run_start
+            run_start = position
+            if progress is not None:
+                progress(written, total)
+        _timed_save(lambda path: output.save(path, garbage=1, deflate=True), output_path)
+        output.close()
+        _close_retired(self.retired)
+        return total
+
+    def overlay(self, path, overlay_for, output_path, progress=None):
+        pymupdf = self.pymupdf
+        document = pymupdf.open(path)
+        overlays = {}
+        total = document.page_count
+        for page_num, page in enumerate(document, 1):
+            left, bottom, right, top, rotation = self.geometry((document, page.number))
+            # show_pdf_page clips to the overlay's media box, which always starts at the origin,
+            # so draw the overlay for an unshifted box and let the placement move it into position
+            geometry = (0.0, 0.0, right - left, top - bottom, rotation)
+            if geometry not in overlays:
+                overlays[geometry] = pymupdf.open('pdf', overlay_for(geometry))
+            # The placement is in displayed coordinates; one form is reused per overlay
+            target = pymupdf.Rect(left, bottom, right, top) * page.transformation_matrix
+            with span('stamp.xobject'):
+                page.show_pdf_page(target, overlays[geometry], 0, keep_proportion=False, overlay=True)
+            count('pages')
+            if progress is not None:
+                progress(page_num, total)
+        _timed_save(lambda path: document.save(path, garbage=1, deflate=True), output_path)
+        document.close()
+        for overlay in overlays.values():
+            overlay.close()
+        return total
+
+
+BACKENDS = OrderedDict((backend.name, backend) for backend in (PypdfBackend, PikepdfBackend, PymupdfBackend))
+
+_instances = {}
+_default = None
+
+
+def available_backends():
+    return [name for name, backend in BACKENDS.items() if backend.available()]
+
+
+def default_backend_name():
+    return _default or os.environ.get('PDF_EDITOR_BACKEND') or DEFAULT_BACKEND
+
+
+def set_default(name):
+    """Make name the engine get_backend() returns when none is asked for."""
+    global _default
+    get_backend(name)
+    _default = name
+
+
+def get_backend(name=None):
+    name = name or default_backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend '{name}'; choose from {', '.join(BACKENDS)}")
+    if name not in _instances:
+        if not BACKENDS[name].available():
+            raise ValueError(f"The '{name}' PDF backend needs the {BACKENDS[name].module} package: pip install {BACKENDS[name].module}")
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
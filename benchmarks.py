@@ -0,0 +1,871 @@
+"""Benchmarks for the headless PDF operations.
+
+Every measurement runs in a fresh process so peak RSS belongs to that
+run alone. Inputs are synthetic and generated offline, reproducibly, in
+a temporary directory or a reusable corpus directory.
+
+The suite times every editor operation against a corpus of text, mixed
+size, image-heavy and many-font documents, and flags regressions against
+the JSON of an earlier run:
+
+    python benchmarks.py corpus --sizes 1 1000 50000 --output-dir corpus
+    python benchmarks.py --json baseline.json suite --corpus-dir corpus
+    python benchmarks.py suite --corpus-dir corpus --baseline baseline.json
+
+The other benchmarks each look at one operation in more depth:
+
+    python benchmarks.py merge --counts 10 50 200 --pages 4
+    python benchmarks.py drag --counts 1000 10000 100000
+    python benchmarks.py stamp --counts 100 1000 5000
+    python benchmarks.py template --counts 100 1000 10000
+    python benchmarks.py startup --runs 10
+    python benchmarks.py backends --pages 2000
+    python benchmarks.py inputs --kinds scanned --sizes 1000 5000
+    python benchmarks.py save --kinds text --sizes 1000 50000
+    python benchmarks.py index --kinds text --sizes 1000 5000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pypdf
+
+import backends
+import incremental
+import merging
+from pdf_backend import DecodedStreamObject, DictionaryObject, NameObject, NumberObject, PdfReader, PdfWriter, open_reader
+import splitting
+import stamping
+import text_index
+from page_model import PageList
+
+
+def make_scanned_pdf(path, pages, image_width=600, image_height=800, seed=0):
+    """Write a PDF whose pages each carry a distinct, incompressible grayscale image, like a scan."""
+    rng = random.Random(seed)
+    writer = PdfWriter()
+    for _ in range(pages):
+        page = writer.add_blank_page(612, 792)
+        image = DecodedStreamObject()
+        image.set_data(rng.randbytes(image_width * image_height))
+        image.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Image'),
+            NameObject('/Width'): NumberObject(image_width),
+            NameObject('/Height'): NumberObject(image_height),
+            NameObject('/ColorSpace'): NameObject('/DeviceGray'),
+            NameObject('/BitsPerComponent'): NumberObject(8),
+        })
+        contents = DecodedStreamObject()
+        contents.set_data(b"q 612 0 0 792 0 0 cm /Im0 Do Q")
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/XObject'): DictionaryObject({NameObject('/Im0'): writer._add_object(image)}),
+        })
+        page[NameObject('/Contents')] = writer._add_object(contents)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def make_text_pdf(path, pages, lines=50):
+    """Write a PDF whose pages each carry a page of Helvetica text, like a typical report."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for page_num in range(pages):
+        page = writer.add_blank_page(612, 792)
+        text = "".join(f"(Page {page_num + 1} line {line + 1}: the quick brown fox jumps over the lazy dog) Tj T* "
+                       for line in range(lines))
+        contents = DecodedStreamObject()
+        contents.set_data(f"BT /F1 10 Tf 12 TL 50 750 Td {text}ET".encode('ascii'))
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+        page[NameObject('/Contents')] = writer._add_object(contents)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+# (width, height, /Rotate, box origin) cycled through by make_mixed_pdf
+MIXED_PAGES = [(612, 792, 0, (0, 0)), (595, 842, 90, (0, 0)), (842, 595, 180, (0, 0)),
+               (595, 842, 0, (50, 60)), (612, 792, 270, (0, 0)), (1191, 842, 0, (-20, -30))]
+
+
+def make_mixed_pdf(path, pages):
+    """Write pages of several sizes, rotations and box origins, each labelled "Page N"."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for page_num in range(pages):
+        width, height, rotation, (left, bottom) = MIXED_PAGES[page_num % len(MIXED_PAGES)]
+        page = writer.add_blank_page(width, height)
+        page.mediabox.lower_left = (left, bottom)
+        page.mediabox.upper_right = (left + width, bottom + height)
+        if rotation:
+            page.rotate(rotation)
+        contents = DecodedStreamObject()
+        contents.set_data(f"BT /F1 24 Tf {left + 72} {bottom + 72} Td (Page {page_num + 1}) Tj ET".encode('ascii'))
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+        page[NameObject('/Contents')] = writer._add_object(contents)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+FONT_NAMES = ['Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', 'Helvetica-BoldOblique',
+              'Times-Roman', 'Times-Bold', 'Times-Italic', 'Times-BoldItalic',
+              'Courier', 'Courier-Bold', 'Courier-Oblique', 'Courier-BoldOblique']
+
+
+def make_fonts_pdf(path, pages, fonts=64, fonts_per_page=8):
+    """Write pages that each set text in several of `fonts` separate font objects, like a document assembled from many sources."""
+    writer = PdfWriter()
+    font_refs = [writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/' + FONT_NAMES[i % len(FONT_NAMES)]),
+        NameObject('/Name'): NameObject(f'/Font{i}'),
+    })) for i in range(fonts)]
+    for page_num in range(pages):
+        page = writer.add_blank_page(612, 792)
+        used = [(page_num * fonts_per_page + k) % fonts for k in range(fonts_per_page)]
+        text = "".join(f"/F{i} 11 Tf (Page {page_num + 1} set in font {i} of {fonts}) Tj T* " for i in used)
+        contents = DecodedStreamObject()
+        contents.set_data(f"BT 14 TL 50 750 Td {text}ET".encode('ascii'))
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject(f'/F{i}'): font_refs[i] for i in used}),
+        })
+        page[NameObject('/Contents')] = writer._add_object(contents)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+# Synthetic corpus documents by kind; every generator is deterministic, so a corpus can be rebuilt anywhere.
+CORPUS_KINDS = {
+    'text': make_text_pdf,
+    'mixed': make_mixed_pdf,
+    'scanned': lambda path, pages: make_scanned_pdf(path, pages, image_width=300, image_height=400),
+    'fonts': make_fonts_pdf,
+}
+
+
+def corpus_path(corpus_dir, kind, pages):
+    """Path of one corpus document, generating it the first time it is needed."""
+    path = os.path.join(corpus_dir, f'{kind}-{pages}.pdf')
+    if not os.path.exists(path):
+        os.makedirs(corpus_dir, exist_ok=True)
+        CORPUS_KINDS[kind](f'{path}.tmp', pages)
+        os.replace(f'{path}.tmp', path)
+    return path
+
+
+def run_isolated(func, *args):
+    """Run func(*args) in a freshly spawned process and return its result."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(func, *args).result()
+
+
+def _timed_merge(paths, output_path, strategy, memory_limit):
+    start = time.perf_counter()
+    pages = merging.merge_pdfs(paths, output_path, strategy=strategy, memory_limit=memory_limit)
+    return {'seconds': time.perf_counter() - start, 'pages': pages, 'peak_rss': merging.peak_rss()}
+
+
+def bench_merge(args):
+    rows = []
+    memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit else None
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, 'source.pdf')
+        make_scanned_pdf(source, args.pages)
+        paths = []
+        for count in args.counts:
+            while len(paths) < count:
+                path = os.path.join(work_dir, f'input{len(paths)}.pdf')
+                shutil.copyfile(source, path)
+                paths.append(path)
+            for strategy in args.strategies:
+                output_path = os.path.join(work_dir, 'merged.pdf')
+                result = run_isolated(_timed_merge, paths[:count], output_path, strategy, memory_limit)
+                row = {'inputs': count, 'strategy': strategy, 'pages': result['pages'],
+                       'seconds': result['seconds'], 'peak_rss_mb': (result['peak_rss'] or 0) / 1024 / 1024,
+                       'output_mb': os.path.getsize(output_path) / 1024 / 1024}
+                rows.append(row)
+                print(f"{count:>6} inputs  {strategy:<7} {row['pages']:>7} pages  {row['seconds']:8.2f}s  "
+                      f"peak RSS {row['peak_rss_mb']:8.1f} MB  output {row['output_mb']:8.1f} MB")
+    return rows
+
+
+def bench_drag(args):
+    """Latency of one drag step (move an entry, relabel its row) against page count."""
+    rows = []
+    rng = random.Random(0)
+    for count in args.counts:
+        pages = PageList()
+        for page_index in range(count):
+            pages.append(0, page_index)
+        timings = []
+        position = rng.randrange(count)
+        for _ in range(args.steps):
+            # A drag moves the held row to a neighbour, like successive <B1-Motion> events
+            new_position = min(max(position + rng.choice((-1, 1)), 0), count - 1)
+            start = time.perf_counter()
+            pages.move(position, new_position)
+            pages.label(new_position)
+            timings.append(time.perf_counter() - start)
+            position = new_position
+        timings.sort()
+        row = {'pages': count, 'steps': args.steps,
+               'median_us': timings[len(timings) // 2] * 1e6,
+               'p99_us': timings[int(len(timings) * 0.99)] * 1e6}
+        rows.append(row)
+        print(f"{count:>8} pages  median {row['median_us']:8.2f} us  p99 {row['p99_us']:8.2f} us per drag step")
+    return rows
+
+
+def _timed_stamp(input_path, output_path, mode):
+    start = time.perf_counter()
+    pages = stamping.add_text_to_existing_pdf(input_path, "CONFIDENTIAL", output_path, 40, 306, 396, angle=45, mode=mode)
+    return {'seconds': time.perf_counter() - start, 'pages': pages, 'peak_rss': merging.peak_rss()}
+
+
+def bench_stamp(args):
+    """Stamping time and output growth per page for each stamp mode."""
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in args.counts:
+            input_path = os.path.join(work_dir, f'text{count}.pdf')
+            make_text_pdf(input_path, count)
+            input_size = os.path.getsize(input_path)
+            for mode in args.modes:
+                output_path = os.path.join(work_dir, 'stamped.pdf')
+                result = run_isolated(_timed_stamp, input_path, output_path, mode)
+                row = {'pages': count, 'mode': mode, 'seconds': result['seconds'],
+                       'ms_per_page': 1000 * result['seconds'] / count,
+                       'growth_bytes_per_page': (os.path.getsize(output_path) - input_size) / count,
+                       'peak_rss_mb': (result['peak_rss'] or 0) / 1024 / 1024}
+                rows.append(row)
+                print(f"{count:>7} pages  {mode:<7} {row['seconds']:8.2f}s  {row['ms_per_page']:7.3f} ms/page  "
+                      f"+{row['growth_bytes_per_page']:8.1f} bytes/page  peak RSS {row['peak_rss_mb']:8.1f} MB")
+    return rows
+
+
+TEMPLATE_TEXT = "ABC{bates:07d}  Page {page} of {pages}"
+TEMPLATE_MODES = ('batched', 'per-page')
+
+
+def _timed_template(input_path, output_path, mode):
+    """Bates-stamp every page, in one canvas pass per chunk or with a separate overlay render per page."""
+    start = time.perf_counter()
+    if mode == 'batched':
+        pages = stamping.add_text_to_existing_pdf(input_path, TEMPLATE_TEXT, output_path, 10, 540, 20)
+    else:
+        reader = open_reader(input_path)
+        writer = PdfWriter()
+        stamper = stamping.FormStamper(writer)
+        pages = len(reader.pages)
+        for page_num, base_page in enumerate(reader.pages, 1):
+            geometry = stamping.page_geometry(base_page)
+            text = TEMPLATE_TEXT.format(page=page_num, pages=pages, bates=page_num)
+            stamp_page = PdfReader(BytesIO(stamping.render_text_overlay(text, 10, 540, 20, geometry=geometry))).pages[0]
+            stamper.forms.clear()  # every page has a stamp of its own
+            stamper.stamp(writer.add_page(base_page), stamp_page, geometry)
+        with open(output_path, 'wb') as f:
+            writer.write(f)
+    return {'seconds': time.perf_counter() - start, 'pages': pages, 'peak_rss': merging.peak_rss()}
+
+
+def bench_template(args):
+    """Throughput of per-page variable stamps (Bates numbers, page X of Y) against page count."""
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in args.counts:
+            input_path = os.path.join(work_dir, f'text{count}.pdf')
+            make_text_pdf(input_path, count)
+            input_size = os.path.getsize(input_path)
+            for mode in args.modes:
+                output_path = os.path.join(work_dir, 'stamped.pdf')
+                result = run_isolated(_timed_template, input_path, output_path, mode)
+                row = {'pages': count, 'mode': mode, 'seconds': result['seconds'],
+                       'pages_per_second': count / result['seconds'],
+                       'ms_per_page': 1000 * result['seconds'] / count,
+                       'growth_bytes_per_page': (os.path.getsize(output_path) - input_size) / count,
+                       'peak_rss_mb': (result['peak_rss'] or 0) / 1024 / 1024}
+                rows.append(row)
+                print(f"{count:>7} pages  {mode:<8} {row['seconds']:8.2f}s  {row['pages_per_second']:8.1f} pages/s  "
+                      f"{row['ms_per_page']:7.3f} ms/page  +{row['growth_bytes_per_page']:8.1f} bytes/page  "
+                      f"peak RSS {row['peak_rss_mb']:8.1f} MB")
+    return rows
+
+
+def _page_labels(path):
+    return [page.extract_text().split()[:2] for page in PdfReader(path).pages]
+
+
+def _geometries(path):
+    return [tuple(round(v, 2) for v in stamping.page_geometry(page)) for page in PdfReader(path).pages]
+
+
+def _render_difference(path_a, path_b):
+    """Fraction of differing pixels between two renderings of the same pages, or None without PyMuPDF."""
+    try:
+        import pymupdf
+    except ImportError:
+        return None
+    differing = total = 0
+    with pymupdf.open(path_a) as a, pymupdf.open(path_b) as b:
+        for page_a, page_b in zip(a, b):
+            samples_a, samples_b = page_a.get_pixmap().samples, page_b.get_pixmap().samples
+            differing += sum(1 for x, y in zip(samples_a, samples_b) if x != y) + abs(len(samples_a) - len(samples_b))
+            total += max(len(samples_a), len(samples_b))
+    return differing / total if total else 0.0
+
+
+def check_backend(name, work_dir, pages=24):
+    """Run the conformance checks against one engine; returns {check: error or None}."""
+    backend = backends.get_backend(name)
+    source = os.path.join(work_dir, 'mixed.pdf')
+    if not os.path.exists(source):
+        make_mixed_pdf(source, pages)
+    labels = _page_labels(source)
+    geometries = _geometries(source)
+    results = {}
+
+    def check(label, func):
+        try:
+            results[label] = func()
+        except Exception as e:
+            results[label] = f"{type(e).__name__}: {e}"
+
+    def check_open():
+        document = backend.open(source)
+        if backend.page_count(document) != pages:
+            return f"{backend.page_count(document)} pages instead of {pages}"
+        found = [tuple(round(v, 2) for v in backend.geometry(backend.page(document, i))) for i in range(pages)]
+        if found != geometries:
+            return "page geometry differs from the file"
+        return None
+
+    def check_reorder():
+        output = os.path.join(work_dir, f'{name}-reordered.pdf')
+        order = list(range(pages))[::-1]
+        backend.reorder(source, order, output)
+        if _page_labels(output) != [labels[i] for i in order] or _geometries(output) != [geometries[i] for i in order]:
+            return "pages out of order or boxes changed"
+        return None
+
+    def check_merge():
+        output = os.path.join(work_dir, f'{name}-merged.pdf')
+        backend.merge([source, source], output)
+        return None if _page_labels(output) == labels * 2 else "merged pages don't match the inputs"
+
+    def check_stamp():
+        output = os.path.join(work_dir, f'{name}-stamped.pdf')
+        reference = os.path.join(work_dir, 'reference-stamped.pdf')
+        stamp_args = ("CONFIDENTIAL", 30, 500, 700)
+        if not os.path.exists(reference):
+            # The original merge_page path is the reference every engine is held to
+            stamping.add_text_to_existing_pdf(source, stamp_args[0], reference, *stamp_args[1:], angle=30,
+                                              mode='merge', backend='pypdf')
+        stamping.add_text_to_existing_pdf(source, stamp_args[0], output, *stamp_args[1:], angle=30, backend=name)
+        if any("CONFIDENTIAL" not in page.extract_text() for page in PdfReader(output).pages):
+            return "stamp text missing"
+        difference = _render_difference(reference, output)
+        if difference is not None and difference > 0.001:
+            return f"stamp placed differently from merge_page ({100 * difference:.2f}% of pixels differ)"
+        return None
+
+    check('open', check_open)
+    check('reorder', check_reorder)
+    check('merge', check_merge)
+    check('stamp', check_stamp)
+    return results
+
+
+def _timed_backend(name, input_path, work_dir, copies):
+    """Time each interface operation of one engine, starting from nothing parsed."""
+    backend = backends.get_backend(name)
+    timings = {}
+    start = time.perf_counter()
+    document = backend.open(input_path)
+    pages = backend.page_count(document)
+    timings['open'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    backend.reorder(input_path, list(range(pages))[::-1], os.path.join(work_dir, f'{name}-reordered.pdf'))
+    timings['reorder'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    backend.merge([input_path] * copies, os.path.join(work_dir, f'{name}-merged.pdf'))
+    timings['merge'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stamping.add_text_to_existing_pdf(input_path, "CONFIDENTIAL", os.path.join(work_dir, f'{name}-stamped.pdf'),
+                                      40, 306, 396, angle=45, backend=name)
+    timings['stamp'] = time.perf_counter() - start
+    return {'pages': pages, 'seconds': timings, 'peak_rss': merging.peak_rss()}
+
+
+def bench_backends(args):
+    """Conformance checks and timings for every available PDF engine."""
+    rows = []
+    names = args.backends or backends.available_backends()
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = os.path.join(work_dir, 'text.pdf')
+        make_text_pdf(input_path, args.pages)
+        for name in names:
+            checks = run_isolated(check_backend, name, work_dir)
+            failed = {check: error for check, error in checks.items() if error}
+            result = run_isolated(_timed_backend, name, input_path, work_dir, args.copies)
+            seconds = result['seconds']
+            page_counts = {'open': args.pages, 'reorder': args.pages, 'merge': args.pages * args.copies, 'stamp': args.pages}
+            row = {'backend': name, 'failed': failed, 'pages': args.pages, 'seconds': seconds,
+                   'pages_per_second': {op: page_counts[op] / t if t > 0 else 0.0 for op, t in seconds.items()},
+                   'peak_rss_mb': (result['peak_rss'] or 0) / 1024 / 1024}
+            rows.append(row)
+            status = "conformance ok" if not failed else "FAILED " + "; ".join(f"{c}: {e}" for c, e in failed.items())
+            print(f"{name:<8} {status}")
+            print("         " + "  ".join(f"{op} {t:7.2f}s ({row['pages_per_second'][op]:8.0f} pages/s)" for op, t in seconds.items())
+                  + f"  peak RSS {row['peak_rss_mb']:.1f} MB")
+    return rows
+
+
+def _editor_pages(path):
+    pages = PageList()
+    pages.append_source_pages(pages.add_source(path))
+    return pages
+
+
+def _suite_open(backend, path, work_dir):
+    return backend.page_count(backend.open(path))
+
+
+def _suite_reorder(backend, path, work_dir):
+    # Save the document with its page order reversed, as the editor would after reordering
+    pages = _editor_pages(path)
+    snapshot = pages.snapshot(range(len(pages) - 1, -1, -1))
+    return backend.write(backend.snapshot_pages(snapshot), os.path.join(work_dir, 'reordered.pdf'))
+
+
+def _suite_delete(backend, path, work_dir):
+    pages = _editor_pages(path)
+    for position in range(0, len(pages), 2):
+        pages.mark_deleted(position)
+    return backend.write(backend.snapshot_pages(pages.snapshot()), os.path.join(work_dir, 'deleted.pdf'))
+
+
+def _suite_extract(backend, path, work_dir):
+    pages = _editor_pages(path)
+    snapshot = pages.snapshot(range(0, len(pages), 10))
+    return backend.write(backend.snapshot_pages(snapshot), os.path.join(work_dir, 'extracted.pdf'))
+
+
+def _suite_merge(backend, path, work_dir):
+    return backend.merge([path, path], os.path.join(work_dir, 'merged.pdf'))
+
+
+def _suite_split(backend, path, work_dir):
+    # Ten parts; splitting always runs on the single-pass pypdf splitter
+    reader = PdfReader(path)
+    ranges = splitting.split_ranges(f"every {max(1, -(-len(reader.pages) // 10))}", reader)
+    output_paths = splitting.output_names(splitting.DEFAULT_TEMPLATE, ranges, path, directory=work_dir)
+    return splitting.split_pdf(path, ranges, output_paths)
+
+
+def _suite_stamp(backend, path, work_dir):
+    return stamping.add_text_to_existing_pdf(path, "CONFIDENTIAL", os.path.join(work_dir, 'stamped.pdf'),
+                                             40, 306, 396, angle=45, backend=backend.name)
+
+
+SUITE_OPERATIONS = {
+    'open': _suite_open,
+    'reorder': _suite_reorder,
+    'delete': _suite_delete,
+    'extract': _suite_extract,
+    'merge': _suite_merge,
+    'split': _suite_split,
+    'stamp': _suite_stamp,
+}
+
+# A slowdown or growth only counts as a regression when it is also bigger than this, so noise on tiny runs doesn't.
+REGRESSION_FLOORS = {'seconds': 0.05, 'peak_rss_mb': 5.0}
+
+
+def _timed_operation(operation, backend_name, path):
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        pages = SUITE_OPERATIONS[operation](backends.get_backend(backend_name), path, work_dir)
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'pages': pages, 'peak_rss': merging.peak_rss()}
+
+
+def find_regressions(rows, baseline_path, tolerance):
+    """Mark rows slower or bigger than the matching baseline row by more than tolerance; returns how many."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(row['corpus'], row['pages'], row['operation'], row['backend']): row for row in json.load(f)['results']}
+    count = 0
+    for row in rows:
+        old = baseline.get((row['corpus'], row['pages'], row['operation'], row['backend']))
+        if old is None:
+            continue
+        regressions = []
+        for metric, floor in REGRESSION_FLOORS.items():
+            if row[metric] > old[metric] * (1 + tolerance) and row[metric] - old[metric] > floor:
+                regressions.append(f"{metric} {old[metric]:.2f} -> {row[metric]:.2f}")
+        if regressions:
+            row['regressions'] = regressions
+            count += 1
+    return count
+
+
+def bench_suite(args):
+    """Every editor operation against every corpus document, optionally checked against a baseline."""
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus_dir or temp_dir
+        for kind in args.kinds:
+            for pages in args.sizes:
+                path = corpus_path(corpus_dir, kind, pages)
+                for operation in args.operations:
+                    result = run_isolated(_timed_operation, operation, args.backend, path)
+                    row = {'corpus': kind, 'pages': pages, 'operation': operation, 'backend': args.backend,
+                           'pages_processed': result['pages'], 'seconds': result['seconds'],
+                           'pages_per_second': result['pages'] / result['seconds'] if result['seconds'] > 0 else 0.0,
+                           'peak_rss_mb': (result['peak_rss'] or 0) / 1024 / 1024,
+                           'input_mb': os.path.getsize(path) / 1024 / 1024}
+                    rows.append(row)
+                    print(f"{kind:<8} {pages:>7} pages  {operation:<8} {row['seconds']:8.3f}s  "
+                          f"{row['pages_per_second']:10.0f} pages/s  peak RSS {row['peak_rss_mb']:8.1f} MB")
+
+    if args.baseline:
+        count = find_regressions(rows, args.baseline, args.tolerance)
+        for row in rows:
+            if row.get('regressions'):
+                print(f"REGRESSION {row['corpus']} {row['pages']} pages {row['operation']}: {'; '.join(row['regressions'])}")
+        print(f"{count} regression(s) against {args.baseline} (tolerance {100 * args.tolerance:.0f}%)")
+    return rows
+
+
+def bench_corpus(args):
+    """Generate corpus documents without timing anything."""
+    rows = []
+    for kind in args.kinds:
+        for pages in args.sizes:
+            start = time.perf_counter()
+            path = corpus_path(args.output_dir, kind, pages)
+            rows.append({'corpus': kind, 'pages': pages, 'path': path, 'mb': os.path.getsize(path) / 1024 / 1024})
+            print(f"{path}: {rows[-1]['mb']:.1f} MB ({time.perf_counter() - start:.1f}s)")
+    return rows
+
+
+def _resident_memory():
+    """(private, file-backed) resident bytes of this process; file-backed pages are shared and reclaimable."""
+    sizes = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('RssAnon:', 'RssFile:')):
+                    sizes[line.split(':')[0]] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return sizes.get('RssAnon'), sizes.get('RssFile')
+
+
+def _timed_input(path, mapped, touch_pages):
+    start = time.perf_counter()
+    reader = open_reader(path, mapped=mapped)
+    pages = len(reader.pages)
+    open_seconds = time.perf_counter() - start
+    private, shared = _resident_memory()
+    # Read the first pages' content, as the editor and a stamp job opening the same file each would
+    start = time.perf_counter()
+    readers = [reader, open_reader(path, mapped=mapped)]
+    for each in readers:
+        for page in each.pages[:touch_pages]:
+            contents = page.get_contents()
+            if contents is not None:
+                contents.get_data()
+    touch_seconds = time.perf_counter() - start
+    private_two, shared_two = _resident_memory()
+    return {'pages': pages, 'open_seconds': open_seconds, 'touch_seconds': touch_seconds,
+            'private_rss': private, 'shared_rss': shared, 'private_rss_two': private_two,
+            'shared_rss_two': shared_two, 'peak_rss': merging.peak_rss()}
+
+
+def bench_inputs(args):
+    """Open latency and memory of reading sources into memory against memory-mapping them."""
+    rows = []
+
+    def mb(size):
+        return (size or 0) / 1024 / 1024
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus_dir or temp_dir
+        for kind in args.kinds:
+            for pages in args.sizes:
+                path = corpus_path(corpus_dir, kind, pages)
+                for mapped in (False, True):
+                    result = run_isolated(_timed_input, path, mapped, args.touch_pages)
+                    row = {'corpus': kind, 'pages': pages, 'input': 'mapped' if mapped else 'read',
+                           'input_mb': mb(os.path.getsize(path)), 'open_seconds': result['open_seconds'],
+                           'touch_seconds': result['touch_seconds'],
+                           'private_rss_mb': mb(result['private_rss']), 'shared_rss_mb': mb(result['shared_rss']),
+                           'two_readers_private_rss_mb': mb(result['private_rss_two']),
+                           'peak_rss_mb': mb(result['peak_rss'])}
+                    rows.append(row)
+                    print(f"{kind:<8} {pages:>7} pages  {row['input']:<6} open {row['open_seconds']:8.3f}s  "
+                          f"RSS private {row['private_rss_mb']:7.1f} MB + file {row['shared_rss_mb']:7.1f} MB  "
+                          f"two readers private {row['two_readers_private_rss_mb']:7.1f} MB  peak {row['peak_rss_mb']:7.1f} MB")
+    return rows
+
+
+INDEX_QUERIES = ('page 4', 'quick brown fox', 'line 12 lazy', 'q')
+
+
+def _timed_index(path, cache_dir, repeats):
+    """Build the text index of path, load it again from the cache, and time searches on it."""
+    start = time.perf_counter()
+    text_index.load_index(path, cache_dir)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index = text_index.PageIndex(*text_index.load_index(path, cache_dir))
+    cached_seconds = time.perf_counter() - start
+    timings = []
+    for _ in range(repeats):
+        for query in INDEX_QUERIES:
+            start = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {'build_seconds': build_seconds, 'cached_seconds': cached_seconds, 'terms': len(index.terms),
+            'search_median_ms': timings[len(timings) // 2] * 1000, 'search_max_ms': timings[-1] * 1000,
+            'peak_rss': merging.peak_rss()}
+
+
+def bench_index(args):
+    """Cost of building the full-text index, loading it from the cache, and searching it."""
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus_dir or temp_dir
+        for kind in args.kinds:
+            for pages in args.sizes:
+                path = corpus_path(corpus_dir, kind, pages)
+                result = run_isolated(_timed_index, path, os.path.join(temp_dir, f'index-{kind}-{pages}'), args.repeats)
+                row = {'corpus': kind, 'pages': pages, 'build_seconds': result['build_seconds'],
+                       'build_ms_per_page': 1000 * result['build_seconds'] / pages, 'cached_seconds': result['cached_seconds'],
+                       'terms': result['terms'], 'search_median_ms': result['search_median_ms'],
+                       'search_max_ms': result['search_max_ms'], 'peak_rss_mb': (result['peak_rss'] or 0) / 1024 / 1024}
+                rows.append(row)
+                print(f"{kind:<8} {pages:>7} pages  build {row['build_seconds']:8.2f}s ({row['build_ms_per_page']:6.2f} ms/page)  "
+                      f"cached {row['cached_seconds']:7.3f}s  {row['terms']:>7} words  search median {row['search_median_ms']:7.3f} ms  "
+                      f"max {row['search_max_ms']:7.3f} ms  peak RSS {row['peak_rss_mb']:7.1f} MB")
+    return rows
+
+
+SAVE_EDITS = ('delete', 'swap')
+
+
+def _edited_order(edit, pages):
+    """0-based page order after one edit in the middle of the document."""
+    order = list(range(pages))
+    middle = pages // 2
+    if edit == 'delete':
+        del order[middle]
+    elif pages > 1:
+        order[middle - 1], order[middle] = order[middle], order[middle - 1]
+    return order
+
+
+def _timed_save(path, edit, mode):
+    """Save one edit of path as the editor would, over the file itself, and time only the save."""
+    pages = PageList()
+    pages.append_source_pages(pages.add_source(path))
+    order = _edited_order(edit, len(pages))
+    entries = pages.snapshot(order)
+    size_before = os.path.getsize(path)
+    start = time.perf_counter()
+    if mode == 'incremental':
+        if incremental.updatable_source(entries) is None:
+            return {'failed': f"{path} can't be updated incrementally"}
+        incremental.save_incremental(path, entries[0][0].reader, order, path)
+        written = os.path.getsize(path) - size_before
+    else:
+        backend = backends.get_backend('pypdf')
+        backend.write(backend.snapshot_pages(entries), f'{path}.part')
+        written = os.path.getsize(f'{path}.part')
+        os.replace(f'{path}.part', path)
+    return {'seconds': time.perf_counter() - start, 'bytes_written': written, 'pages': len(order),
+            'peak_rss': merging.peak_rss()}
+
+
+def bench_save(args):
+    """Time to save a one-page deletion or swap: full rewrite against an appended incremental update."""
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus_dir or temp_dir
+        for kind in args.kinds:
+            for pages in args.sizes:
+                source = corpus_path(corpus_dir, kind, pages)
+                for edit in args.edits:
+                    for mode in ('rewrite', 'incremental'):
+                        path = os.path.join(temp_dir, 'saved.pdf')
+                        shutil.copyfile(source, path)
+                        result = run_isolated(_timed_save, path, edit, mode)
+                        row = {'corpus': kind, 'pages': pages, 'edit': edit, 'mode': mode,
+                               'input_mb': os.path.getsize(source) / 1024 / 1024}
+                        if 'failed' in result:
+                            row['failed'] = result['failed']
+                            print(f"FAILED {kind} {pages} pages {edit} {mode}: {result['failed']}")
+                        else:
+                            row.update(seconds=result['seconds'], bytes_written=result['bytes_written'],
+                                       peak_rss_mb=(result['peak_rss'] or 0) / 1024 / 1024)
+                            print(f"{kind:<8} {pages:>7} pages  {edit:<6} {mode:<11} {row['seconds']:8.3f}s  "
+                                  f"wrote {row['bytes_written'] / 1024:10.1f} KB  peak RSS {row['peak_rss_mb']:8.1f} MB")
+                        rows.append(row)
+    return rows
+
+
+# Run in a fresh interpreter: imports the editor, shows its window and reports what that cost.
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import pdf_editor
+result = {'import_seconds': time.perf_counter() - start, 'window_seconds': None}
+try:
+    app = pdf_editor.PDFApp()
+    app.update()
+    result['window_seconds'] = time.perf_counter() - start
+except Exception as e:
+    result['error'] = f"{type(e).__name__}: {e}"
+from merging import current_rss
+result['rss'] = current_rss()
+result['modules'] = sorted(name for name in ('pypdf', 'PyPDF2', 'reportlab', 'pymupdf') if name in sys.modules)
+print(json.dumps(result))
+"""
+
+
+def bench_startup(args):
+    """Time to first window and resident memory of a freshly started editor."""
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', STARTUP_PROBE], capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['process_seconds'] = time.perf_counter() - start
+        runs.append(result)
+
+    def median(key):
+        values = sorted(run[key] for run in runs if run[key] is not None)
+        return values[len(values) // 2] if values else None
+
+    row = {'runs': args.runs, 'import_seconds': median('import_seconds'), 'window_seconds': median('window_seconds'),
+           'process_seconds': median('process_seconds'), 'rss_mb': (median('rss') or 0) / 1024 / 1024,
+           'modules_loaded': runs[0]['modules']}
+    window = f"{row['window_seconds']:.3f}s" if row['window_seconds'] is not None else f"n/a ({runs[0].get('error')})"
+    print(f"import {row['import_seconds']:.3f}s  first window {window}  process {row['process_seconds']:.3f}s  "
+          f"RSS {row['rss_mb']:.1f} MB  PDF/graphics modules loaded: {', '.join(row['modules_loaded']) or 'none'}")
+    return [row]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the headless PDF operations.")
+    parser.add_argument('--json', help="also write the results to this JSON file")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    merge_parser = subparsers.add_parser('merge', help="peak RSS and time of merging against input count")
+    merge_parser.add_argument('--counts', type=int, nargs='+', default=[10, 50, 100])
+    merge_parser.add_argument('--pages', type=int, default=4, help="pages per input file")
+    merge_parser.add_argument('--strategies', nargs='+', choices=merging.MERGE_STRATEGIES, default=list(merging.MERGE_STRATEGIES))
+    merge_parser.add_argument('--memory-limit', type=int, help="memory ceiling in MiB for the stream strategy")
+    merge_parser.set_defaults(func=bench_merge)
+
+    drag_parser = subparsers.add_parser('drag', help="latency of a drag-and-drop step against page count")
+    drag_parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    drag_parser.add_argument('--steps', type=int, default=2000)
+    drag_parser.set_defaults(func=bench_drag)
+
+    stamp_parser = subparsers.add_parser('stamp', help="stamping time and output growth per page for each stamp mode")
+    stamp_parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 5000])
+    stamp_parser.add_argument('--modes', nargs='+', choices=stamping.STAMP_MODES, default=list(stamping.STAMP_MODES))
+    stamp_parser.set_defaults(func=bench_stamp)
+
+    template_parser = subparsers.add_parser('template', help="throughput of per-page Bates and page-number stamps")
+    template_parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000])
+    template_parser.add_argument('--modes', nargs='+', choices=TEMPLATE_MODES, default=list(TEMPLATE_MODES))
+    template_parser.set_defaults(func=bench_template)
+
+    startup_parser = subparsers.add_parser('startup', help="time to first window and RSS of the editor")
+    startup_parser.add_argument('--runs', type=int, default=10)
+    startup_parser.set_defaults(func=bench_startup)
+
+    backends_parser = subparsers.add_parser('backends', help="conformance checks and timings for every PDF engine")
+    backends_parser.add_argument('--pages', type=int, default=2000, help="pages in the timed document")
+    backends_parser.add_argument('--copies', type=int, default=3, help="copies of the document to merge")
+    backends_parser.add_argument('--backends', nargs='+', choices=list(backends.BACKENDS), help="engines to run (default: all installed)")
+    backends_parser.set_defaults(func=bench_backends)
+
+    suite_parser = subparsers.add_parser('suite', help="time every editor operation against a synthetic corpus")
+    add_corpus_arguments(suite_parser)
+    suite_parser.add_argument('--corpus-dir', help="keep generated corpus documents here and reuse them (default: a temporary directory)")
+    suite_parser.add_argument('--operations', nargs='+', choices=list(SUITE_OPERATIONS), default=list(SUITE_OPERATIONS))
+    suite_parser.add_argument('--backend', choices=list(backends.BACKENDS), default=backends.DEFAULT_BACKEND)
+    suite_parser.add_argument('--baseline', help="JSON written by an earlier --json run to compare against")
+    suite_parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown or growth before a regression is flagged (default: 0.2)")
+    suite_parser.set_defaults(func=bench_suite)
+
+    inputs_parser = subparsers.add_parser('inputs', help="open latency and RSS of memory-mapped against in-memory sources")
+    add_corpus_arguments(inputs_parser)
+    inputs_parser.add_argument('--corpus-dir', help="keep generated corpus documents here and reuse them (default: a temporary directory)")
+    inputs_parser.add_argument('--touch-pages', type=int, default=50, help="pages whose content each of the two readers reads")
+    inputs_parser.set_defaults(func=bench_inputs)
+
+    save_parser = subparsers.add_parser('save', help="time to save one edit: full rewrite against incremental update")
+    add_corpus_arguments(save_parser)
+    save_parser.add_argument('--corpus-dir', help="keep generated corpus documents here and reuse them (default: a temporary directory)")
+    save_parser.add_argument('--edits', nargs='+', choices=SAVE_EDITS, default=list(SAVE_EDITS))
+    save_parser.set_defaults(func=bench_save)
+
+    index_parser = subparsers.add_parser('index', help="full-text index build, cached load and search latency")
+    add_corpus_arguments(index_parser)
+    index_parser.add_argument('--corpus-dir', help="keep generated corpus documents here and reuse them (default: a temporary directory)")
+    index_parser.add_argument('--repeats', type=int, default=20, help="times each query is timed")
+    index_parser.set_defaults(func=bench_index)
+
+    corpus_parser = subparsers.add_parser('corpus', help="generate the synthetic corpus documents")
+    add_corpus_arguments(corpus_parser)
+    corpus_parser.add_argument('--output-dir', default='corpus')
+    corpus_parser.set_defaults(func=bench_corpus)
+
+    args = parser.parse_args(argv)
+    rows = args.func(args)
+    if args.json:
+        environment = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                       'pypdf': pypdf.__version__, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': args.benchmark, 'environment': environment, 'results': rows}, f, indent=2)
+    return 1 if any(row.get('failed') or row.get('regressions') for row in rows) else 0
+
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--kinds', nargs='+', choices=list(CORPUS_KINDS), default=list(CORPUS_KINDS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 1000], help="page counts, up to 50000")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""Saving page edits as an incremental update.
+
+When every page being saved comes from the opened document, in any order
+and with any of them deleted, nothing in the file needs to be copied: a
+new page tree is appended after the original bytes, with a
+cross-reference section for just the objects that changed and a trailer
+pointing back at the previous one. Parts of the page tree whose pages
+are unchanged are reused as they are, so saving one deletion or a swap
+of two pages writes a few objects however large the document is:
+
+    python incremental.py statements.pdf "1-4,6,5,7-200"
+
+The pages removed remain in the file's earlier revision, as with any
+incremental update; a full rewrite (or the optimize pass) drops them.
+Encrypted files and files indexed by cross-reference streams always get
+a full rewrite.
+"""
+import argparse
+import os
+import shutil
+import sys
+from io import BytesIO
+
+from instrument import count, span
+from page_model import count_pages
+from pdf_backend import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, open_reader
+
+# Page attributes a page can inherit from the page tree nodes above it
+INHERITABLE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+TAIL_BYTES = 1024
+
+
+class _Node:
+    __slots__ = ('ref', 'parent', 'start', 'end')
+
+    def __init__(self, ref, parent, start):
+        self.ref = ref
+        self.parent = parent
+        self.start = start  # index of the first page below this node
+        self.end = start
+
+
+def _tail(stream):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(max(size - TAIL_BYTES, 0))
+    return size, stream.read()
+
+
+def _object_bytes(stream, offset):
+    """The text of the object starting at offset, up to its endobj."""
+    stream.seek(offset)
+    data = b""
+    while True:
+        chunk = stream.read(4096)
+        data += chunk
+        end = data.find(b"endobj", max(len(data) - len(chunk) - 6, 0))
+        if end >= 0 or not chunk:
+            return data[:end] if end >= 0 else data
+
+
+def last_xref_offset(reader):
+    """Offset of the document's last cross-reference table, or None when it doesn't end in a plain table."""
+    _, tail = _tail(reader.stream)
+    position = tail.rfind(b"startxref")
+    if position < 0:
+        return None
+    try:
+        offset = int(tail[position + 9:].split()[0])
+    except (IndexError, ValueError):
+        return None
+    reader.stream.seek(offset)
+    return offset if reader.stream.read(4) == b"xref" else None
+
+
+def reader_matches_file(reader, path):
+    """Whether reader was parsed from the file now at path, judged by its size and last bytes."""
+    size, tail = _tail(reader.stream)
+    try:
+        with open(path, 'rb') as f:
+            return (size, tail) == _tail(f)
+    except OSError:
+        return False
+
+
+def updatable_source(entries, reader=None):
+    """The source of a PageList snapshot when it can be saved as an incremental update, else None.
+
+    That needs every entry to be a distinct page of one source whose file
+    is unchanged on disk, unencrypted and indexed by a plain xref table.
+    reader, when given, is looked at instead of the source's own reader,
+    which a background job may be using.
+    """
+    if not entries:
+        return None
+    source = entries[0][0]
+    if any(entry_source is not source for entry_source, _ in entries):
+        return None
+    if len({page_index for _, page_index in entries}) != len(entries):
+        return None
+    reader = reader or source.reader
+    if '/Encrypt' in reader.trailer or '/XRefStm' in reader.trailer or last_xref_offset(reader) is None:
+        return None
+    # The reader must still match the file: the update is appended to what is on disk
+    if not reader_matches_file(reader, source.path):
+        return None
+    return source
+
+
+def _is_tree_node(reader, ref):
+    """Whether the object ref points to is a /Pages node, looking at its raw bytes where possible."""
+    offset = reader.xref.get(ref.generation, {}).get(ref.idnum)
+    if offset is not None and b"/Kids" not in _object_bytes(reader.stream, offset):
+        return False
+    # Only nodes have kids; the few candidates are parsed to make sure
+    return ref.get_object().get('/Type') == '/Pages'
+
+
+def _page_tree(reader):
+    """The root node, every node, and the page refs with their parent nodes, in page order.
+
+    Pages are told apart from nodes by their raw bytes, so the page
+    objects themselves are never parsed.
+    """
+    root_ref = reader.trailer['/Root'].raw_get('/Pages')
+    pages, parents, nodes = [], [], []
+
+    def visit(ref, parent):
+        node = _Node(ref, parent, len(pages))
+        nodes.append(node)
+        for kid in ref.get_object()['/Kids']:
+            if _is_tree_node(reader, kid):
+                visit(kid, node)
+            else:
+                pages.append(kid)
+                parents.append(node)
+        node.end = len(pages)
+
+    visit(root_ref, None)
+    return nodes[0], pages, parents
+
+
+def _plan_kids(order, root, pages, parents):
+    """(ref, original parent node) for each kid of the new root.
+
+    Runs of pages that make up a whole subtree, in its original order,
+    keep that subtree instead of listing the pages one by one.
+    """
+    kids = []
+    position = 0
+    while position < len(order):
+        page_index = order[position]
+        best = None
+        node = parents[page_index]
+        while node is not root and node.start == page_index and \
+                order[position:position + node.end - node.start] == list(range(node.start, node.end)):
+            best = node
+            node = node.parent
+        if best is None:
+            kids.append((pages[page_index], parents[page_index]))
+            position += 1
+        else:
+            kids.append((best.ref, best.parent))
+            position += best.end - best.start
+    return kids
+
+
+def _write_object(buffer, base, ref, obj, offsets):
+    offsets[ref.idnum] = (base + buffer.tell(), ref.generation)
+    buffer.write(f"{ref.idnum} {ref.generation} obj\n".encode())
+    obj.write_to_stream(buffer)
+    buffer.write(b"\nendobj\n")
+
+
+def _xref_section(offsets):
+    """An xref table for offsets ({object number: (offset, generation)}), in runs of consecutive numbers."""
+    numbers = sorted(offsets)
+    lines = ["xref\n"]
+    start = 0
+    for position in range(1, len(numbers) + 1):
+        if position < len(numbers) and numbers[position] == numbers[position - 1] + 1:
+            continue
+        lines.append(f"{numbers[start]} {position - start}\n")
+        for number in numbers[start:position]:
+            offset, generation = offsets[number]
+            lines.append(f"{offset:010d} {generation:05d} n \n")
+        start = position
+    return "".join(lines).encode()
+
+
+def append_update(reader, order, output_path, progress=None):
+    """Append to output_path, a copy of reader's file, an update that leaves only the pages in order.
+
+    order lists 0-based page indices of reader. Returns the number of
+    pages. If anything fails, output_path is cut back to its original size.
+    progress, when given, is called as progress(objects_done, total).
+    """
+    previous_xref = last_xref_offset(reader)
+    with span('incremental.plan'):
+        root, pages, parents = _page_tree(reader)
+        kids = _plan_kids(list(order), root, pages, parents)
+
+    with open(output_path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        original_size = f.tell()
+        try:
+            base = original_size + 1
+            buffer = BytesIO()
+            offsets = {}
+            with span('incremental.objects'):
+                root_dict = root.ref.get_object()
+                new_root = DictionaryObject({NameObject(k): v for k, v in root_dict.items() if k not in ('/Kids', '/Count')})
+                new_root[NameObject('/Kids')] = ArrayObject(IndirectObject(ref.idnum, ref.generation, None) for ref, _ in kids)
+                new_root[NameObject('/Count')] = NumberObject(len(order))
+                _write_object(buffer, base, root.ref, new_root, offsets)
+
+                moved = [(ref, parent) for ref, parent in kids if parent is not root]
+                if progress is not None:
+                    progress(1, len(moved) + 1)
+                for done, (ref, parent) in enumerate(moved, 2):
+                    kid = DictionaryObject({NameObject(k): v for k, v in ref.get_object().items()})
+                    kid[NameObject('/Parent')] = IndirectObject(root.ref.idnum, root.ref.generation, None)
+                    # Attributes inherited from the nodes it no longer sits under
+                    node = parent
+                    while node is not root:
+                        node_dict = node.ref.get_object()
+                        for key in INHERITABLE_KEYS:
+                            if key not in kid and key in node_dict:
+                                kid[NameObject(key)] = node_dict.raw_get(key)
+                        node = node.parent
+                    _write_object(buffer, base, ref, kid, offsets)
+                    if progress is not None:
+                        progress(done, len(moved) + 1)
+
+            xref_offset = base + buffer.tell()
+            buffer.write(_xref_section(offsets))
+            trailer = DictionaryObject({NameObject(k): v for k, v in reader.trailer.items() if k not in ('/Prev', '/XRefStm')})
+            trailer[NameObject('/Prev')] = NumberObject(previous_xref)
+            buffer.write(b"trailer\n")
+            trailer.write_to_stream(buffer)
+            buffer.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+            with span('writer.write'):
+                f.write(b"\n")
+                f.write(buffer.getbuffer())
+                f.flush()
+            count('pages', len(order))
+            count('bytes_written', f.tell() - original_size)
+        except BaseException:
+            f.truncate(original_size)
+            raise
+    return len(order)
+
+
+def save_incremental(source_path, reader, order, output_path, progress=None):
+    """Save the pages in order as source_path plus an update, copying the file first unless saving over it.
+
+    Raises ValueError if reader no longer matches the file at source_path.
+    """
+    if not reader_matches_file(reader, source_path):
+        raise ValueError(f"'{source_path}' has changed since it was opened.")
+    if not (os.path.exists(output_path) and os.path.samefile(source_path, output_path)):
+        with span('incremental.copy'):
+            shutil.copyfile(source_path, output_path)
+    return append_update(reader, order, output_path, progress=progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reorder or delete pages by appending an incremental update.")
+    parser.add_argument('source', help="PDF to update")
+    parser.add_argument('pages', help="pages to keep, in their new order, such as '1-4,6,5,7-200'")
+    parser.add_argument('--output', help="write the updated copy here instead of updating the source in place")
+    args = parser.parse_args(argv)
+
+    from splitting import parse_page_ranges  # only the command line needs it
+    order = [page - 1 for start, end in parse_page_ranges(args.pages) for page in range(start, end + 1)]
+    reader = open_reader(args.source)
+    if '/Encrypt' in reader.trailer or '/XRefStm' in reader.trailer or last_xref_offset(reader) is None:
+        print(f"{args.source} can't be updated incrementally; save it with the editor or merging.py instead.", file=sys.stderr)
+        return 1
+    if len(set(order)) != len(order) or not all(0 <= page < count_pages(reader) for page in order):
+        print("Each page may only be listed once, and must be in the document.", file=sys.stderr)
+        return 1
+    pages = save_incremental(args.source, reader, order, args.output or args.source)
+    print(f"Wrote {pages} pages to '{args.output or args.source}' as an incremental update.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Lightweight timing of the hot paths.
+
+Operations are wrapped in a trace; inside one, span() times a step
+(reader open, page add, merge_page, overlay render, writer.write) and
+count() adds to a counter such as pages or bytes written. Outside a
+trace both cost next to nothing, so the headless modules call them
+unconditionally. A trace can also capture a cProfile profile and
+tracemalloc statistics, and is exported in the Chrome trace event
+format, which chrome://tracing and Perfetto open:
+
+    with instrument.trace("Saving", profile=True) as t:
+        ...
+    t.save("save-trace.json")
+
+Traces belong to the thread that started them; work done in worker
+processes only shows up as the span around it.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Spans beyond this many are still added to the totals but not kept as individual events.
+MAX_EVENTS = 20000
+
+_local = threading.local()
+_lock = threading.Lock()
+last_trace = None
+
+
+def format_bytes(size):
+    return f"{size / 1024 / 1024:.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.0f} KB"
+
+
+class Trace:
+    def __init__(self, name, profile=False):
+        self.name = name
+        self.profile = profile
+        self.events = []  # (name, start, duration, depth, args)
+        self.totals = defaultdict(lambda: [0, 0.0])  # span name -> [count, seconds]
+        self.counters = Counter()
+        self.dropped = 0
+        self.depth = 0
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.profile_report = None
+        self._profiler = None
+
+    def record(self, name, start, duration, depth, args):
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += duration
+        if len(self.events) < MAX_EVENTS:
+            self.events.append((name, start, duration, depth, args))
+        else:
+            self.dropped += 1
+
+    def summary(self):
+        return {
+            'name': self.name,
+            'seconds': self.seconds,
+            'spans': {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in
+                      sorted(self.totals.items(), key=lambda item: -item[1][1])},
+            'counters': dict(self.counters),
+            'dropped_events': self.dropped,
+            'profile': self.profile_report,
+        }
+
+    def breakdown(self, limit=4):
+        """One line for a status bar: total time, the slowest span names and the counters."""
+        parts = [f"{name} {seconds:.2f}s" for name, (_, seconds) in
+                 sorted(self.totals.items(), key=lambda item: -item[1][1])[:limit]]
+        for name, value in self.counters.items():
+            parts.append(f"{format_bytes(value)} {name.replace('bytes_', '')}" if name.startswith('bytes_')
+                         else f"{value} {name}")
+        return f"{self.name} took {self.seconds or 0:.2f}s" + (": " + ", ".join(parts) if parts else "")
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': self.thread_id,
+                   'ts': (start - self.start) * 1e6, 'dur': duration * 1e6, 'args': args}
+                  for name, start, duration, _, args in self.events]
+        events.insert(0, {'name': self.name, 'cat': 'operation', 'ph': 'X', 'pid': pid, 'tid': self.thread_id,
+                          'ts': 0, 'dur': (self.seconds or 0) * 1e6, 'args': {}})
+        if self.counters:
+            events.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': self.thread_id,
+                           'ts': (self.seconds or 0) * 1e6, 'args': dict(self.counters)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': self.summary()}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+
+    def _start_profile(self):
+        tracemalloc.start()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def _stop_profile(self):
+        self._profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:15]
+        tracemalloc.stop()
+
+        stats = pstats.Stats(self._profiler)
+        functions = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in sorted(
+                stats.stats.items(), key=lambda item: -item[1][3])[:30]:
+            functions.append({'function': f"{os.path.basename(filename)}:{line}({function})", 'calls': calls,
+                              'own_seconds': own, 'cumulative_seconds': cumulative})
+        self.profile_report = {
+            'functions': functions,
+            'memory_peak_bytes': peak,
+            'allocations': [{'where': str(stat.traceback[0]), 'bytes': stat.size, 'count': stat.count}
+                            for stat in allocations],
+        }
+        self._profiler = None
+
+
+@contextmanager
+def trace(name, profile=False):
+    """Collect spans and counters from this thread until the block ends; the finished trace becomes last_trace."""
+    global last_trace
+    current = Trace(name, profile=profile)
+    outer = getattr(_local, 'trace', None)
+    _local.trace = current
+    # tracemalloc is process-wide, so only one trace at a time can profile
+    profiling = profile and not tracemalloc.is_tracing()
+    if profiling:
+        current._start_profile()
+    try:
+        yield current
+    finally:
+        if profiling:
+            current._stop_profile()
+        current.seconds = time.perf_counter() - current.start
+        _local.trace = outer
+        with _lock:
+            last_trace = current
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def span(name, **args):
+    current = getattr(_local, 'trace', None)
+    if current is None:
+        yield
+        return
+    depth = current.depth
+    current.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.depth = depth
+        current.record(name, start, time.perf_counter() - start, depth, args)
+
+
+def count(name, amount=1):
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current.counters[name] += amount
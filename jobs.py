@@ -0,0 +1,237 @@
+"""Background jobs for the long PDF operations.
+
+A job runs on a worker thread and reports its progress through a queue
+that the Tk thread polls with after(), so the window keeps responding.
+Outputs are written to a '.part' file next to their final path and only
+renamed into place when the job succeeds; a cancelled or failed job
+removes its partial files and leaves any existing file untouched.
+
+Every job runs inside an instrument trace. The status bar shows where
+the last job's time went, and its Performance window shows the full
+breakdown, can profile the next job and exports the trace as JSON.
+"""
+import os
+import queue
+import threading
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+
+import instrument
+
+POLL_INTERVAL_MS = 100
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def partial_path(path):
+    return f"{path}.part"
+
+
+class Job:
+    def __init__(self, name, func, outputs, profile=False):
+        self.name = name
+        self.func = func
+        self.outputs = list(outputs)
+        self.profile = profile
+        self.trace = None
+        self.cancel_event = threading.Event()
+        self.events = queue.Queue()
+
+    def progress(self, done, total=None):
+        """Called from the worker thread; raises JobCancelled once the job has been cancelled."""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.events.put(('progress', (done, total)))
+
+    def run(self):
+        try:
+            with instrument.trace(self.name, profile=self.profile) as self.trace:
+                result = self.func(self.progress)
+        except JobCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+        else:
+            self.events.put(('done', result))
+
+
+class JobRunner(ttk.Frame):
+    """Status bar that runs one job at a time and shows its progress with a Cancel button."""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.job = None
+        self.on_done = None
+        self.error_message = None
+        self.last_trace = None
+        self.panel = None
+        self.profile_next = tk.BooleanVar()
+
+        self.status = ttk.Label(self, text="Ready")
+        self.status.pack(side=tk.LEFT, padx=10)
+        self.cancel_button = ttk.Button(self, text="Cancel", style='LightBlue.TButton', command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=10, pady=5)
+        ttk.Button(self, text="Performance", style='LightBlue.TButton', command=self.show_performance).pack(side=tk.RIGHT, pady=5)
+        self.progress_bar = ttk.Progressbar(self, length=300, maximum=100)
+        self.progress_bar.pack(side=tk.RIGHT, padx=5)
+
+    @property
+    def busy(self):
+        return self.job is not None
+
+    def start(self, name, func, outputs=(), on_done=None, error_message=None):
+        """Run func(progress) on a worker thread.
+
+        func must write each path in outputs to partial_path(path) instead;
+        the partial files are renamed into place once it returns. on_done
+        is called on the Tk thread with func's return value.
+        """
+        if self.job is not None:
+            messagebox.showinfo("Busy", f"Please wait for '{self.job.name}' to finish or cancel it.")
+            return None
+
+        self.job = Job(name, func, outputs, profile=self.profile_next.get())
+        self.profile_next.set(False)
+        self.on_done = on_done
+        self.error_message = error_message or f"{name} failed"
+        self.status.config(text=f"{name}...")
+        self.progress_bar.config(mode='indeterminate', value=0)
+        self.cancel_button.config(state=tk.NORMAL)
+        threading.Thread(target=self.job.run, daemon=True).start()
+        self.after(POLL_INTERVAL_MS, self.poll)
+        return self.job
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel_event.set()
+            self.status.config(text=f"Cancelling {self.job.name}...")
+
+    def poll(self):
+        job = self.job
+        latest = None
+        finished = None
+        while finished is None:
+            try:
+                kind, value = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                latest = value
+            else:
+                finished = (kind, value)
+
+        if latest is not None and not job.cancel_event.is_set():
+            done, total = latest
+            if total:
+                self.progress_bar.config(mode='determinate', value=100 * done / total)
+                self.status.config(text=f"{job.name}: page {done} of {total}")
+            else:
+                self.progress_bar.step(5)
+                self.status.config(text=f"{job.name}: {done} pages")
+
+        if finished is None:
+            self.after(POLL_INTERVAL_MS, self.poll)
+        else:
+            self.finish(job, *finished)
+
+    def finish(self, job, kind, value):
+        if kind == 'done':
+            try:
+                for output in job.outputs:
+                    os.replace(partial_path(output), output)
+            except OSError as e:
+                kind, value = 'error', e
+        if kind != 'done':
+            for output in job.outputs:
+                try:
+                    os.remove(partial_path(output))
+                except FileNotFoundError:
+                    pass
+
+        self.job = None
+        self.cancel_button.config(state=tk.DISABLED)
+        self.progress_bar.config(mode='determinate', value=100 if kind == 'done' else 0)
+        self.status.config(text={'done': f"{job.name} finished", 'cancelled': f"{job.name} cancelled",
+                                 'error': f"{job.name} failed"}[kind])
+        if job.trace is not None:
+            self.last_trace = job.trace
+            if kind == 'done':
+                self.status.config(text=job.trace.breakdown())
+            if self.panel is not None and self.panel.winfo_exists():
+                self.panel.show(job.trace)
+
+        if kind == 'done' and self.on_done is not None:
+            self.on_done(value)
+        elif kind == 'error':
+            messagebox.showerror("Error", f"{self.error_message}: {value}")
+
+    def show_performance(self):
+        if self.panel is None or not self.panel.winfo_exists():
+            self.panel = PerformancePanel(self, self.profile_next)
+        self.panel.show(self.last_trace)
+        self.panel.lift()
+
+
+class PerformancePanel(tk.Toplevel):
+    """Breakdown of the last job: time per span, counters and, when profiled, the top functions and allocations."""
+
+    def __init__(self, parent, profile_next):
+        super().__init__(parent)
+        self.title("Performance")
+        self.geometry("640x480")
+        self.trace = None
+
+        controls = ttk.Frame(self)
+        controls.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Checkbutton(controls, text="Profile the next operation (cProfile and tracemalloc)", variable=profile_next).pack(side=tk.LEFT)
+        self.export_button = ttk.Button(controls, text="Export Trace...", style='LightBlue.TButton', command=self.export, state=tk.DISABLED)
+        self.export_button.pack(side=tk.RIGHT)
+
+        self.summary = ttk.Label(self, text="No operation has run yet.", wraplength=600, justify=tk.LEFT)
+        self.summary.pack(fill=tk.X, padx=10, pady=5)
+
+        self.table = ttk.Treeview(self, columns=('count', 'seconds', 'share'), show='tree headings')
+        self.table.heading('#0', text="Step")
+        self.table.heading('count', text="Count")
+        self.table.heading('seconds', text="Seconds")
+        self.table.heading('share', text="Share")
+        for column in ('count', 'seconds', 'share'):
+            self.table.column(column, width=90, anchor=tk.E)
+        self.table.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+
+    def show(self, trace):
+        self.trace = trace
+        self.table.delete(*self.table.get_children())
+        if trace is None:
+            return
+        self.export_button.config(state=tk.NORMAL)
+        self.summary.config(text=trace.breakdown(limit=0))
+
+        summary = trace.summary()
+        total = summary['seconds'] or 0
+        for name, span in summary['spans'].items():
+            share = f"{100 * span['seconds'] / total:.0f}%" if total else ""
+            self.table.insert('', tk.END, text=name, values=(span['count'], f"{span['seconds']:.3f}", share))
+
+        profile = summary['profile']
+        if profile:
+            functions = self.table.insert('', tk.END, text="Profile: slowest functions (cumulative)", open=True)
+            for entry in profile['functions'][:15]:
+                self.table.insert(functions, tk.END, text=entry['function'],
+                                  values=(entry['calls'], f"{entry['cumulative_seconds']:.3f}", ""))
+            memory = self.table.insert('', tk.END, open=True,
+                                       text=f"Memory: peak {profile['memory_peak_bytes'] / 1024 / 1024:.1f} MB traced, largest allocations")
+            for entry in profile['allocations'][:10]:
+                self.table.insert(memory, tk.END, text=entry['where'],
+                                  values=(entry['count'], f"{entry['bytes'] / 1024:.0f} KB", ""))
+
+    def export(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".json", filetypes=[("Trace JSON", "*.json")],
+                                            title="Export Trace As")
+        if path:
+            try:
+                self.trace.save(path)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to export the trace: {e}", parent=self)
@@ -0,0 +1,241 @@
+"""Undo and redo for the page editor, kept in a sidecar file.
+
+Every edit to a PageList goes through an EditJournal, which applies it
+and records only what changed: the positions marked deleted, the range
+of pages an added PDF appended, the two ends of a move, the entries a
+save dropped. Undoing or redoing an edit costs the size of that edit,
+not of the page list, and a drag is recorded as one move however many
+rows it passes.
+
+Each edit is also appended as a line of JSON to a sidecar file next to
+the document ('report.pdf.journal'), which is removed when the editor
+closes normally. If it doesn't, opening the document again offers to
+replay the journal; added PDFs are recorded with their page counts, so
+replaying doesn't parse them.
+"""
+import json
+import os
+
+JOURNAL_VERSION = 1
+
+
+def journal_path(path):
+    return f"{path}.journal"
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class EditJournal:
+    """Applies edits to pages, with undo and redo stacks of compact operations.
+
+    path is the document the sidecar belongs to; without one the journal
+    is kept in memory only.
+    """
+
+    def __init__(self, pages, path=None):
+        self.pages = pages
+        self.path = path
+        self.undo_stack = []
+        self.redo_stack = []
+        self._file = None
+        self._drags = 0
+
+    # The sidecar file
+
+    def start(self):
+        """Begin a new sidecar for the document, replacing any earlier one."""
+        self.close()
+        if self.path is None:
+            return
+        try:
+            self._file = open(journal_path(self.path), 'w', encoding='utf-8')
+            self._write({'document': os.path.abspath(self.path), 'version': JOURNAL_VERSION, **_file_state(self.path)})
+        except OSError:
+            # A read-only folder: undo still works, only without crash recovery
+            self._file = None
+
+    def _write(self, record):
+        if self._file is not None:
+            try:
+                self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+            except OSError:
+                self._file = None
+
+    def _read(self):
+        """The edit records of an earlier session's sidecar for this document, or None."""
+        if self.path is None:
+            return None
+        records = []
+        try:
+            with open(journal_path(self.path), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break  # the line being written when the session ended
+        except OSError:
+            return None
+        if not records:
+            return None
+        header = records[0]
+        if header.get('version') != JOURNAL_VERSION or header.get('document') != os.path.abspath(self.path) or \
+                {'size': header.get('size'), 'mtime_ns': header.get('mtime_ns')} != _file_state(self.path):
+            return None
+        return records[1:]
+
+    def recoverable(self):
+        """Whether an earlier session left edits to this document that can be replayed."""
+        return bool(self._read())
+
+    def replay(self):
+        """Apply the edits recorded by an earlier session and return how many there were.
+
+        Raises ValueError, before changing anything, if a PDF the edits
+        added has changed or gone since.
+        """
+        records = self._read() or []
+        for record in records:
+            if record['op'] == 'add':
+                if not os.path.exists(record['path']) or \
+                        _file_state(record['path']) != {'size': record['size'], 'mtime_ns': record['mtime_ns']}:
+                    raise ValueError(f"'{record['path']}' has changed since the edits were made.")
+
+        self.close()
+        for record in records:
+            op = record['op']
+            if op == 'delete':
+                self.delete(record['positions'])
+            elif op == 'add':
+                self.add_source(record['path'], name=record['name'], page_count=record['pages'])
+            elif op == 'move':
+                self.move(record['from'], record['to'], drag=record.get('drag'))
+            elif op == 'purge':
+                self.purge()
+            elif op == 'undo':
+                self.undo()
+            elif op == 'redo':
+                self.redo()
+        # Continue in a fresh sidecar, without a half-written last line
+        self.start()
+        for record in records:
+            self._write(record)
+        return len(records)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Stop journaling and remove the sidecar; its edits were saved or abandoned."""
+        self.close()
+        if self.path is not None:
+            try:
+                os.remove(journal_path(self.path))
+            except FileNotFoundError:
+                pass
+
+    # Edits
+
+    def _done(self, op, record):
+        self.undo_stack.append(op)
+        self.redo_stack.clear()
+        self._write(record)
+
+    def delete(self, positions):
+        """Mark positions deleted and return the ones that weren't already."""
+        positions = [position for position in positions if not self.pages.deleted[position]]
+        if not positions:
+            return positions
+        for position in positions:
+            self.pages.mark_deleted(position)
+        self._done(('delete', positions), {'op': 'delete', 'positions': positions})
+        return positions
+
+    def add_source(self, path, name=None, page_count=None):
+        """Append every page of the PDF at path and return the position of the first."""
+        start = len(self.pages)
+        source_id = self.pages.add_source(path, name=name, page_count=page_count)
+        count = self.pages.append_source_pages(source_id)
+        self._done(('add', source_id, start, count, self.pages.sources[source_id]),
+                   {'op': 'add', 'path': path, 'name': name, 'pages': count, **_file_state(path)})
+        return start
+
+    def begin_drag(self):
+        """A token for the moves of one drag, distinct from those of earlier drags and replayed sessions."""
+        self._drags += 1
+        return self._drags
+
+    def move(self, old_position, new_position, drag=None):
+        """Move one entry. Successive moves with the same drag token are undone as one."""
+        self.pages.move(old_position, new_position)
+        if drag is not None:
+            self._drags = max(self._drags, drag)
+        record = {'op': 'move', 'from': old_position, 'to': new_position, 'drag': drag}
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if drag is not None and last is not None and last[0] == 'move' and last[3] == drag and last[2] == old_position:
+            # The held row moved on: one move from where the drag started
+            self.undo_stack[-1] = ('move', last[1], new_position, drag)
+            self._write(record)
+        else:
+            self._done(('move', old_position, new_position, drag), record)
+
+    def purge(self):
+        """Drop the entries marked deleted, as saving does, and return their positions."""
+        removed = []
+        for position in reversed([position for position, flag in enumerate(self.pages.deleted) if flag]):
+            removed.append((position,) + self.pages.pop(position))
+        if not removed:
+            return []  # nothing for an undo to bring back
+        removed.reverse()
+        self._done(('purge', removed), {'op': 'purge'})
+        return [entry[0] for entry in removed]
+
+    # Undo and redo
+
+    def undo(self):
+        """Revert the last edit and return its operation, or None when there is nothing to undo."""
+        if not self.undo_stack:
+            return None
+        op = self.undo_stack.pop()
+        kind = op[0]
+        if kind == 'delete':
+            for position in op[1]:
+                self.pages.unmark_deleted(position)
+        elif kind == 'add':
+            self.pages.truncate(op[2])
+            # Later adds were undone first, so this source is the last one
+            self.pages.sources.pop()
+        elif kind == 'move':
+            self.pages.move(op[2], op[1])
+        elif kind == 'purge':
+            for position, source_id, page_index, page_id, deleted in op[1]:
+                self.pages.insert(position, source_id, page_index, page_id=page_id, deleted=deleted)
+        self.redo_stack.append(op)
+        self._write({'op': 'undo'})
+        return op
+
+    def redo(self):
+        """Apply the last undone edit again and return its operation, or None."""
+        if not self.redo_stack:
+            return None
+        op = self.redo_stack.pop()
+        kind = op[0]
+        if kind == 'delete':
+            for position in op[1]:
+                self.pages.mark_deleted(position)
+        elif kind == 'add':
+            self.pages.sources.append(op[4])
+            self.pages.append_source_pages(op[1])
+        elif kind == 'move':
+            self.pages.move(op[1], op[2])
+        elif kind == 'purge':
+            for entry in reversed(op[1]):
+                self.pages.pop(entry[0])
+        self.undo_stack.append(op)
+        self._write({'op': 'redo'})
+        return op
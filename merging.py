@@ -0,0 +1,327 @@
+"""Merging PDFs, either in memory or streamed straight to the output file.
+
+The 'memory' strategy builds a single PdfWriter holding every page before
+anything is written. The 'stream' strategy opens one input at a time and
+appends each copied object to the output as soon as it is reached, so
+peak memory is bounded by the largest single input rather than the sum
+of all of them:
+
+    python merging.py merged.pdf a.pdf b.pdf c.pdf --memory-limit 512
+"""
+import argparse
+import gc
+import os
+import sys
+
+from pdf_backend import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, NumberObject,
+                         PdfWriter, StreamObject, open_output, open_reader)
+
+import instrument
+import optimize
+from instrument import count, span
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MERGE_STRATEGIES = ('stream', 'memory')
+
+# Page keys that point back into the source document's structure.
+PAGE_EXCLUDED_KEYS = ('/Parent', '/B', '/StructParents')
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None when it cannot be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Only the peak is available here; ru_maxrss is bytes on macOS and KiB elsewhere.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None when it cannot be read."""
+    try:
+        # VmHWM starts afresh with each program; ru_maxrss can carry the parent's peak over fork and exec
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StreamingPdfWriter:
+    """Append-only PDF writer that copies pages as they are added.
+
+    Only the output offsets, the list of page object numbers and a map of
+    already-copied objects per source reader are kept; every object is
+    written out as soon as it is reached. Call finish_reader() once a
+    reader will not be used again to forget its map.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.offsets = [None]  # indexed by object number; object 0 is the free list head
+        self.page_numbers = []
+        self._mappings = {}  # reader -> {(source id, generation): output object number}
+        stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.pages_number = self._reserve()
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, number, obj):
+        self.offsets[number] = self.stream.tell()
+        self.stream.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self.stream)
+        self.stream.write(b"\nendobj\n")
+
+    def _remap(self, obj, mapping, pending):
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key in mapping:
+                return IndirectObject(mapping[key], 0, None)
+            target = obj.get_object()
+            if isinstance(target, DictionaryObject) and target.get('/Type') == '/Pages':
+                # A link into the source page tree
+                return NullObject()
+            number = self._reserve()
+            mapping[key] = number
+            if not (isinstance(target, DictionaryObject) and target.get('/Type') == '/Page'):
+                pending.append((number, target))
+            # Links to other pages get a number now; if that page is never
+            # added, the number stays a free xref entry, which reads as null.
+            return IndirectObject(number, 0, None)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            for k, v in obj.items():
+                if k != '/Length':
+                    copy[NameObject(k)] = self._remap(v, mapping, pending)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({NameObject(k): self._remap(v, mapping, pending) for k, v in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._remap(v, mapping, pending) for v in obj)
+        return obj
+
+    def add_page(self, page, overrides=None):
+        """Copy one page, and everything it uses that was not copied already, to the output.
+
+        overrides maps page keys to values, already in the output's terms
+        (see import_object), that replace the page's own.
+        """
+        with span('page.add'):
+            self._add_page(page, overrides or {})
+        count('pages')
+
+    def _add_page(self, page, overrides):
+        mapping = self._mappings.setdefault(page.pdf, {})
+        pending = []
+        ref = page.indirect_reference
+        number = mapping.get((ref.idnum, ref.generation))
+        if number is None or self.offsets[number] is not None:
+            # First time this page is reached, or a second copy of a page already written
+            number = self._reserve()
+            mapping.setdefault((ref.idnum, ref.generation), number)
+
+        page_dict = DictionaryObject({
+            NameObject(k): self._remap(v, mapping, pending)
+            for k, v in page.items() if k not in PAGE_EXCLUDED_KEYS and k not in overrides
+        })
+        page_dict.update({NameObject(k): v for k, v in overrides.items()})
+        page_dict[NameObject('/Parent')] = IndirectObject(self.pages_number, 0, None)
+        self._write_object(number, page_dict)
+        self._write_pending(mapping, pending)
+        self.page_numbers.append(number)
+
+    def _write_pending(self, mapping, pending):
+        while pending:
+            obj_number, obj = pending.pop()
+            self._write_object(obj_number, self._remap(obj, mapping, pending))
+
+    def import_object(self, obj, reader=None):
+        """Return obj with its references to reader's objects pointing at copies in the output.
+
+        Objects copied here are shared with pages of reader added later.
+        """
+        mapping = self._mappings.setdefault(reader, {})
+        pending = []
+        obj = self._remap(obj, mapping, pending)
+        self._write_pending(mapping, pending)
+        return obj
+
+    def add_object(self, obj, reader=None):
+        """Write a new object, copying what it refers to from reader, and return a reference to it."""
+        number = self._reserve()
+        self._write_object(number, self.import_object(obj, reader))
+        return IndirectObject(number, 0, None)
+
+    def finish_reader(self, reader):
+        self._mappings.pop(reader, None)
+
+    def add_reader(self, reader, memory_limit=None, progress=None, skip=()):
+        """Append every page of reader, except the 0-based indices in skip, and return the number of pages added.
+
+        When memory_limit (bytes) is exceeded, the reader's parsed object
+        cache is dropped after each page to bring memory back down.
+        """
+        pages = reader.pages
+        mapping = self._mappings.setdefault(reader, {})
+        # Reserve page numbers up front so links between pages of this input survive.
+        for page in pages:
+            ref = page.indirect_reference
+            mapping[(ref.idnum, ref.generation)] = self._reserve()
+
+        added = 0
+        for page_index, page in enumerate(pages):
+            if page_index in skip:
+                continue
+            self.add_page(page)
+            added += 1
+            if progress is not None:
+                progress(len(self.page_numbers), None)
+            if memory_limit is not None and (current_rss() or 0) > memory_limit:
+                reader.resolved_objects.clear()
+                self.stream.flush()
+                gc.collect()
+
+        self.finish_reader(reader)
+        return added
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        with span('writer.write'):
+            self._close()
+        count('bytes_written', self.stream.tell())
+
+    def _close(self):
+        pages_tree = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(n, 0, None) for n in self.page_numbers),
+            NameObject('/Count'): NumberObject(len(self.page_numbers)),
+        })
+        self._write_object(self.pages_number, pages_tree)
+        catalog_number = self._reserve()
+        self._write_object(catalog_number, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(self.pages_number, 0, None),
+        }))
+
+        xref_offset = self.stream.tell()
+        lines = [f"xref\n0 {len(self.offsets)}\n", "0000000000 65535 f \n"]
+        for offset in self.offsets[1:]:
+            lines.append("0000000000 65535 f \n" if offset is None else f"{offset:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {len(self.offsets)} /Root {catalog_number} 0 R >>\n")
+        lines.append(f"startxref\n{xref_offset}\n%%EOF\n")
+        self.stream.write("".join(lines).encode())
+
+
+def write_pages(pages, output_path, total=None, progress=None):
+    """Stream page objects, in order, into a new PDF and return how many were written.
+
+    progress, when given, is called as progress(pages_done, total) after each page.
+    """
+    written = 0
+    with open_output(output_path) as f:
+        writer = StreamingPdfWriter(f)
+        for page in pages:
+            writer.add_page(page)
+            written += 1
+            if progress is not None:
+                progress(written, total)
+        writer.close()
+    return written
+
+
+def merge_pdfs(pdf_paths, output_path, strategy='stream', memory_limit=None, progress=None, open_reader=open_reader, skip=None):
+    """Merge pdf_paths, in order, into output_path and return the number of pages written.
+
+    progress, when given, is called as progress(pages_done, None) after each page.
+    open_reader opens each input; pass a pool's get() to reuse readers already parsed.
+    skip, when given, lists for each input a set of 0-based page indices
+    to leave out, such as the 'skip' of page_hashes.find_duplicates().
+    """
+    skip = skip or [()] * len(pdf_paths)
+    if strategy not in MERGE_STRATEGIES:
+        raise ValueError(f"Unknown merge strategy: {strategy}")
+
+    if strategy == 'memory':
+        merger = PdfWriter()
+        for pdf, skipped in zip(pdf_paths, skip):
+            reader = open_reader(pdf)
+            for page_index, page in enumerate(reader.pages):
+                if page_index in skipped:
+                    continue
+                with span('page.add'):
+                    merger.add_page(page)
+                count('pages')
+                if progress is not None:
+                    progress(len(merger.pages), None)
+        with open_output(output_path) as f, span('writer.write'):
+            merger.write(f)
+            count('bytes_written', f.tell())
+        return len(merger.pages)
+
+    total = 0
+    with open_output(output_path) as f:
+        writer = StreamingPdfWriter(f)
+        for pdf, skipped in zip(pdf_paths, skip):
+            total += writer.add_reader(open_reader(pdf), memory_limit=memory_limit, progress=progress, skip=skipped)
+            # Readers are full of reference cycles; free each input before opening the next.
+            gc.collect()
+        writer.close()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge PDFs into a single file.")
+    parser.add_argument('output', help="merged PDF to write")
+    parser.add_argument('inputs', nargs='+', help="PDFs to merge, in order")
+    parser.add_argument('--strategy', choices=MERGE_STRATEGIES, default='stream')
+    parser.add_argument('--memory-limit', type=int, help="memory ceiling in MiB for the stream strategy")
+    parser.add_argument('--optimize', action='store_true', help="deduplicate objects and compress content streams afterwards")
+    parser.add_argument('--backend', help="merge with this PDF engine instead (pypdf, pikepdf or pymupdf; see backends.py)")
+    parser.add_argument('--trace', help="write a Chrome-format timing trace of the merge to this JSON file")
+    parser.add_argument('--profile', action='store_true', help="include cProfile and tracemalloc results in the trace")
+    parser.add_argument('--skip-duplicates', action='store_true', help="leave out pages whose content repeats an earlier page")
+    args = parser.parse_args(argv)
+
+    with instrument.trace("Merging", profile=args.profile) as merge_trace:
+        skip = None
+        if args.skip_duplicates:
+            import page_hashes  # only needed for this option
+            duplicates = page_hashes.find_duplicates(args.inputs)
+            skip = duplicates['skip']
+        if args.backend:
+            import backends  # not at the top: backends builds on this module
+            pages = backends.get_backend(args.backend).merge(args.inputs, args.output, skip=skip)
+        else:
+            memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit else None
+            pages = merge_pdfs(args.inputs, args.output, strategy=args.strategy, memory_limit=memory_limit, skip=skip)
+    print(f"Merged {len(args.inputs)} files, {pages} pages, into '{args.output}'.")
+    if args.skip_duplicates:
+        print(page_hashes.describe(duplicates))
+    print(merge_trace.breakdown())
+    if args.trace:
+        merge_trace.save(args.trace)
+    if args.optimize:
+        report = optimize.optimize_pdf(args.output)
+        print(f"{args.output}: {optimize.describe(report)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
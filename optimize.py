@@ -0,0 +1,76 @@
+"""Optional size optimization pass for written PDFs.
+
+Merged and stamped pages often carry their own copies of the same fonts,
+images and stamp resources, and merged content streams are written
+uncompressed. This pass rewrites a finished file with identical objects
+collapsed into one, page content streams Flate-compressed and objects
+nothing refers to any more dropped. It holds the whole document in
+memory, so it is off by default and reports whether it paid off:
+
+    python optimize.py stamped.pdf
+"""
+import argparse
+import os
+import sys
+import time
+
+from instrument import span
+from pdf_backend import PdfWriter, open_reader
+
+
+def optimize_pdf(path, compress_streams=True, deduplicate=True):
+    """Optimize the PDF at path in place and return a report of the sizes and time taken.
+
+    The file is only replaced when the result is smaller.
+    """
+    start = time.perf_counter()
+    bytes_before = os.path.getsize(path)
+
+    writer = PdfWriter(clone_from=open_reader(path))
+    with span('optimize.compress'):
+        if compress_streams:
+            for page in writer.pages:
+                page.compress_content_streams()
+        if deduplicate:
+            writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+
+    temp_path = f"{path}.opt"
+    try:
+        with open(temp_path, 'wb') as f, span('writer.write'):
+            writer.write(f)
+        bytes_after = os.path.getsize(temp_path)
+        if bytes_after < bytes_before:
+            os.replace(temp_path, path)
+        else:
+            bytes_after = bytes_before
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return {
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_saved': bytes_before - bytes_after,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def describe(report):
+    saved = report['bytes_saved']
+    percent = 100 * saved / report['bytes_before'] if report['bytes_before'] else 0
+    return f"optimized {report['bytes_before'] / 1024:.0f} KB -> {report['bytes_after'] / 1024:.0f} KB " \
+           f"(saved {percent:.0f}%) in {report['seconds']:.2f}s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shrink PDFs by deduplicating objects and compressing content streams.")
+    parser.add_argument('paths', nargs='+', help="PDFs to optimize in place")
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        print(f"{path}: {describe(optimize_pdf(path))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Content fingerprints of pages, for finding the same page more than once.
+
+A page's fingerprint is a SHA-256 of its content stream, with runs of
+whitespace collapsed, of everything its resources lead to (fonts,
+images, forms, followed through references, so object numbers don't
+matter) and of its boxes and rotation. A page that was scanned or
+exported into several batches has the same fingerprint in each of them:
+
+    python page_hashes.py batch1.pdf batch2.pdf batch3.pdf
+
+Fingerprinting runs on a process pool, FINGERPRINT_CHUNK_PAGES pages per
+task, and is cached on disk by file hash, so a batch is only hashed the
+first time it is seen. The report says what each document cost.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from instrument import count, span
+from page_model import count_pages
+from pdf_backend import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+from reader_pool import file_key, reader_pool
+from thumbnails import file_digest
+
+FINGERPRINT_VERSION = 1
+FINGERPRINT_CHUNK_PAGES = 500
+
+# Page keys that make up how a page looks, besides its content and resources
+PAGE_KEYS = ('/MediaBox', '/CropBox', '/Rotate')
+
+# Keys that lead back up to the page or document instead of down to what is drawn
+SKIPPED_KEYS = ('/Parent', '/P', '/Length')
+
+
+def default_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pdf_editor', 'page_hashes')
+
+
+def _object_digest(obj, memo):
+    """SHA-256 of obj as it would be drawn, with indirect objects hashed once each through memo."""
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key not in memo:
+            memo[key] = b"cycle"  # a reference back into an object still being hashed
+            memo[key] = _object_digest(obj.get_object(), memo)
+        return memo[key]
+    digest = hashlib.sha256()
+    if isinstance(obj, DictionaryObject):
+        digest.update(b"S" if isinstance(obj, StreamObject) else b"D")
+        for key in sorted(obj):
+            if key not in SKIPPED_KEYS:
+                digest.update(key.encode('utf-8', 'surrogateescape') + _object_digest(obj.raw_get(key), memo))
+        if isinstance(obj, StreamObject):
+            # The stored bytes: images and fonts are compared without decoding them
+            digest.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b"A")
+        for item in obj:
+            digest.update(_object_digest(item, memo))
+    else:
+        digest.update(f"{type(obj).__name__}:{obj!r}".encode('utf-8', 'surrogateescape'))
+    return digest.digest()
+
+
+def _content_data(page):
+    contents = page.raw_get('/Contents') if '/Contents' in page else None
+    if contents is None:
+        return b""
+    contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        return b"\n".join(stream.get_object().get_data() for stream in contents)
+    return contents.get_data()
+
+
+def page_fingerprint(page, memo=None):
+    """Hex SHA-256 of what page draws, ignoring whitespace differences in its content stream."""
+    memo = {} if memo is None else memo
+    digest = hashlib.sha256()
+    digest.update(b" ".join(_content_data(page).split()))
+    if '/Resources' in page:
+        digest.update(_object_digest(page.raw_get('/Resources'), memo))
+    for key in PAGE_KEYS:
+        if key in page:
+            digest.update(key.encode('ascii') + _object_digest(page.raw_get(key), memo))
+    return digest.hexdigest()
+
+
+def fingerprint_range(path, start, end):
+    """Fingerprints of pages start to end - 1 of path, and the CPU seconds they took. Runs in a worker process."""
+    started = time.process_time()
+    pages = reader_pool.get(path).pages
+    memo = {}  # fonts and forms shared between pages are hashed once per task
+    fingerprints = [page_fingerprint(pages[index], memo) for index in range(start, end)]
+    return fingerprints, time.process_time() - started
+
+
+def fingerprint_cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest[:2], f"{digest}.json")
+
+
+def _load_cached(cache_path):
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data['pages'] if data.get('version') == FINGERPRINT_VERSION else None
+
+
+def _save_cached(cache_path, fingerprints):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': FINGERPRINT_VERSION, 'pages': fingerprints}, f)
+    os.replace(temp_path, cache_path)
+
+
+def fingerprint_files(paths, workers=None, cache_dir=None, progress=None):
+    """Fingerprint every page of paths and return ({path: [fingerprint per page]}, [cost per document]).
+
+    Each cost is a dict with the path, its pages, whether it came from
+    the cache, the wall-clock seconds until its fingerprints were ready
+    and the CPU seconds spent hashing it on the workers. Runs inline
+    when workers is 1. progress, when given, is called as
+    progress(pages_done, total).
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    start = time.perf_counter()
+    fingerprints = {}
+    costs = {}
+    tasks = []  # (path, start, end)
+    for path in dict.fromkeys(paths):
+        key = file_key(path)
+        cache_path = fingerprint_cache_path(cache_dir, file_digest(path))
+        cached = _load_cached(cache_path)
+        costs[path] = {'path': path, 'pages': 0, 'cached': cached is not None, 'seconds': 0.0, 'cpu_seconds': 0.0,
+                       'cache_path': cache_path, 'key': key}
+        if cached is not None:
+            fingerprints[path] = cached
+            costs[path]['pages'] = len(cached)
+            costs[path]['seconds'] = time.perf_counter() - start
+            continue
+        page_count = count_pages(reader_pool.get(path))
+        fingerprints[path] = [None] * page_count
+        costs[path]['pages'] = page_count
+        tasks.extend((path, first, min(first + FINGERPRINT_CHUNK_PAGES, page_count))
+                     for first in range(0, page_count, FINGERPRINT_CHUNK_PAGES))
+
+    total = sum(end - first for _, first, end in tasks)
+    remaining = {path: sum(1 for task in tasks if task[0] == path) for path in costs}
+    done = 0
+
+    def finished(task, result):
+        nonlocal done
+        path, first, end = task
+        fingerprints[path][first:end], cpu_seconds = result
+        costs[path]['cpu_seconds'] += cpu_seconds
+        remaining[path] -= 1
+        if not remaining[path]:
+            costs[path]['seconds'] = time.perf_counter() - start
+            # Rewritten while it was hashed: the fingerprints may not be of the contents the digest names
+            if file_key(path) == costs[path]['key']:
+                _save_cached(costs[path]['cache_path'], fingerprints[path])
+        done += end - first
+        count('pages_fingerprinted', end - first)
+        if progress is not None:
+            progress(done, total)
+
+    with span('pages.fingerprint', pages=total):
+        if workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                finished(task, fingerprint_range(*task))
+        elif tasks:
+            # Spawned, not forked: the editor calls this from a job thread, and a forked child could inherit a held lock
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(tasks)),
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [(task, pool.submit(fingerprint_range, *task)) for task in tasks]
+                for task, future in futures:
+                    finished(task, future.result())
+
+    for cost in costs.values():
+        del cost['cache_path'], cost['key']
+    return fingerprints, list(costs.values())
+
+
+def find_duplicates(paths, workers=None, cache_dir=None, progress=None):
+    """Report the pages of paths, taken in order, that repeat a page seen before them.
+
+    The report's 'skip' lists, for each entry of paths, the set of its
+    0-based page indices that are duplicates; 'first' maps each such
+    (entry, page index) to the (entry, page index) it repeats.
+    """
+    start = time.perf_counter()
+    fingerprints, documents = fingerprint_files(paths, workers=workers, cache_dir=cache_dir, progress=progress)
+    seen = {}
+    skip = []
+    first = {}
+    for position, path in enumerate(paths):
+        duplicates = set()
+        for page_index, fingerprint in enumerate(fingerprints[path]):
+            if fingerprint in seen:
+                duplicates.add(page_index)
+                first[(position, page_index)] = seen[fingerprint]
+            else:
+                seen[fingerprint] = (position, page_index)
+        skip.append(duplicates)
+    for document in documents:
+        document['duplicates'] = sum(len(skip[position]) for position, path in enumerate(paths) if path == document['path'])
+    return {
+        'pages': sum(len(fingerprints[path]) for path in paths),
+        'duplicates': sum(len(duplicates) for duplicates in skip),
+        'skip': skip,
+        'first': first,
+        'documents': documents,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def describe(report):
+    lines = [f"{report['duplicates']} of {report['pages']} pages are duplicates; fingerprinting took {report['seconds']:.2f}s"]
+    for document in report['documents']:
+        source = "cached" if document['cached'] else f"{document['cpu_seconds']:.2f}s CPU"
+        lines.append(f"  {document['path']}: {document['pages']} pages, {document['duplicates']} duplicates, "
+                     f"ready after {document['seconds']:.2f}s ({source})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find pages that appear more than once in a set of PDFs.")
+    parser.add_argument('paths', nargs='+', help="PDFs to compare, in merge order")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes (default: CPU count)")
+    parser.add_argument('--cache-dir', default=default_cache_dir())
+    args = parser.parse_args(argv)
+
+    report = find_duplicates(args.paths, workers=args.workers, cache_dir=args.cache_dir)
+    for (position, page_index), (first_position, first_index) in sorted(report['first'].items()):
+        print(f"{args.paths[position]} page {page_index + 1} repeats {args.paths[first_position]} page {first_index + 1}")
+    print(describe(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
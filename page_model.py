@@ -0,0 +1,184 @@
+"""Compact page model for the editor.
+
+A page in the editor is just a (source id, page index) pair. The pairs
+are kept in two parallel arrays, and the page objects themselves are only
+looked up in their source reader when the document is saved or pages are
+extracted.
+"""
+from array import array
+from itertools import repeat
+
+from reader_pool import file_key, reader_pool
+
+
+def count_pages(reader):
+    """Page count from the page tree root, without walking every page."""
+    try:
+        return int(reader.trailer['/Root']['/Pages']['/Count'])
+    except (KeyError, TypeError, ValueError):
+        return len(reader.pages)
+
+
+class PageSource:
+    """One PDF the editor's pages come from, as it was when it was added.
+
+    Its page indices only mean something for that version of the file, so
+    it is looked up again by path only while the file is unchanged.
+    """
+    __slots__ = ('path', 'name', 'page_count', 'key', '_reader')
+
+    def __init__(self, path, reader=None, name=None, page_count=None):
+        self.path = path
+        self.name = name
+        self.key = file_key(path)
+        self._reader = reader
+        # A known page count (from an edit journal) saves parsing the file until its pages are needed
+        self.page_count = count_pages(self.reader) if page_count is None else page_count
+
+    def check_unchanged(self):
+        """Raise ValueError if the file has been rewritten since it was added."""
+        try:
+            unchanged = file_key(self.path) == self.key
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            raise ValueError(f"'{self.path}' has changed since it was opened; open it again.")
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self.check_unchanged()
+            self._reader = reader_pool.get(self.path)
+        return self._reader
+
+
+class PageList:
+    """Ordered pages of the document being edited.
+
+    Source 0 is the opened document; every other source was added from
+    another PDF. Each entry also has a stable id that survives reordering,
+    and a deleted flag so the list stays aligned with the rows shown in
+    the editor until the deletions are saved.
+    """
+
+    def __init__(self):
+        self.sources = []
+        self.source_ids = array('i')
+        self.page_indices = array('i')
+        self.page_ids = array('q')
+        self.deleted = bytearray()
+        self._next_id = 0
+
+    def add_source(self, path, reader=None, name=None, page_count=None):
+        self.sources.append(PageSource(path, reader=reader, name=name, page_count=page_count))
+        return len(self.sources) - 1
+
+    def append_source_pages(self, source_id):
+        """Append every page of a source, in order, and return how many were added."""
+        page_count = self.sources[source_id].page_count
+        self.source_ids.extend(repeat(source_id, page_count))
+        self.page_indices.extend(range(page_count))
+        self.page_ids.extend(range(self._next_id, self._next_id + page_count))
+        self.deleted.extend(bytes(page_count))
+        self._next_id += page_count
+        return page_count
+
+    def __len__(self):
+        return len(self.page_indices)
+
+    def __getitem__(self, position):
+        return self.source_ids[position], self.page_indices[position]
+
+    def append(self, source_id, page_index):
+        self.insert(len(self), source_id, page_index)
+
+    def insert(self, position, source_id, page_index, page_id=None, deleted=False):
+        if page_id is None:
+            page_id = self._next_id
+            self._next_id += 1
+        self.source_ids.insert(position, source_id)
+        self.page_indices.insert(position, page_index)
+        self.page_ids.insert(position, page_id)
+        self.deleted.insert(position, deleted)
+        return page_id
+
+    def pop(self, position):
+        """Remove the entry at position and return (source id, page index, page id, deleted)."""
+        return (self.source_ids.pop(position), self.page_indices.pop(position),
+                self.page_ids.pop(position), bool(self.deleted.pop(position)))
+
+    def move(self, old_position, new_position):
+        """Move one entry, rotating only the entries between the two positions."""
+        for values in (self.source_ids, self.page_indices, self.page_ids, self.deleted):
+            if old_position < new_position:
+                values[old_position:new_position + 1] = values[old_position + 1:new_position + 1] + values[old_position:old_position + 1]
+            elif new_position < old_position:
+                values[new_position:old_position + 1] = values[old_position:old_position + 1] + values[new_position:old_position]
+
+    def position_of(self, page_id):
+        return self.page_ids.index(page_id)
+
+    def clear(self):
+        del self.source_ids[:]
+        del self.page_indices[:]
+        del self.page_ids[:]
+        del self.deleted[:]
+
+    def is_original(self, position):
+        return self.source_ids[position] == 0
+
+    def mark_deleted(self, position):
+        self.deleted[position] = 1
+
+    def unmark_deleted(self, position):
+        self.deleted[position] = 0
+
+    def truncate(self, length):
+        """Drop every entry from position length on."""
+        for values in (self.source_ids, self.page_indices, self.page_ids, self.deleted):
+            del values[length:]
+
+    def purge_deleted(self):
+        """Drop the entries marked as deleted and return how many there were."""
+        positions = [position for position, flag in enumerate(self.deleted) if flag]
+        for position in reversed(positions):
+            self.pop(position)
+        return len(positions)
+
+    def label(self, position):
+        source_id, page_index = self[position]
+        if source_id == 0:
+            label = f"Original Page {page_index + 1}"
+        else:
+            label = f"Added Page from {self.sources[source_id].name} - Page {page_index + 1}"
+        return f"{label} - Deleted" if self.deleted[position] else label
+
+    def labels(self, start=0, end=None):
+        return [self.label(position) for position in range(start, len(self) if end is None else end)]
+
+    def resolve(self, position):
+        """Look up the page object at a position in its source reader."""
+        source_id, page_index = self[position]
+        return self.sources[source_id].reader.pages[page_index]
+
+    def snapshot(self, positions=None):
+        """(source, page index) pairs for positions, or every page not deleted, in order.
+
+        The snapshot doesn't change when the list is edited afterwards, so
+        it can be resolved with resolve_snapshot() on another thread.
+        """
+        if positions is None:
+            positions = [position for position, flag in enumerate(self.deleted) if not flag]
+        return [(self.sources[self.source_ids[position]], self.page_indices[position]) for position in positions]
+
+    @staticmethod
+    def resolve_snapshot(entries):
+        for source, page_index in entries:
+            yield source.reader.pages[page_index]
+
+    def resolve_all(self, positions=None):
+        """Yield page objects in order, skipping deleted entries when no positions are given."""
+        if positions is None:
+            positions = [position for position, flag in enumerate(self.deleted) if not flag]
+        for position in positions:
+            yield self.resolve(position)
@@ -0,0 +1,69 @@
+"""The one PDF library behind every operation.
+
+Modules that parse or write PDF objects import them from here rather
+than from the library directly, so the editor, stamping, merging and
+splitting all share a single parser and only one is ever loaded.
+
+Sources are opened through a read-only memory map rather than read into
+memory: the parser reads straight from the page cache, parts of a file
+it never reaches are never loaded, and a file that is both open in the
+editor and being stamped is held in memory once, shared by every reader
+and worker process. Because a mapped file must not be truncated while
+a reader uses it, outputs are written through open_output(), which
+renames a finished temporary file into place.
+"""
+import mmap
+import os
+from contextlib import contextmanager
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject,
+                           NameObject, NullObject, NumberObject, StreamObject)
+
+from instrument import count, span
+
+__all__ = [
+    'map_file', 'open_output', 'open_reader', 'PdfReader', 'PdfWriter',
+    'ArrayObject', 'DecodedStreamObject', 'DictionaryObject', 'FloatObject', 'IndirectObject',
+    'NameObject', 'NullObject', 'NumberObject', 'StreamObject',
+]
+
+# Windows can't replace or delete a file while it is mapped, which saving over an open document needs
+MAP_INPUTS = os.name != 'nt'
+
+
+def map_file(path):
+    """A read-only memory map of path, or None when it can't be mapped (an empty file, a pipe)."""
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+
+def open_reader(path, mapped=MAP_INPUTS):
+    """Parse the PDF at path, timed as a reader.open span.
+
+    With mapped, the reader parses a memory map of the file (see map_file);
+    otherwise, or when mapping fails, the whole file is read into memory.
+    """
+    with span('reader.open', path=os.path.basename(path), mapped=mapped):
+        count('bytes_read', os.path.getsize(path))
+        source = map_file(path) if mapped else None
+        return PdfReader(source if source is not None else path)
+
+
+@contextmanager
+def open_output(path):
+    """Open path for writing as a temporary file that replaces path once the block completes.
+
+    Writing in place would truncate a file that a reader may still have mapped.
+    """
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
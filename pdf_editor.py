@@ -2,12 +2,25 @@ import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 from tkinter import ttk
-from pypdf import PdfReader, PdfWriter
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.pdfgen import canvas
-from reportlab.lib.colors import red, black, blue
-from PyPDF2 import PdfReader as PyPDF2Reader, PdfWriter as PyPDF2Writer
-import tempfile
+import backends
+import incremental
+from jobs import JobRunner, partial_path
+from journal import EditJournal
+import optimize
+from page_model import PageList, count_pages
+import page_hashes
+from reader_pool import ui_reader_pool
+import splitting
+from thumbnails import ThumbnailGrid
+import stamping
+from text_index import TextIndexer
+
+def optimize_output(path, enabled):
+    # Optional size optimization once an output is written; returns a note for the success message
+    if not enabled:
+        return ""
+    return f"\n\nOutput {optimize.describe(optimize.optimize_pdf(path))}."
+
 
 class PDFApp(tk.Tk):
     def __init__(self):
@@ -34,25 +47,36 @@ class PDFApp(tk.Tk):
                   background=[('active', '#87CEFA')],  # Slightly darker light blue on hover
                   foreground=[('active', 'black')])
 
+        # Status bar for long operations, which run in the background
+        self.jobs = JobRunner(self)
+        self.jobs.pack(side=tk.BOTTOM, fill=tk.X)
+
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(expand=True, fill='both')
 
-        self.pdf_editor_tab = PDFEditorTab(self.notebook)
-        self.portrait_tab = PortraitModeTab(self.notebook)
-        self.landscape_tab = LandscapeModeTab(self.notebook)
+        self.pdf_editor_tab = PDFEditorTab(self.notebook, self.jobs)
+        self.portrait_tab = PortraitModeTab(self.notebook, self.jobs)
+        self.landscape_tab = LandscapeModeTab(self.notebook, self.jobs)
 
         self.notebook.add(self.pdf_editor_tab, text='PDF Editor')
         self.notebook.add(self.portrait_tab, text='Portrait Mode')
         self.notebook.add(self.landscape_tab, text='Landscape Mode')
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        # A normal exit abandons unsaved edits; only a crash leaves their journal to be replayed
+        self.pdf_editor_tab.journal.discard()
+        self.destroy()
+
 
 class PDFEditorTab(ttk.Frame):
-    def __init__(self, parent):
+    def __init__(self, parent, jobs):
         super().__init__(parent)
+        self.jobs = jobs
         self.reader = None
-        self.pages_to_keep = []  # List of original page indices to keep
-        self.additional_pages = []  # List of added pages from other PDFs
-        self.current_pages = []  # Unified list to manage ordering
+        self.pages = PageList()  # (source, page index) pairs in the current order
+        self.journal = EditJournal(self.pages)  # every edit goes through here, for undo and redo
         self.style = ttk.Style()
         self.style.configure("Treeview", rowheight=25)
 
@@ -63,15 +87,33 @@ class PDFEditorTab(ttk.Frame):
         ttk.Button(button_frame, text="Open PDF", style='LightBlue.TButton', command=self.open_pdf).grid(row=0, column=0, padx=5, pady=5)
         ttk.Button(button_frame, text="Merge PDFs", style='LightBlue.TButton', command=self.merge_pdfs).grid(row=0, column=1, padx=5, pady=5)
         ttk.Button(button_frame, text="Split PDF", style='LightBlue.TButton', command=self.split_pdf).grid(row=0, column=2, padx=5, pady=5)
+        ttk.Button(button_frame, text="Undo", style='LightBlue.TButton', command=self.undo).grid(row=0, column=3, padx=5, pady=5)
+        ttk.Button(button_frame, text="Redo", style='LightBlue.TButton', command=self.redo).grid(row=0, column=4, padx=5, pady=5)
 
         # Instructional Label
         instruction_label = ttk.Label(self, text="Click on a page to drag and drop to edit the order of pages.", font=("Helvetica", 10, "italic"))
         instruction_label.pack(pady=(10, 0))  # Add some padding above the label
 
+        # Find pages by their text; every PDF in the list is indexed in the background
+        search_frame = ttk.Frame(self)
+        search_frame.pack(pady=(5, 0))
+        ttk.Label(search_frame, text="Find text:").grid(row=0, column=0, padx=5)
+        self.search_entry = ttk.Entry(search_frame, width=40)
+        self.search_entry.grid(row=0, column=1, padx=5)
+        self.search_entry.bind('<Return>', self.select_matches)
+        ttk.Button(search_frame, text="Select Matching Pages", style='LightBlue.TButton', command=self.select_matches).grid(row=0, column=2, padx=5)
+        self.search_status = ttk.Label(search_frame, text="")
+        self.search_status.grid(row=0, column=3, padx=5)
+        self.text_index = TextIndexer(self, on_update=self.show_index_status)
+
         # Create a frame to hold the Listbox and Scrollbar
         self.pages_frame = ttk.Frame(self)
         self.pages_frame.pack(fill=tk.BOTH, expand=True, pady=5, padx=10)
 
+        # Thumbnails of the pages in their current order, rendered only while scrolled into view
+        self.thumbnails = ThumbnailGrid(self.pages_frame, self.pages, on_select=self.select_page)
+        self.thumbnails.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0))
+
         # Create the Listbox
         self.pages_list = tk.Listbox(self.pages_frame, selectmode=tk.MULTIPLE)
         self.pages_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -79,7 +121,10 @@ class PDFEditorTab(ttk.Frame):
         # Enable drag-and-drop
         self.pages_list.bind('<Button-1>', self.on_click)
         self.pages_list.bind('<B1-Motion>', self.on_drag)
-        self.drag_data = {"item": None}
+        self.drag_data = {"item": None, "drag": None}
+        self.pages_list.bind('<Control-z>', self.undo)
+        self.pages_list.bind('<Control-y>', self.redo)
+        self.pages_list.bind('<Control-Z>', self.redo)
 
         # Create the Scrollbar
         self.scrollbar = ttk.Scrollbar(self.pages_frame, orient=tk.VERTICAL, command=self.pages_list.yview)
@@ -97,14 +142,63 @@ class PDFEditorTab(ttk.Frame):
         ttk.Button(operation_frame, text="Extract Selected Pages", style='LightBlue.TButton', command=self.extract_pages).grid(row=0, column=2, padx=5, pady=5)
         ttk.Button(operation_frame, text="Save PDF", style='LightBlue.TButton', command=self.save_pdf).grid(row=0, column=3, padx=5, pady=5)
 
+        # Deduplicate objects and compress content streams after saving, extracting or merging
+        self.optimize_size = tk.BooleanVar()
+        ttk.Checkbutton(operation_frame, text="Optimize file size", variable=self.optimize_size).grid(row=0, column=4, padx=5, pady=5)
+
+        # Save reordered and deleted pages of the opened file by appending an update instead of rewriting it
+        self.append_changes = tk.BooleanVar(value=True)
+        ttk.Checkbutton(operation_frame, text="Fast save (append changes)", variable=self.append_changes).grid(row=1, column=4, padx=5, pady=5)
+
+        # Pages whose content repeats an earlier page: select them in the list, or leave them out of merges
+        ttk.Button(operation_frame, text="Select Duplicate Pages", style='LightBlue.TButton', command=self.select_duplicates).grid(row=1, column=0, padx=5, pady=5)
+        self.skip_duplicates = tk.BooleanVar()
+        ttk.Checkbutton(operation_frame, text="Skip duplicate pages when merging", variable=self.skip_duplicates).grid(row=1, column=1, columnspan=2, padx=5, pady=5)
+
+        # PDF engine used for saving, extracting, merging and stamping
+        ttk.Label(operation_frame, text="Engine:").grid(row=0, column=5, padx=(5, 0), pady=5)
+        self.backend_name = tk.StringVar(value=backends.default_backend_name())
+        backend_box = ttk.Combobox(operation_frame, textvariable=self.backend_name, values=backends.available_backends(),
+                                   state='readonly', width=10)
+        backend_box.grid(row=0, column=6, padx=5, pady=5)
+        backend_box.bind('<<ComboboxSelected>>', lambda event: backends.set_default(self.backend_name.get()))
+
     def open_pdf(self):
         file_path = filedialog.askopenfilename(title="Select PDF file", filetypes=[("PDF Files", "*.pdf")])
         if file_path:
-            self.reader = PdfReader(file_path)
-            self.pages_to_keep = list(range(len(self.reader.pages)))
-            self.additional_pages = []
-            self.current_pages = [{'type': 'original', 'page_num': i, 'page': self.reader.pages[i]} for i in self.pages_to_keep]
-            self.load_pages()
+            self.load_document(file_path)
+
+    def load_document(self, file_path):
+        # Open the new PDF before letting go of the current one, which stays as it was if this fails
+        try:
+            # The window's own reader: background jobs read the document through reader_pool
+            reader = ui_reader_pool.get(file_path)
+            page_count = count_pages(reader)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to open PDF: {e}")
+            return
+        self.journal.discard()
+        self.reader = reader
+        self.pages = PageList()
+        self.pages.append_source_pages(self.pages.add_source(file_path, page_count=page_count))
+        self.journal = EditJournal(self.pages, file_path)
+        if self.journal.recoverable() and messagebox.askyesno(
+                "Restore Edits", "This PDF has unsaved edits from a session that didn't close normally. Restore them?"):
+            try:
+                self.journal.replay()
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to restore the edits: {e}")
+                self.pages = PageList()
+                self.pages.append_source_pages(self.pages.add_source(file_path, page_count=page_count))
+                self.journal = EditJournal(self.pages, file_path)
+                self.journal.start()
+        else:
+            self.journal.start()
+        for source in self.pages.sources:
+            self.text_index.add(source.path)
+        self.show_index_status()
+        self.thumbnails.clear()
+        self.load_pages()
 
     def load_pages(self):
         try:
@@ -112,11 +206,8 @@ class PDFEditorTab(ttk.Frame):
                 raise Exception("No PDF file is loaded.")
             
             self.pages_list.delete(0, tk.END)
-            for page in self.current_pages:
-                if page['type'] == 'original':
-                    self.pages_list.insert(tk.END, f"Original Page {page['page_num'] +1}")
-                elif page['type'] == 'added':
-                    self.pages_list.insert(tk.END, f"Added Page from {page['source']} - Page {page['page_num']}")
+            self.pages_list.insert(tk.END, *self.pages.labels())
+            self.thumbnails.set_pages(self.pages)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load PDF: {e}")
 
@@ -126,26 +217,10 @@ class PDFEditorTab(ttk.Frame):
             messagebox.showinfo("Info", "Please select one or more pages to delete.")
             return
 
-        # Identify original pages to delete before modifying the listbox
-        original_selected = [
-            idx for idx in selected_pages
-            if self.current_pages[idx]['type'] == 'original'
-        ]
-
-        if not original_selected:
-            messagebox.showinfo("Info", "Please select one or more original pages to delete.")
-            return
-
-        # Remove selected original pages from pages_to_keep and current_pages
-        pages_to_remove = sorted(original_selected, reverse=True)
-        for idx in pages_to_remove:
-            # Mark as deleted in the Listbox
-            entry = self.pages_list.get(idx)
-            self.pages_list.delete(idx)
-            self.pages_list.insert(idx, f"{entry} - Deleted")
-            # Remove from current_pages
-            self.current_pages.pop(idx)
-            self.pages_to_keep.pop(idx)
+        # Mark the selected pages, original or added, as deleted; they are dropped when the document is saved
+        for idx in self.journal.delete(selected_pages):
+            self.relabel(idx)
+        self.thumbnails.refresh()
 
         messagebox.showinfo("Success", "Pages marked for deletion. Save the document to apply changes.")
 
@@ -154,17 +229,12 @@ class PDFEditorTab(ttk.Frame):
         if new_pdfs:
             try:
                 for pdf_path in new_pdfs:
-                    new_reader = PdfReader(pdf_path)
-                    for i in range(len(new_reader.pages)):
-                        page_info = {
-                            'type': 'added',
-                            'source': os.path.basename(pdf_path),
-                            'page_num': i + 1,
-                            'page': new_reader.pages[i]
-                        }
-                        self.additional_pages.append(page_info)
-                        self.current_pages.append(page_info)
-                        self.pages_list.insert(tk.END, f"Added Page from {os.path.basename(pdf_path)} - Page {i+1}")
+                    start = self.journal.add_source(pdf_path, name=os.path.basename(pdf_path),
+                                                    page_count=count_pages(ui_reader_pool.get(pdf_path)))
+                    self.pages_list.insert(tk.END, *self.pages.labels(start))
+                    self.text_index.add(pdf_path)
+                self.show_index_status()
+                self.thumbnails.refresh()
                 messagebox.showinfo("Success", f"Pages from {len(new_pdfs)} PDF(s) added successfully.")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load additional PDFs: {e}")
@@ -175,168 +245,295 @@ class PDFEditorTab(ttk.Frame):
             messagebox.showinfo("Info", "Please select one or more pages to extract.")
             return
 
-        pages_to_extract = []
-        for idx in selected_indices:
-            page = self.current_pages[idx]['page']
-            pages_to_extract.append(page)
+        pages_to_extract = self.pages.snapshot(idx for idx in selected_indices if not self.pages.deleted[idx])
 
         if not pages_to_extract:
             messagebox.showinfo("Info", "No valid pages selected to extract.")
             return
 
-        writer = PdfWriter()
-        for page in pages_to_extract:
-            writer.add_page(page)
-
         output_filename = filedialog.asksaveasfilename(defaultextension=".pdf",
                                                        filetypes=[("PDF Files", "*.pdf")],
                                                        title="Save Extracted Pages As")
         if output_filename:
-            try:
-                with open(output_filename, "wb") as output_file:
-                    writer.write(output_file)
-                messagebox.showinfo("Success", f"Extracted pages saved as '{output_filename}'.")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to save the extracted pages: {e}")
+            optimize_size = self.optimize_size.get()
+            backend = backends.get_backend()
 
-    def save_pdf(self):
-        try:
-            if self.reader is None:
-                raise Exception("No PDF file is loaded.")
-            
-            writer = PdfWriter()
+            def extract(progress):
+                backend.write(backend.snapshot_pages(pages_to_extract), partial_path(output_filename), progress=progress)
+                return optimize_output(partial_path(output_filename), optimize_size)
 
-            # Add pages in the order of current_pages
-            for page_info in self.current_pages:
-                writer.add_page(page_info['page'])
+            self.jobs.start(
+                "Extracting pages",
+                extract,
+                outputs=[output_filename],
+                on_done=lambda note: messagebox.showinfo("Success", f"Extracted pages saved as '{output_filename}'.{note}"),
+                error_message="Failed to save the extracted pages"
+            )
 
-            output_filename = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF Files", "*.pdf")],
-                                                           title="Save PDF As")
-            
-            if output_filename:
-                with open(output_filename, "wb") as output_file:
-                    writer.write(output_file)
+    def save_pdf(self):
+        if self.reader is None:
+            messagebox.showerror("Error", "Failed to save the file: No PDF file is loaded.")
+            return
 
-                messagebox.showinfo("Success", f"File saved as '{output_filename}' with the selected changes applied.")
-                self.load_pages()  # Reload pages to reflect any deletions
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save the file: {e}")
+        # Take the current order now; pages are looked up and written on the worker thread
+        pages_to_save = self.pages.snapshot()
+
+        output_filename = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF Files", "*.pdf")],
+                                                       title="Save PDF As")
+        if output_filename:
+            optimize_size = self.optimize_size.get()
+            backend = backends.get_backend()
+            # Optimizing rewrites the whole file anyway
+            source = None
+            if self.append_changes.get() and not optimize_size and pages_to_save:
+                source = incremental.updatable_source(pages_to_save, reader=ui_reader_pool.get(pages_to_save[0][0].path))
+            in_place = source is not None and os.path.exists(output_filename) and os.path.samefile(source.path, output_filename)
+            # Saving over any open source, either way, leaves the page list pointing into the old file
+            overwrites_source = os.path.exists(output_filename) and any(
+                os.path.exists(page_source.path) and os.path.samefile(page_source.path, output_filename)
+                for page_source in self.pages.sources)
+
+            def save(progress):
+                if source is not None:
+                    # Saving over the source appends to it directly; a failed or cancelled save cuts it back
+                    target = output_filename if in_place else partial_path(output_filename)
+                    incremental.save_incremental(source.path, source.reader, [page_index for _, page_index in pages_to_save],
+                                                 target, progress=progress)
+                    return ""
+                backend.write(backend.snapshot_pages(pages_to_save), partial_path(output_filename), progress=progress)
+                return optimize_output(partial_path(output_filename), optimize_size)
+
+            def saved(note):
+                messagebox.showinfo("Success", f"File saved as '{output_filename}' with the selected changes applied.{note}")
+                if overwrites_source:
+                    # Reopen the saved file: its pages are what the list showed, and the next save can append to it
+                    self.load_document(output_filename)
+                else:
+                    self.journal.purge()
+                    self.load_pages()  # Reload pages to reflect any deletions
+
+            self.jobs.start(
+                "Saving",
+                save,
+                outputs=[] if in_place else [output_filename],
+                on_done=saved,
+                error_message="Failed to save the file"
+            )
 
     def merge_pdfs(self):
         pdf_files = filedialog.askopenfilenames(title="Select PDFs to Merge", filetypes=[("PDF Files", "*.pdf")])
         if pdf_files:
-            try:
-                merger = PdfWriter()
-                for pdf in pdf_files:
-                    reader = PdfReader(pdf)
-                    for page in reader.pages:
-                        merger.add_page(page)
-                output_filename = filedialog.asksaveasfilename(defaultextension=".pdf",
-                                                               filetypes=[("PDF Files", "*.pdf")],
-                                                               title="Save Merged PDF As")
-                if output_filename:
-                    with open(output_filename, "wb") as f:
-                        merger.write(f)
-                    messagebox.showinfo("Success", f"Merged PDF saved as '{output_filename}'.")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to merge PDFs: {e}")
+            output_filename = filedialog.asksaveasfilename(defaultextension=".pdf",
+                                                           filetypes=[("PDF Files", "*.pdf")],
+                                                           title="Save Merged PDF As")
+            if output_filename:
+                optimize_size = self.optimize_size.get()
+                skip_duplicates = self.skip_duplicates.get()
+                backend = backends.get_backend()
+
+                def merge(progress):
+                    skip, note = None, ""
+                    if skip_duplicates:
+                        duplicates = page_hashes.find_duplicates(pdf_files, progress=progress)
+                        skip, note = duplicates['skip'], f"\n\n{page_hashes.describe(duplicates)}"
+                    # The pypdf engine streams one input at a time so large merges don't hold every page in memory
+                    backend.merge(pdf_files, partial_path(output_filename), progress=progress, skip=skip)
+                    return note + optimize_output(partial_path(output_filename), optimize_size)
+
+                self.jobs.start(
+                    "Merging",
+                    merge,
+                    outputs=[output_filename],
+                    on_done=lambda note: messagebox.showinfo("Success", f"Merged PDF saved as '{output_filename}'.{note}"),
+                    error_message="Failed to merge PDFs"
+                )
+
+    def select_duplicates(self):
+        if self.reader is None:
+            messagebox.showerror("Error", "No PDF file is loaded.")
+            return
+
+        # Page ids rather than positions, in case the list is edited while the pages are hashed
+        entries = [(self.pages.page_ids[position], self.pages.sources[source_id].path, page_index)
+                   for position, (source_id, page_index) in enumerate(self.pages) if not self.pages.deleted[position]]
+
+        def find(progress):
+            fingerprints, documents = page_hashes.fingerprint_files([path for _, path, _ in entries], progress=progress)
+            seen = set()
+            duplicates = []
+            for page_id, path, page_index in entries:
+                if fingerprints[path][page_index] in seen:
+                    duplicates.append(page_id)
+                seen.add(fingerprints[path][page_index])
+            return duplicates, documents
+
+        def found(result):
+            duplicates, documents = result
+            positions = {page_id: position for position, page_id in enumerate(self.pages.page_ids)}
+            self.pages_list.selection_clear(0, tk.END)
+            for page_id in duplicates:
+                if page_id in positions:
+                    self.pages_list.selection_set(positions[page_id])
+            costs = "\n".join(f"{os.path.basename(document['path'])}: {document['pages']} pages, "
+                              + ("cached" if document['cached'] else f"hashed in {document['seconds']:.2f}s")
+                              for document in documents)
+            messagebox.showinfo("Duplicate Pages", f"{len(duplicates)} page(s) repeat an earlier page and are now selected; "
+                                                   f"Delete Selected Pages removes them.\n\n{costs}")
+
+        self.jobs.start("Finding duplicate pages", find, on_done=found,
+                        error_message="Failed to find duplicate pages")
 
     def split_pdf(self):
         if self.reader is None:
             messagebox.showerror("Error", "No PDF file is loaded.")
             return
 
-        page_ranges_str = simpledialog.askstring("Split PDF", "Enter page ranges to split (e.g., 1-3,5,7-9):")
+        page_ranges_str = simpledialog.askstring("Split PDF", "Enter page ranges to split (e.g., 1-3,5,7-9), 'every N' or 'bookmarks':")
         if not page_ranges_str:
             return
 
+        source_path = self.pages.sources[0].path
         try:
-            ranges = self.parse_page_ranges(page_ranges_str)
-            for idx, (start, end) in enumerate(ranges, 1):
-                writer = PdfWriter()
-                for page_num in range(start-1, end):
-                    if page_num < len(self.reader.pages):
-                        writer.add_page(self.reader.pages[page_num])
-                    else:
-                        raise Exception(f"Page number {page_num +1} exceeds the total number of pages.")
-                output_filename = filedialog.asksaveasfilename(defaultextension=".pdf",
-                                                               filetypes=[("PDF Files", "*.pdf")],
-                                                               title=f"Save Split PDF {idx} As")
-                if output_filename:
-                    with open(output_filename, "wb") as f:
-                        writer.write(f)
-            messagebox.showinfo("Success", "PDF split successfully.")
+            ranges = splitting.split_ranges(page_ranges_str, self.reader)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to split PDF: {e}")
+            return
+
+        # One folder for all the parts, named from the source file and part number
+        output_dir = filedialog.askdirectory(title="Save Split PDFs To")
+        if not output_dir:
+            return
+        output_paths = splitting.output_names(splitting.DEFAULT_TEMPLATE, ranges, source_path, directory=output_dir)
+
+        self.jobs.start(
+            "Splitting",
+            lambda progress: splitting.split_pdf(source_path, ranges, [partial_path(path) for path in output_paths], progress=progress),
+            outputs=output_paths,
+            on_done=lambda pages: messagebox.showinfo("Success", f"PDF split into {len(output_paths)} files in '{output_dir}'."),
+            error_message="Failed to split PDF"
+        )
 
     def parse_page_ranges(self, ranges_str):
-        ranges = []
-        parts = ranges_str.split(',')
-        for part in parts:
-            if '-' in part:
-                start, end = part.split('-')
-                start, end = int(start.strip()), int(end.strip())
-                if start > end:
-                    raise ValueError(f"Invalid range: {part}")
-                ranges.append((start, end))
-            else:
-                num = int(part.strip())
-                ranges.append((num, num))
-        return ranges
+        return splitting.parse_page_ranges(ranges_str)
 
     def on_click(self, event):
-        # Record the index of the clicked item
+        # Record the index of the clicked item; the moves of one drag are undone together
         self.drag_data["item"] = self.pages_list.nearest(event.y)
+        self.drag_data["drag"] = self.journal.begin_drag()
 
     def on_drag(self, event):
         # Get the index of the item where the mouse is dragged to
         new_index = self.pages_list.nearest(event.y)
-        if new_index != self.drag_data["item"]:
-            # Get the text of the item to move
-            item_text = self.pages_list.get(self.drag_data["item"])
-            # Remove the item from its original position
-            self.pages_list.delete(self.drag_data["item"])
-            # Insert the item at the new position
-            self.pages_list.insert(new_index, item_text)
+        old_index = self.drag_data["item"]
+        if old_index is not None and new_index != old_index:
+            # Move the one dragged entry in the page order and the Listbox
+            self.journal.move(old_index, new_index, drag=self.drag_data["drag"])
+            self.pages_list.delete(old_index)
+            self.pages_list.insert(new_index, self.pages.label(new_index))
             # Update drag_data to the new position
             self.drag_data["item"] = new_index
+            self.thumbnails.refresh()
+
+    def relabel(self, position):
+        self.pages_list.delete(position)
+        self.pages_list.insert(position, self.pages.label(position))
+
+    def undo(self, event=None):
+        op = self.journal.undo()
+        if op is not None:
+            self.show_change(op, undone=True)
+        return "break"
+
+    def redo(self, event=None):
+        op = self.journal.redo()
+        if op is not None:
+            self.show_change(op, undone=False)
+        return "break"
+
+    def show_change(self, op, undone):
+        # Update only the Listbox rows an undone or redone edit touched
+        kind = op[0]
+        if kind == 'delete':
+            for position in op[1]:
+                self.relabel(position)
+        elif kind == 'add':
+            start = op[2]
+            if undone:
+                self.pages_list.delete(start, tk.END)
+            else:
+                self.pages_list.insert(tk.END, *self.pages.labels(start))
+        elif kind == 'move':
+            old_position, new_position = (op[2], op[1]) if undone else (op[1], op[2])
+            self.pages_list.delete(old_position)
+            self.pages_list.insert(new_position, self.pages.label(new_position))
+        elif kind == 'purge':
+            positions = [entry[0] for entry in op[1]]
+            if undone:
+                for position in positions:
+                    self.pages_list.insert(position, self.pages.label(position))
+            else:
+                for position in reversed(positions):
+                    self.pages_list.delete(position)
+        self.thumbnails.refresh()
+
+    def show_index_status(self):
+        pending = self.text_index.pending()
+        if pending:
+            self.search_status.config(text=f"Indexing {pending} PDF(s)...")
+        elif self.text_index.errors:
+            self.search_status.config(text=f"{len(self.text_index.errors)} PDF(s) couldn't be indexed")
+        else:
+            self.search_status.config(text="")
 
-            # Reorder current_pages based on the new Listbox order
-            self.reorder_current_pages()
-
-    def reorder_current_pages(self):
-        # Reconstruct current_pages based on the current Listbox order
-        new_current_pages = []
-        for idx in range(self.pages_list.size()):
-            entry = self.pages_list.get(idx)
-            if entry.startswith("Original Page") and "Deleted" not in entry:
-                page_num = int(entry.split(" ")[2]) - 1
-                new_current_pages.append({'type': 'original', 'page_num': page_num, 'page': self.reader.pages[page_num]})
-            elif entry.startswith("Added Page"):
-                # Extract source and page_num
-                try:
-                    parts = entry.split(" ")
-                    source = parts[3]
-                    page_num = int(parts[5])
-                    # Find the corresponding added page
-                    for added_page in self.additional_pages:
-                        if added_page['source'] == source and added_page['page_num'] == page_num:
-                            new_current_pages.append(added_page)
-                            break
-                except (IndexError, ValueError):
-                    continue
-            elif "Deleted" in entry:
-                # Skip deleted pages
-                continue
-        self.current_pages = new_current_pages
-
-    # Optional: Implement drag-and-drop for rearranging additional pages as well
-    # This is handled in reorder_current_pages()
+    def select_matches(self, event=None):
+        query = self.search_entry.get()
+        if not query.strip():
+            return
+        matches = self.text_index.search(query)
+        by_source = [matches.get(source.path, ()) for source in self.pages.sources]
+
+        # Select runs of matching rows with one call each; deleted rows are left out
+        self.pages_list.selection_clear(0, tk.END)
+        found = 0
+        first_match = run_start = None
+        for position in range(len(self.pages) + 1):
+            matched = False
+            if position < len(self.pages) and not self.pages.deleted[position]:
+                source_id, page_index = self.pages[position]
+                matched = page_index in by_source[source_id]
+            if matched:
+                found += 1
+                if run_start is None:
+                    run_start = position
+            elif run_start is not None:
+                self.pages_list.selection_set(run_start, position - 1)
+                if first_match is None:
+                    first_match = run_start
+                run_start = None
+        if first_match is not None:
+            self.pages_list.see(first_match)
+
+        note = f"{found} page(s) match"
+        if self.text_index.pending():
+            note += f"; still indexing {self.text_index.pending()} PDF(s)"
+        self.search_status.config(text=note)
+
+    def destroy(self):
+        self.text_index.shutdown()
+        super().destroy()
+
+    def select_page(self, position):
+        # Select the Listbox row of a clicked thumbnail
+        self.pages_list.selection_set(position)
+        self.pages_list.see(position)
 
 
 class PortraitModeTab(ttk.Frame):
-    def __init__(self, parent):
+    orientation = 'portrait'
+
+    def __init__(self, parent, jobs):
         super().__init__(parent)
+        self.jobs = jobs
         self.init_ui()
 
     def init_ui(self):
@@ -364,6 +561,7 @@ class PortraitModeTab(ttk.Frame):
         self.text_entry = ttk.Entry(controls_frame, width=30)
         self.text_entry.pack(pady=2)
         self.text_entry.bind('<KeyRelease>', self.update_canvas_text)
+        ttk.Label(controls_frame, text="{page}, {pages}, {bates} and {doc_id} are filled in per page").pack(pady=2)
 
         ttk.Label(controls_frame, text="Enter font size:").pack(pady=2)
         self.font_size_entry = ttk.Entry(controls_frame, width=10)
@@ -381,6 +579,9 @@ class PortraitModeTab(ttk.Frame):
         self.underline = tk.BooleanVar()
         ttk.Checkbutton(controls_frame, text="Underline", variable=self.underline, command=self.update_canvas_text).pack(pady=2)
 
+        self.optimize_size = tk.BooleanVar()
+        ttk.Checkbutton(controls_frame, text="Optimize file size", variable=self.optimize_size).pack(pady=2)
+
         # Apply the LightBlue.TButton style to these buttons
         ttk.Button(controls_frame, text="Update Position", style='LightBlue.TButton', command=self.update_position).pack(pady=2)
         ttk.Button(controls_frame, text="45 Degrees", style='LightBlue.TButton', command=lambda: self.process_text_overlay(angle=45)).pack(pady=2)
@@ -435,6 +636,11 @@ class PortraitModeTab(ttk.Frame):
         if not text:
             messagebox.showerror("Input Error", "Please enter the text for the stamp.")
             return
+        try:
+            stamping.template_fields(text)
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e))
+            return
 
         try:
             font_size = int(font_size)
@@ -452,77 +658,41 @@ class PortraitModeTab(ttk.Frame):
         if not output_pdf_path:
             return
 
-        self.add_text_to_existing_pdf(
-            base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos,
-            angle=angle, orientation='portrait', color=selected_color, underline=underline
+        optimize_size = self.optimize_size.get()
+
+        def stamp(progress):
+            self.add_text_to_existing_pdf(
+                base_pdf_path, text, partial_path(output_pdf_path), font_size, x_pos, y_pos,
+                angle=angle, orientation=self.orientation, color=selected_color, underline=underline, progress=progress
+            )
+            return optimize_output(partial_path(output_pdf_path), optimize_size)
+
+        self.jobs.start(
+            "Stamping",
+            stamp,
+            outputs=[output_pdf_path],
+            on_done=lambda note: messagebox.showinfo("Success", f"PDF with text stamp saved successfully!{note}"),
+            error_message="Failed to stamp the PDF"
         )
 
-        messagebox.showinfo("Success", "PDF with text stamp saved successfully!")
-
-    def add_text_to_existing_pdf(self, base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False):
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-            temp_pdf_path = temp_pdf.name
-            self.create_text_overlay(temp_pdf_path, text, font_size, x_pos, y_pos, angle=angle, orientation=orientation, color=color, underline=underline)
-
-        reader_base = PyPDF2Reader(base_pdf_path)
-        reader_stamp = PyPDF2Reader(temp_pdf_path)
-        writer = PyPDF2Writer()
-
-        stamp_page = reader_stamp.pages[0]
-
-        for base_page in reader_base.pages:
-            base_page.merge_page(stamp_page)
-            writer.add_page(base_page)
-
-        with open(output_pdf_path, 'wb') as f:
-            writer.write(f)
-
-        os.remove(temp_pdf_path)
-
-    def create_text_overlay(self, temp_pdf_path, text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False):
-        page_size = letter if orientation == 'portrait' else landscape(letter)
-        page_width, page_height = page_size
-
-        c = canvas.Canvas(temp_pdf_path, pagesize=page_size)
-        c.setFont("Helvetica-Bold", font_size)
-
-        color_dict = {'red': red, 'blue': blue, 'black': black}
-        text_color = color_dict.get(color, red)
-
-        c.setFillColor(text_color)
-        c.setStrokeColor(text_color)
-
-        adjusted_y_pos = y_pos
-        ascent = font_size * 0.8
-
-        if adjusted_y_pos + ascent > page_height:
-            adjusted_y_pos = page_height - ascent
-        elif adjusted_y_pos - font_size * 0.2 < 0:
-            adjusted_y_pos = font_size * 0.2
-
-        if angle is not None:
-            c.saveState()
-            c.translate(x_pos, adjusted_y_pos)
-            c.rotate(angle)
-            c.drawCentredString(0, 0, text)
-            text_width = c.stringWidth(text, "Helvetica-Bold", font_size)
-            if underline:
-                c.setLineWidth(1)
-                c.line(-text_width / 2, -2, text_width / 2, -2)
-            c.restoreState()
-        else:
-            c.drawCentredString(x_pos, adjusted_y_pos, text)
-            text_width = c.stringWidth(text, "Helvetica-Bold", font_size)
-            if underline:
-                c.setLineWidth(1)
-                c.line(x_pos - text_width / 2, adjusted_y_pos - 2, x_pos + text_width / 2, adjusted_y_pos - 2)
+    def add_text_to_existing_pdf(self, base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, progress=None):
+        return stamping.add_text_to_existing_pdf(
+            base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos,
+            angle=angle, orientation=orientation, color=color, underline=underline, progress=progress
+        )
 
-        c.save()
+    def create_text_overlay(self, output, text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, geometry=None):
+        stamping.create_text_overlay(
+            output, text, font_size, x_pos, y_pos,
+            angle=angle, orientation=orientation, color=color, underline=underline, geometry=geometry
+        )
 
 
 class LandscapeModeTab(PortraitModeTab):
-    def __init__(self, parent):
-        super().__init__(parent)
+    orientation = 'landscape'
+
+    def __init__(self, parent, jobs):
+        super().__init__(parent, jobs)
 
     def init_ui(self):
         self.scale_factor = 0.4
@@ -549,6 +719,7 @@ class LandscapeModeTab(PortraitModeTab):
         self.text_entry = ttk.Entry(controls_frame, width=30)
         self.text_entry.pack(pady=2)
         self.text_entry.bind('<KeyRelease>', self.update_canvas_text)
+        ttk.Label(controls_frame, text="{page}, {pages}, {bates} and {doc_id} are filled in per page").pack(pady=2)
 
         ttk.Label(controls_frame, text="Enter font size:").pack(pady=2)
         self.font_size_entry = ttk.Entry(controls_frame, width=10)
@@ -566,6 +737,9 @@ class LandscapeModeTab(PortraitModeTab):
         self.underline = tk.BooleanVar()
         ttk.Checkbutton(controls_frame, text="Underline", variable=self.underline, command=self.update_canvas_text).pack(pady=2)
 
+        self.optimize_size = tk.BooleanVar()
+        ttk.Checkbutton(controls_frame, text="Optimize file size", variable=self.optimize_size).pack(pady=2)
+
         # Apply the LightBlue.TButton style to these buttons
         ttk.Button(controls_frame, text="Update Position", style='LightBlue.TButton', command=self.update_position).pack(pady=2)
         ttk.Button(controls_frame, text="45 Degrees", style='LightBlue.TButton', command=lambda: self.process_text_overlay(angle=45)).pack(pady=2)
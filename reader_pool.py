@@ -0,0 +1,73 @@
+"""Session-wide pool of parsed PDF readers.
+
+Opening the same source again (adding more of its pages, merging it,
+extracting from it) reuses the reader parsed the first time, as long as
+the file's size and modification time are unchanged. Readers are evicted
+least recently used first once their files add up to more than the byte
+budget; a reader maps its file (see pdf_backend.open_reader) and parses
+it as it is used, so file size stands in for what a reader costs.
+
+pypdf readers aren't thread-safe, so the editor's Tk thread reads through
+ui_reader_pool, and reader_pool is left to the background jobs; a job can
+be reading a document while the window looks up the same one.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from pdf_backend import open_reader
+
+DEFAULT_BUDGET_BYTES = 512 * 1024 * 1024
+
+
+def file_key(path):
+    """(absolute path, mtime, size) of a file, which changes whenever the file is rewritten."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class ReaderPool:
+    def __init__(self, max_bytes=DEFAULT_BUDGET_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self._readers = OrderedDict()  # (path, mtime, size) -> reader, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return a reader for path, parsing the file only if it isn't pooled already."""
+        key = file_key(path)
+        with self._lock:
+            if key in self._readers:
+                self.hits += 1
+                self._readers.move_to_end(key)
+                return self._readers[key]
+
+        reader = open_reader(path)
+        with self._lock:
+            if key in self._readers:
+                # Another thread opened it meanwhile; keep the pooled one
+                self.hits += 1
+                return self._readers[key]
+            self.misses += 1
+            self._readers[key] = reader
+            self.total_bytes += key[2]
+            # Never evict the reader just opened, even if it alone is over budget
+            while self.total_bytes > self.max_bytes and len(self._readers) > 1:
+                (_, _, size), _ = self._readers.popitem(last=False)
+                self.total_bytes -= size
+        return reader
+
+    def clear(self):
+        with self._lock:
+            self._readers.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'readers': len(self._readers),
+                'bytes': self.total_bytes, 'max_bytes': self.max_bytes}
+
+
+reader_pool = ReaderPool()
+ui_reader_pool = ReaderPool()
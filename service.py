@@ -0,0 +1,506 @@
+"""Headless service that runs stamping, merging, splitting and extraction jobs.
+
+Jobs arrive as JSON over a small local HTTP API, or as job files dropped
+into hot folders under a root directory:
+
+    python service.py --root jobs --port 8765 --workers 4 --limit merge=2
+
+    POST /jobs/<queue>   queue the JSON body as a job; 202 with its id
+    GET  /jobs/<id>      its state, and its result or error once finished
+    GET  /metrics        queue depth, latency percentiles and pages/s
+
+A file '<root>/<queue>/<name>.json' is the same JSON job (write it under
+another name and rename it, so it isn't read half-written). It is moved to
+'<root>/processing/<queue>/' while it runs, then to '<root>/done/' or
+'<root>/failed/' with '<name>.result.json' beside it. Files found in
+'processing' at start-up, left by a service that stopped, run again.
+
+The queues and their jobs (paths relative to the service's directory):
+
+    stamp    a stamping manifest row: input, output, text, ... (see stamping.py)
+    merge    inputs (a list), output, and optionally skip_duplicates
+    split    source, spec ('1-3,5', 'every N' or 'bookmarks'), and
+             optionally template and output_dir (see splitting.py)
+    extract  input, pages ('1-3,5'), output, and optionally backend
+
+Jobs run on one shared process pool. Each queue runs at most its limit
+of jobs at once and holds at most --queue-size waiting jobs; when one is
+full, POST answers 503 with Retry-After and job files wait in their
+folder until there is room.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import backends
+import merging
+import splitting
+import stamping
+from reader_pool import reader_pool
+
+QUEUES = ('stamp', 'merge', 'split', 'extract')
+
+# Jobs each queue runs at once; merges and splits are long and use the most memory
+DEFAULT_LIMITS = {'stamp': 4, 'merge': 1, 'split': 1, 'extract': 2}
+
+DEFAULT_QUEUE_SIZE = 100
+POLL_SECONDS = 1.0
+LATENCY_SAMPLES = 1000  # most recent jobs per queue the percentiles are taken over
+RATE_WINDOW_SECONDS = 60
+JOB_HISTORY = 10000  # finished jobs kept for GET /jobs/<id>
+MAX_BODY_BYTES = 1024 * 1024
+
+REQUIRED_KEYS = {
+    'stamp': ('input', 'output', 'text'),
+    'merge': ('inputs', 'output'),
+    'split': ('source', 'spec'),
+    'extract': ('input', 'pages', 'output'),
+}
+
+# JSON types each job field may have; numbers may also be given as strings, as in a stamping manifest
+NUMBER = (int, float, str)
+FIELD_TYPES = {
+    'input': str, 'output': str, 'text': str, 'inputs': list, 'source': str, 'spec': str, 'pages': str,
+    'template': str, 'output_dir': str, 'backend': str, 'skip_duplicates': bool,
+    'size': NUMBER, 'x': NUMBER, 'y': NUMBER, 'angle': NUMBER, 'bates_start': NUMBER, 'color': str,
+    'orientation': str, 'underline': (bool, str), 'optimize': (bool, str), 'mode': str, 'doc_id': str,
+}
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def validate_job(queue_name, spec):
+    """Check a job before it is queued and return it with defaults filled in; raises ValueError."""
+    if queue_name not in QUEUES:
+        raise ValueError(f"Unknown queue '{queue_name}'; choose from {', '.join(QUEUES)}")
+    if not isinstance(spec, dict):
+        raise ValueError("A job must be a JSON object")
+    for key in REQUIRED_KEYS[queue_name]:
+        if not spec.get(key):
+            raise ValueError(f"A {queue_name} job needs '{key}'")
+    for key, value in spec.items():
+        if key in FIELD_TYPES and value is not None and not isinstance(value, FIELD_TYPES[key]):
+            raise ValueError(f"'{key}' has the wrong type ({type(value).__name__})")
+    if queue_name == 'stamp':
+        return stamping.normalize_job(spec)
+    if queue_name == 'merge' and (not isinstance(spec['inputs'], list) or not all(isinstance(path, str) for path in spec['inputs'])):
+        raise ValueError("'inputs' must be a list of paths")
+    if queue_name == 'extract':
+        splitting.parse_page_ranges(spec['pages'])
+    return dict(spec)
+
+
+def _run_stamp(spec):
+    result = stamping.run_stamp_job(spec)
+    if result['status'] != 'ok':
+        raise RuntimeError(result['error'])
+    return {'pages': result['pages'], 'outputs': [spec['output']], 'bytes_saved': result['bytes_saved']}
+
+
+def _run_merge(spec):
+    skip = None
+    if spec.get('skip_duplicates'):
+        import page_hashes  # only needed for this option
+        skip = page_hashes.find_duplicates(spec['inputs'], workers=1)['skip']
+    pages = merging.merge_pdfs(spec['inputs'], spec['output'], skip=skip)
+    return {'pages': pages, 'outputs': [spec['output']]}
+
+
+def _run_split(spec):
+    ranges = splitting.split_ranges(spec['spec'], reader_pool.get(spec['source']))
+    output_paths = splitting.output_names(spec.get('template') or splitting.DEFAULT_TEMPLATE, ranges, spec['source'],
+                                          directory=spec.get('output_dir'))
+    for directory in {os.path.dirname(path) for path in output_paths if os.path.dirname(path)}:
+        os.makedirs(directory, exist_ok=True)
+    # One process per job: the service's pool already runs jobs side by side
+    pages = splitting.split_pdf(spec['source'], ranges, output_paths, workers=1)
+    return {'pages': pages, 'outputs': output_paths}
+
+
+def _run_extract(spec):
+    order = [page - 1 for start, end in splitting.parse_page_ranges(spec['pages']) for page in range(start, end + 1)]
+    pages = backends.get_backend(spec.get('backend')).reorder(spec['input'], order, spec['output'])
+    return {'pages': pages, 'outputs': [spec['output']]}
+
+
+RUNNERS = {'stamp': _run_stamp, 'merge': _run_merge, 'split': _run_split, 'extract': _run_extract}
+
+
+def run_job(queue_name, spec):
+    """Run one job and return its result. Runs in a worker process."""
+    start = time.perf_counter()
+    result = RUNNERS[queue_name](spec)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def _ignore_interrupts():
+    # Ctrl+C reaches the workers too; the service shuts them down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class Job:
+    def __init__(self, queue_name, spec, path=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.queue = queue_name
+        self.spec = spec
+        self.path = path  # the job file, for jobs from a hot folder
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    def describe(self):
+        return {'id': self.id, 'queue': self.queue, 'state': self.state, 'submitted': self.submitted,
+                'started': self.started, 'finished': self.finished, 'result': self.result, 'error': self.error}
+
+
+class QueueStats:
+    def __init__(self):
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.pages = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # submitted to finished, seconds
+        self.run_times = deque(maxlen=LATENCY_SAMPLES)  # started to finished, seconds
+        self.recent_pages = deque()  # (finished, pages) within RATE_WINDOW_SECONDS
+
+
+class Service:
+    """The job queues, their consumers on a shared process pool, the hot-folder watcher and the HTTP front end.
+
+    limits maps queue names to the number of jobs they run at once
+    (DEFAULT_LIMITS fills in the rest). Without a root there are no hot
+    folders.
+    """
+
+    def __init__(self, root=None, workers=None, limits=None, queue_size=DEFAULT_QUEUE_SIZE, poll_seconds=POLL_SECONDS):
+        self.root = root
+        self.workers = workers or os.cpu_count()
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.queue_size = queue_size
+        self.poll_seconds = poll_seconds
+        self.queues = {}
+        self.stats = {name: QueueStats() for name in QUEUES}
+        self.jobs = OrderedDict()  # id -> Job, oldest first
+        self.pool = None
+        self.server = None
+        self.tasks = []
+        self.started = None
+
+    # Lifecycle
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """Start the consumers, the watcher and, unless port is None, the HTTP server."""
+        self.started = time.time()
+        # Spawned, not forked: a forked worker would hold open the client sockets of the moment it started
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_ignore_interrupts)
+        self.queues = {name: asyncio.Queue(maxsize=self.queue_size) for name in QUEUES}
+        for name in QUEUES:
+            self.tasks.extend(asyncio.create_task(self._consume(name)) for _ in range(self.limits[name]))
+        if self.root is not None:
+            self._prepare_folders()
+            self.tasks.append(asyncio.create_task(self._watch()))
+        if port is not None:
+            self.server = await asyncio.start_server(self._handle_http, host, port)
+        return self
+
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2] if self.server is not None else None
+
+    async def join(self):
+        """Wait until every job queued so far has finished."""
+        for queue in self.queues.values():
+            await queue.join()
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # Jobs still running finish in the pool; their files stay in 'processing' and run again next time
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    # Jobs
+
+    def submit(self, queue_name, spec, path=None):
+        """Validate and queue a job and return it.
+
+        Raises ValueError for an invalid job and asyncio.QueueFull when
+        the queue has no room.
+        """
+        spec = validate_job(queue_name, spec)
+        job = Job(queue_name, spec, path=path)
+        try:
+            self.queues[queue_name].put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats[queue_name].rejected += 1
+            raise
+        self.jobs[job.id] = job
+        self._forget_old_jobs()
+        return job
+
+    def _forget_old_jobs(self):
+        while len(self.jobs) > JOB_HISTORY:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.finished is None:
+                break
+            self.jobs.popitem(last=False)
+
+    async def _consume(self, queue_name):
+        queue = self.queues[queue_name]
+        stats = self.stats[queue_name]
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await queue.get()
+            job.state = 'running'
+            job.started = time.time()
+            stats.running += 1
+            try:
+                job.result = await loop.run_in_executor(self.pool, run_job, queue_name, job.spec)
+                job.state = 'done'
+            except Exception as e:
+                job.state = 'failed'
+                job.error = f"{type(e).__name__}: {e}"
+            finally:
+                stats.running -= 1
+                queue.task_done()
+            job.finished = time.time()
+            self._record(stats, job)
+            if job.path is not None:
+                self._file_finished(job)
+
+    def _record(self, stats, job):
+        if job.state == 'done':
+            stats.completed += 1
+            stats.pages += job.result['pages']
+            stats.recent_pages.append((job.finished, job.result['pages']))
+        else:
+            stats.failed += 1
+        stats.latencies.append(job.finished - job.submitted)
+        stats.run_times.append(job.finished - job.started)
+
+    # Hot folders
+
+    def _folder(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _prepare_folders(self):
+        for name in QUEUES:
+            os.makedirs(self._folder(name), exist_ok=True)
+            os.makedirs(self._folder('processing', name), exist_ok=True)
+            # Jobs a stopped service was running go back in line
+            for entry in os.scandir(self._folder('processing', name)):
+                if entry.name.endswith('.json'):
+                    os.replace(entry.path, self._folder(name, entry.name))
+        os.makedirs(self._folder('done'), exist_ok=True)
+        os.makedirs(self._folder('failed'), exist_ok=True)
+
+    async def _watch(self):
+        while True:
+            for name in QUEUES:
+                try:
+                    self._claim_files(name)
+                except OSError:
+                    pass  # the folder is being changed under us; try again next time
+            await asyncio.sleep(self.poll_seconds)
+
+    def _claim_files(self, queue_name):
+        queue = self.queues[queue_name]
+        entries = sorted((entry for entry in os.scandir(self._folder(queue_name))
+                          if entry.is_file() and entry.name.endswith('.json')), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if queue.full():
+                return  # backpressure: the rest wait in the folder
+            path = self._folder('processing', queue_name, entry.name)
+            try:
+                os.replace(entry.path, path)
+            except OSError:
+                continue  # being written or removed
+            try:
+                with open(path, encoding='utf-8') as f:
+                    spec = json.load(f)
+                self.submit(queue_name, spec, path=path)
+            except asyncio.QueueFull:
+                os.replace(path, entry.path)  # filled up since the check above; it waits its turn
+                return
+            except Exception as e:
+                # A bad job file goes to 'failed' with its error, so it isn't read again
+                job = Job(queue_name, None, path=path)
+                job.state = 'failed'
+                job.error = f"{type(e).__name__}: {e}"
+                job.finished = time.time()
+                self._file_finished(job)
+
+    def _file_finished(self, job):
+        folder = self._folder('done' if job.state == 'done' else 'failed')
+        name = os.path.basename(job.path)
+        try:
+            os.replace(job.path, os.path.join(folder, name))
+            with open(os.path.join(folder, f"{os.path.splitext(name)[0]}.result.json"), 'w', encoding='utf-8') as f:
+                json.dump(job.describe(), f, indent=2)
+        except OSError:
+            pass
+
+    # Metrics
+
+    def metrics(self):
+        now = time.time()
+        uptime = now - self.started
+        queues = {}
+        for name, stats in self.stats.items():
+            while stats.recent_pages and stats.recent_pages[0][0] < now - RATE_WINDOW_SECONDS:
+                stats.recent_pages.popleft()
+            latencies = sorted(stats.latencies)
+            run_times = sorted(stats.run_times)
+            queues[name] = {
+                'depth': self.queues[name].qsize() if self.queues else 0,
+                'capacity': self.queue_size,
+                'limit': self.limits[name],
+                'running': stats.running,
+                'completed': stats.completed,
+                'failed': stats.failed,
+                'rejected': stats.rejected,
+                'pages': stats.pages,
+                'latency_seconds': {'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9),
+                                    'p99': percentile(latencies, 0.99)},
+                'run_seconds': {'p50': percentile(run_times, 0.5), 'p90': percentile(run_times, 0.9),
+                                'p99': percentile(run_times, 0.99)},
+                'pages_per_second': sum(pages for _, pages in stats.recent_pages) / min(uptime, RATE_WINDOW_SECONDS) if uptime else 0.0,
+            }
+        pages = sum(stats.pages for stats in self.stats.values())
+        return {'uptime_seconds': uptime, 'workers': self.workers, 'pages': pages,
+                'pages_per_second': pages / uptime if uptime else 0.0, 'queues': queues}
+
+    # HTTP
+
+    async def _handle_http(self, reader, writer):
+        extra_headers = {}
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                status, payload = 413, {'error': f"Jobs are limited to {MAX_BODY_BYTES} bytes"}
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, payload, extra_headers = self._route(method, target.split('?')[0], body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {'error': f"Malformed request: {e}"}
+        except Exception as e:
+            # Every request gets an answer, whatever went wrong
+            status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+
+        data = json.dumps(payload).encode('utf-8')
+        head = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", "Content-Type: application/json",
+                f"Content-Length: {len(data)}", "Connection: close"]
+        head.extend(f"{name}: {value}" for name, value in extra_headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def _route(self, method, path, body):
+        """(status, JSON payload, extra headers) for a request."""
+        parts = [part for part in path.split('/') if part]
+        if parts == ['metrics']:
+            if method != 'GET':
+                return 405, {'error': "Use GET"}, {}
+            return 200, self.metrics(), {}
+        if len(parts) == 2 and parts[0] == 'jobs':
+            if method == 'GET':
+                job = self.jobs.get(parts[1])
+                if job is None:
+                    return 404, {'error': f"No job '{parts[1]}'"}, {}
+                return 200, job.describe(), {}
+            if method == 'POST':
+                if parts[1] not in QUEUES:
+                    return 404, {'error': f"Unknown queue '{parts[1]}'; choose from {', '.join(QUEUES)}"}, {}
+                try:
+                    job = self.submit(parts[1], json.loads(body or b"null"))
+                except asyncio.QueueFull:
+                    return 503, {'error': f"The {parts[1]} queue is full; try again shortly"}, {'Retry-After': '1'}
+                except ValueError as e:
+                    return 400, {'error': str(e)}, {}
+                except Exception as e:
+                    return 400, {'error': f"Invalid job: {type(e).__name__}: {e}"}, {}
+                return 202, job.describe(), {}
+            return 405, {'error': "Use GET or POST"}, {}
+        return 404, {'error': f"No such endpoint: {path}"}, {}
+
+
+def _parse_limit(text):
+    name, _, value = text.partition('=')
+    if name not in QUEUES or not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected QUEUE=N with a queue from {', '.join(QUEUES)}, got '{text}'")
+    return name, int(value)
+
+
+async def _serve(service, host, port):
+    await service.start(host=host, port=port)
+    address = service.address()
+    if address:
+        print(f"Listening on http://{address[0]}:{address[1]}/ (POST /jobs/<queue>, GET /jobs/<id>, GET /metrics)")
+    if service.root:
+        print(f"Watching {', '.join(os.path.join(service.root, name) for name in QUEUES)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run stamp, merge, split and extract jobs from hot folders and a local HTTP API.")
+    parser.add_argument('--root', help="hot-folder root; jobs are read from ROOT/<queue>/*.json")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help="HTTP port (0 picks a free one)")
+    parser.add_argument('--no-http', action='store_true', help="only watch the hot folders")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes shared by all queues (default: CPU count)")
+    parser.add_argument('--limit', type=_parse_limit, action='append', default=[], metavar='QUEUE=N',
+                        help="jobs a queue runs at once (default: " + ", ".join(f"{k}={v}" for k, v in DEFAULT_LIMITS.items()) + ")")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help="waiting jobs each queue holds before refusing more")
+    args = parser.parse_args(argv)
+    if args.no_http and not args.root:
+        parser.error("--no-http needs --root")
+
+    service = Service(root=args.root, workers=args.workers, limits=dict(args.limit), queue_size=args.queue_size)
+    try:
+        asyncio.run(_serve(service, args.host, None if args.no_http else args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
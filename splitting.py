@@ -0,0 +1,222 @@
+"""Splitting one PDF into many outputs in a single pass.
+
+Ranges come from a page range spec ("1-3,5,7-9"), a fixed size
+("every 10") or the top-level bookmarks ("bookmarks"). Each worker opens
+the source once and walks its share of the pages in order, handing every
+page to all the outputs that need it, so nothing is parsed twice:
+
+    python splitting.py statements.pdf "every 3" --template "out/{stem}_{index:04d}.pdf"
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from merging import StreamingPdfWriter
+from page_model import count_pages
+from reader_pool import reader_pool
+
+DEFAULT_TEMPLATE = "{stem}_part{index:03d}.pdf"
+
+# Below this many pages, starting worker processes costs more than it saves.
+PARALLEL_MIN_PAGES = 200
+
+
+def parse_page_ranges(ranges_str):
+    ranges = []
+    parts = ranges_str.split(',')
+    for part in parts:
+        if '-' in part:
+            start, end = part.split('-')
+            start, end = int(start.strip()), int(end.strip())
+            if start > end:
+                raise ValueError(f"Invalid range: {part}")
+            ranges.append((start, end))
+        else:
+            num = int(part.strip())
+            ranges.append((num, num))
+    return ranges
+
+
+def every_n_pages(page_count, n):
+    if n < 1:
+        raise ValueError(f"Invalid page count per part: {n}")
+    return [(start, min(start + n - 1, page_count)) for start in range(1, page_count + 1, n)]
+
+
+def bookmark_ranges(reader):
+    """(start, end, title) for each top-level bookmark, ending where the next one starts."""
+    starts = []
+    for item in reader.outline:
+        if isinstance(item, list):
+            continue  # children of the previous bookmark
+        page_index = reader.get_destination_page_number(item)
+        if page_index is not None:
+            starts.append((page_index + 1, str(item.title)))
+    if not starts:
+        raise ValueError("The PDF has no bookmarks to split by.")
+
+    starts.sort()
+    page_count = count_pages(reader)
+    if starts[0][0] > 1:
+        starts.insert(0, (1, ""))
+    ranges = []
+    for (start, title), (next_start, _) in zip(starts, starts[1:] + [(page_count + 1, "")]):
+        if next_start > start:
+            ranges.append((start, next_start - 1, title))
+    return ranges
+
+
+def split_ranges(spec, reader):
+    """Turn a split spec into (start, end, title) ranges with 1-based, inclusive page numbers."""
+    spec = spec.strip()
+    page_count = count_pages(reader)
+    if spec.lower() in ('bookmarks', 'by bookmark'):
+        ranges = bookmark_ranges(reader)
+    else:
+        match = re.fullmatch(r'every\s+(\d+)(\s+pages?)?', spec, re.IGNORECASE)
+        if match:
+            ranges = [(start, end, "") for start, end in every_n_pages(page_count, int(match.group(1)))]
+        else:
+            ranges = [(start, end, "") for start, end in parse_page_ranges(spec)]
+
+    for start, end, _ in ranges:
+        if start < 1:
+            raise ValueError(f"Invalid page number: {start}")
+        if end > page_count:
+            raise ValueError(f"Page number {end} exceeds the total number of pages.")
+    return ranges
+
+
+def _safe_filename(text):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', text).strip('_')
+
+
+def output_names(template, ranges, source_path, directory=None):
+    """Output path for each range from a template with {index}, {start}, {end}, {title} and {stem}."""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    names = []
+    for index, (start, end, title) in enumerate(ranges, 1):
+        name = template.format(index=index, start=start, end=end, title=_safe_filename(title) or str(index), stem=stem)
+        names.append(os.path.join(directory, name) if directory else name)
+    if len(set(names)) != len(names):
+        raise ValueError(f"The output name template '{template}' gives several parts the same name.")
+    if os.path.abspath(source_path) in map(os.path.abspath, names):
+        # The source is read through a memory map while the parts are written
+        raise ValueError(f"The output name template '{template}' would overwrite the source file.")
+    return names
+
+
+def write_ranges(source_path, assignments, progress=None):
+    """Write (output path, start, end) assignments from one reader in a single ordered pass.
+
+    Returns the number of pages written. A writer is open only while the
+    pass is inside its range, so even thousands of outputs need few open files.
+    progress, when given, is called as progress(pages_done, total) after each page.
+    """
+    # Pooled, so every chunk a worker process writes shares one parsed source
+    reader = reader_pool.get(source_path)
+    pending = sorted(assignments, key=lambda assignment: assignment[1])
+    active = []  # [end, writer, file]
+    total = sum(end - start + 1 for _, start, end in pending)
+    written = 0
+    next_start = 0
+    page_num = 0
+    try:
+        while next_start < len(pending) or active:
+            if not active:
+                page_num = max(page_num, pending[next_start][1])
+            while next_start < len(pending) and pending[next_start][1] <= page_num:
+                output_path, _, end = pending[next_start]
+                f = open(output_path, 'wb')
+                active.append([end, StreamingPdfWriter(f), f])
+                next_start += 1
+
+            page = reader.pages[page_num - 1]
+            for _, writer, _ in active:
+                writer.add_page(page)
+                written += 1
+            if progress is not None:
+                progress(written, total)
+
+            still_active = []
+            for entry in active:
+                end, writer, f = entry
+                if end == page_num:
+                    writer.close()
+                    f.close()
+                else:
+                    still_active.append(entry)
+            active = still_active
+            page_num += 1
+    finally:
+        for _, _, f in active:
+            f.close()
+    return written
+
+
+def split_pdf(source_path, ranges, output_paths, workers=None, progress=None):
+    """Write each (start, end, ...) range of source_path to the matching output path.
+
+    The ranges are shared out between `workers` processes (inline when 1;
+    by default inline for small jobs and one per CPU otherwise). progress,
+    when given, is called as progress(pages_done, total) as parts finish.
+    Returns the number of pages written.
+    """
+    assignments = sorted(((path, r[0], r[1]) for path, r in zip(output_paths, ranges)), key=lambda a: a[1])
+    total = sum(end - start + 1 for _, start, end in assignments)
+    if workers is None:
+        workers = 1 if total < PARALLEL_MIN_PAGES else os.cpu_count()
+
+    if workers == 1 or len(assignments) == 1:
+        return write_ranges(source_path, assignments, progress=progress)
+
+    # Contiguous chunks, so each worker reads one region of the source; a few per
+    # worker keep them all busy and give regular progress updates.
+    chunk_count = min(len(assignments), workers * 2)
+    chunk_size = -(-len(assignments) // chunk_count)
+    chunks = [assignments[i:i + chunk_size] for i in range(0, len(assignments), chunk_size)]
+
+    written = 0
+    # Spawned, not forked: the editor starts splits from a job thread, and a forked child could inherit a held lock
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = [pool.submit(write_ranges, source_path, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            written += future.result()
+            if progress is not None:
+                progress(written, total)
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a PDF into several files in one pass.")
+    parser.add_argument('source', help="PDF to split")
+    parser.add_argument('spec', help="page ranges such as '1-3,5,7-9', 'every N' or 'bookmarks'")
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE,
+                        help="output name template using {index}, {start}, {end}, {title} and {stem} (default: %(default)s)")
+    parser.add_argument('--output-dir', help="directory for the outputs (default: next to the template path)")
+    parser.add_argument('--workers', type=int, help="number of worker processes (default: one per CPU for large splits)")
+    args = parser.parse_args(argv)
+
+    try:
+        ranges = split_ranges(args.spec, reader_pool.get(args.source))
+        output_paths = output_names(args.template, ranges, args.source, directory=args.output_dir)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    for directory in {os.path.dirname(path) for path in output_paths if os.path.dirname(path)}:
+        os.makedirs(directory, exist_ok=True)
+
+    pages = split_pdf(args.source, ranges, output_paths, workers=args.workers)
+    print(f"Wrote {len(output_paths)} files, {pages} pages.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,667 @@
+"""Headless text stamping, shared by the stamping tabs and the batch CLI.
+
+Run a manifest of stamp jobs across a process pool:
+
+    python stamping.py jobs.csv --workers 8
+
+The manifest is a CSV file with a header row, a JSON list or JSON lines,
+with one job per row: input, output, text and optionally size, x, y,
+angle, color, orientation, underline, optimize, mode, backend,
+bates_start and doc_id.
+
+Text may be a template with per-page fields, such as "ABC{bates:06d}"
+or "Page {page} of {pages}" (see TEMPLATE_FIELDS); other braces are
+printed as they are. The overlays for all
+pages of a document are drawn in one canvas pass and streamed onto their
+pages; --bates-start numbers every job of a manifest in one sequence:
+
+    python stamping.py production.csv --bates-start 1
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+import optimize
+from instrument import count, span
+from merging import StreamingPdfWriter
+from page_model import count_pages
+from pdf_backend import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject, PdfReader, PdfWriter, open_output, open_reader
+
+JOB_DEFAULTS = {
+    'size': 20,
+    'x': 306,
+    'y': 396,
+    'angle': None,
+    'color': 'red',
+    'orientation': 'portrait',
+    'underline': False,
+    'optimize': False,
+    'mode': 'xobject',
+    'backend': None,
+    'bates_start': 1,
+    'doc_id': None,
+}
+
+# 'xobject' draws one shared Form XObject on every page; 'merge' copies the
+# overlay's content and resources into each page with merge_page.
+STAMP_MODES = ('xobject', 'merge')
+
+STAMP_FONT = "Helvetica-Bold"
+
+# Fields a stamp template can use: the page number, the document's page
+# count, the Bates number (bates_start on the first page) and the
+# document ID (by default the input file name without its extension).
+TEMPLATE_FIELDS = ('page', 'pages', 'bates', 'doc_id')
+
+# A field with an optional conversion and format spec, as in "{bates:06d}";
+# doubling its braces, as in "{{page}}", prints it literally instead.
+TEMPLATE_FIELD = re.compile(r"\{\{(%(field)s)\}\}|\{(%(field)s)\}" % {
+    'field': r"(?:%s)(?:![rsa])?(?::[^{}]*)?" % '|'.join(TEMPLATE_FIELDS)})
+
+# Template overlays are rendered this many pages per canvas, which bounds memory on huge documents.
+TEMPLATE_CHUNK_PAGES = 2000
+
+
+class OverlayCache:
+    """LRU cache of parsed stamp pages, keyed on everything that affects the overlay."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+
+    def get(self, key, render):
+        if key in self._pages:
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return self._pages[key]
+        self.misses += 1
+        page = render()
+        self._pages[key] = page
+        if len(self._pages) > self.maxsize:
+            self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        self._pages.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._pages), 'maxsize': self.maxsize}
+
+
+# One cache per process, so every worker in a batch renders each distinct stamp once.
+overlay_cache = OverlayCache()
+
+
+# Where the origin of the displayed page sits in user space for each /Rotate value.
+ROTATION_ORIGINS = {90: (1, 0), 180: (1, 1), 270: (0, 1)}
+
+
+def page_geometry(page):
+    """Return (left, bottom, right, top, rotation) for a page, the key overlays are rendered for."""
+    box = page.mediabox
+    return (float(box.left), float(box.bottom), float(box.right), float(box.top), page.rotation % 360)
+
+
+def create_text_overlay(output, text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, geometry=None):
+    """Draw the stamp for a page with the given geometry.
+
+    x_pos and y_pos are points on the US Letter designer page for the
+    orientation, and are scaled to the displayed size of the target page.
+    Without a geometry the overlay is the designer page itself.
+    """
+    # reportlab is only needed once a stamp is actually drawn, so it isn't loaded at startup
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(output)
+    draw_overlay_page(c, text, font_size, x_pos, y_pos, angle=angle, orientation=orientation, color=color,
+                      underline=underline, geometry=geometry)
+    c.save()
+
+
+def create_template_overlay(output, texts, geometries, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False):
+    """Draw one overlay page per text and geometry, in a single canvas pass."""
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(output, pageCompression=1)
+    for text, geometry in zip(texts, geometries):
+        draw_overlay_page(c, text, font_size, x_pos, y_pos, angle=angle, orientation=orientation, color=color,
+                          underline=underline, geometry=geometry)
+        c.showPage()
+    c.save()
+
+
+def draw_overlay_page(c, text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, geometry=None):
+    """Draw the stamp on the current page of canvas c, sized for geometry (see create_text_overlay)."""
+    from reportlab.lib.colors import red, black, blue
+    from reportlab.lib.pagesizes import letter, landscape
+
+    designer_width, designer_height = letter if orientation == 'portrait' else landscape(letter)
+    if geometry is None:
+        geometry = (0, 0, designer_width, designer_height, 0)
+    left, bottom, right, top, rotation = geometry
+    width, height = right - left, top - bottom
+    if rotation in (90, 270):
+        page_width, page_height = height, width
+    else:
+        page_width, page_height = width, height
+
+    x_pos = x_pos * page_width / designer_width
+    y_pos = y_pos * page_height / designer_height
+
+    c.setPageSize((width, height))
+    # Draw in the coordinates of the page as displayed, whatever its box origin and /Rotate.
+    c.translate(left, bottom)
+    if rotation in ROTATION_ORIGINS:
+        origin_x, origin_y = ROTATION_ORIGINS[rotation]
+        c.translate(origin_x * width, origin_y * height)
+        c.rotate(rotation)
+    c.setFont(STAMP_FONT, font_size)
+
+    color_dict = {'red': red, 'blue': blue, 'black': black}
+    text_color = color_dict.get(color, red)
+
+    c.setFillColor(text_color)
+    c.setStrokeColor(text_color)
+
+    adjusted_y_pos = y_pos
+    ascent = font_size * 0.8
+
+    if adjusted_y_pos + ascent > page_height:
+        adjusted_y_pos = page_height - ascent
+    elif adjusted_y_pos - font_size * 0.2 < 0:
+        adjusted_y_pos = font_size * 0.2
+
+    if angle is not None:
+        c.saveState()
+        c.translate(x_pos, adjusted_y_pos)
+        c.rotate(angle)
+        c.drawCentredString(0, 0, text)
+        text_width = c.stringWidth(text, STAMP_FONT, font_size)
+        if underline:
+            c.setLineWidth(1)
+            c.line(-text_width / 2, -2, text_width / 2, -2)
+        c.restoreState()
+    else:
+        c.drawCentredString(x_pos, adjusted_y_pos, text)
+        text_width = c.stringWidth(text, STAMP_FONT, font_size)
+        if underline:
+            c.setLineWidth(1)
+            c.line(x_pos - text_width / 2, adjusted_y_pos - 2, x_pos + text_width / 2, adjusted_y_pos - 2)
+
+
+def render_text_overlay(text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, geometry=None):
+    """Render the overlay in memory and return the PDF bytes."""
+    buffer = BytesIO()
+    with span('overlay.render'):
+        create_text_overlay(buffer, text, font_size, x_pos, y_pos, angle=angle, orientation=orientation, color=color, underline=underline, geometry=geometry)
+    return buffer.getvalue()
+
+
+def render_template_overlay(texts, geometries, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False):
+    """Render one overlay page per text and geometry in memory and return the PDF bytes."""
+    buffer = BytesIO()
+    with span('overlay.render', pages=len(texts)):
+        create_template_overlay(buffer, texts, geometries, font_size, x_pos, y_pos, angle=angle, orientation=orientation, color=color, underline=underline)
+    return buffer.getvalue()
+
+
+def get_stamp_page(text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, geometry=None):
+    """Return the parsed overlay page, rendering it only on a cache miss."""
+    key = (text, STAMP_FONT, font_size, color, underline, angle, x_pos, y_pos, orientation, geometry)
+
+    def render():
+        data = render_text_overlay(text, font_size, x_pos, y_pos, angle=angle, orientation=orientation, color=color, underline=underline, geometry=geometry)
+        return PdfReader(BytesIO(data)).pages[0]
+
+    return overlay_cache.get(key, render)
+
+
+def get_stamp_pdf(text, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, geometry=None):
+    """Return the overlay as PDF bytes for the other backends, rendering it only on a cache miss."""
+    key = ('pdf', text, STAMP_FONT, font_size, color, underline, angle, x_pos, y_pos, orientation, geometry)
+    return overlay_cache.get(key, lambda: render_text_overlay(text, font_size, x_pos, y_pos, angle=angle, orientation=orientation,
+                                                              color=color, underline=underline, geometry=geometry))
+
+
+def stamp_form(stamp_page, geometry, writer):
+    """Add the overlay page to writer as a Form XObject and return a reference to it."""
+    content = DecodedStreamObject()
+    content.set_data(stamp_page.get_contents().get_data())
+    form = content.flate_encode()
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject(FloatObject(v) for v in geometry[:4]),
+        # Cloned, so writing never touches the cached overlay's objects
+        NameObject('/Resources'): stamp_page['/Resources'].clone(writer),
+    })
+    return writer._add_object(form)
+
+
+class FormStamper:
+    """Draws shared Form XObjects on the pages of one writer.
+
+    Each page only gains a resource entry and two tiny content streams
+    (shared by every page that uses the same name), so stamping cost and
+    output growth no longer depend on how much content a page has.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.forms = {}
+        self.streams = {}
+
+    def _stream(self, data):
+        if data not in self.streams:
+            stream = DecodedStreamObject()
+            stream.set_data(data)
+            self.streams[data] = self.writer._add_object(stream)
+        return self.streams[data]
+
+    def stamp(self, page, stamp_page, geometry):
+        """Draw stamp_page over page, a page of the writer, as the form shared by its geometry."""
+        if geometry not in self.forms:
+            self.forms[geometry] = stamp_form(stamp_page, geometry, self.writer)
+
+        # Copy the dictionaries before adding to them; pages may share their resources
+        resources = DictionaryObject(page['/Resources'].get_object()) if '/Resources' in page else DictionaryObject()
+        xobjects = DictionaryObject(resources['/XObject'].get_object()) if '/XObject' in resources else DictionaryObject()
+        number = 0
+        while f'/Stamp{number}' in xobjects:
+            number += 1
+        name = NameObject(f'/Stamp{number}')
+        xobjects[name] = self.forms[geometry]
+        resources[NameObject('/XObject')] = xobjects
+        page[NameObject('/Resources')] = resources
+
+        contents = page.get('/Contents')
+        if contents is None:
+            contents = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            contents = list(contents.get_object())
+        else:
+            contents = [contents]
+        # Wrap the page content in q/Q so a graphics state it leaves behind can't move the stamp
+        page[NameObject('/Contents')] = ArrayObject(
+            [self._stream(b"q\n")] + contents + [self._stream(f"\nQ q {name} Do Q\n".encode('ascii'))]
+        )
+
+
+class StreamingFormStamper:
+    """Stamps pages as they are streamed to a StreamingPdfWriter, each with its own overlay page.
+
+    Every overlay page becomes a Form XObject of its own, but the fonts and
+    other resources of one overlay document are copied once and shared.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.streams = {}
+
+    def _stream(self, data):
+        if data not in self.streams:
+            stream = DecodedStreamObject()
+            stream.set_data(data)
+            self.streams[data] = self.writer.add_object(stream)
+        return self.streams[data]
+
+    def stamp(self, page, stamp_page, geometry):
+        """Write page to the output with stamp_page, a page of an overlay reader, drawn over it."""
+        writer = self.writer
+        content = stamp_page.raw_get('/Contents').get_object()
+        # The overlay's content stream is reused as it was compressed, not decoded and encoded again
+        form = content.__class__()
+        form._data = content._data
+        for key in ('/Filter', '/DecodeParms'):
+            if key in content:
+                form[NameObject(key)] = content[key]
+        form.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject(FloatObject(v) for v in geometry[:4]),
+            NameObject('/Resources'): stamp_page.raw_get('/Resources'),
+        })
+        form_ref = writer.add_object(form, stamp_page.pdf)
+
+        resources = DictionaryObject(page['/Resources'].get_object()) if '/Resources' in page else DictionaryObject()
+        if '/XObject' in resources:
+            resources[NameObject('/XObject')] = DictionaryObject(resources['/XObject'].get_object())
+        else:
+            resources[NameObject('/XObject')] = DictionaryObject()
+        resources = writer.import_object(resources, page.pdf)
+        xobjects = resources['/XObject']
+        number = 0
+        while f'/Stamp{number}' in xobjects:
+            number += 1
+        name = NameObject(f'/Stamp{number}')
+        xobjects[name] = form_ref
+
+        contents = page.raw_get('/Contents') if '/Contents' in page else None
+        if contents is None:
+            contents = ArrayObject()
+        elif isinstance(contents.get_object(), ArrayObject):
+            contents = contents.get_object()
+        else:
+            contents = ArrayObject([contents])
+        contents = ArrayObject(
+            [self._stream(b"q\n")] + list(writer.import_object(contents, page.pdf)) + [self._stream(f"\nQ q {name} Do Q\n".encode('ascii'))]
+        )
+        writer.add_page(page, overrides={'/Resources': resources, '/Contents': contents})
+
+
+def template_fields(text):
+    """The TEMPLATE_FIELDS that text uses; raises ValueError for a format spec that doesn't suit its field."""
+    fields = set()
+    for match in TEMPLATE_FIELD.finditer(text):
+        if match.group(2) is not None:
+            fields.add(re.match(r"\w+", match.group(2)).group())
+    if fields:
+        try:
+            format_template(text, page=1, pages=1, bates=1, doc_id="")
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid stamp text '{text}': {e}") from None
+    return fields
+
+
+def format_template(text, **values):
+    """text with its fields filled in from values and its doubled field braces undone."""
+    def replace(match):
+        if match.group(1) is not None:
+            return "{%s}" % match.group(1)
+        return ("{%s}" % match.group(2)).format(**values)
+    return TEMPLATE_FIELD.sub(replace, text)
+
+
+def stamp_template(base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, progress=None, bates_start=1, doc_id=None):
+    """Stamp every page of base_pdf_path with its own rendering of the template text and return the number of pages.
+
+    Overlays are drawn TEMPLATE_CHUNK_PAGES pages to a canvas, and each
+    stamped page is streamed to the output as soon as it is done.
+    """
+    if doc_id is None:
+        doc_id = os.path.splitext(os.path.basename(base_pdf_path))[0]
+    reader = open_reader(base_pdf_path)
+    pages = reader.pages
+    total = len(pages)
+
+    def page_text(page_num):
+        return format_template(text, page=page_num, pages=total, bates=bates_start + page_num - 1, doc_id=doc_id)
+
+    page_text(1)  # a format spec that doesn't suit its field fails here, before anything is written
+    with open_output(output_pdf_path) as f:
+        writer = StreamingPdfWriter(f)
+        stamper = StreamingFormStamper(writer)
+        for first in range(0, total, TEMPLATE_CHUNK_PAGES):
+            chunk = [pages[index] for index in range(first, min(first + TEMPLATE_CHUNK_PAGES, total))]
+            geometries = [page_geometry(page) for page in chunk]
+            texts = [page_text(page_num) for page_num in range(first + 1, first + len(chunk) + 1)]
+            overlay = PdfReader(BytesIO(render_template_overlay(texts, geometries, font_size, x_pos, y_pos, angle=angle, orientation=orientation,
+                                                                color=color, underline=underline)))
+            for page_num, (base_page, stamp_page, geometry) in enumerate(zip(chunk, overlay.pages, geometries), first + 1):
+                with span('stamp.xobject'):
+                    stamper.stamp(base_page, stamp_page, geometry)
+                if progress is not None:
+                    progress(page_num, total)
+            writer.finish_reader(overlay)
+        writer.close()
+    return total
+
+
+def add_text_to_existing_pdf(base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos, angle=None, orientation='portrait', color='red', underline=False, progress=None, mode='xobject', backend=None, bates_start=1, doc_id=None):
+    """Stamp every page of base_pdf_path and return the number of pages written.
+
+    One overlay is rendered per distinct page geometry, so mixed-size and
+    rotated pages all get the stamp in the same relative position.
+    mode is one of STAMP_MODES; backend names the engine (see backends.py).
+    Text with template fields is rendered per page (see stamp_template),
+    numbering Bates from bates_start.
+    progress, when given, is called as progress(pages_done, total) after each page.
+    """
+    if mode not in STAMP_MODES:
+        raise ValueError(f"Invalid stamp mode: {mode}")
+    import backends  # not at the top: backends builds on this module
+    backend = backend or backends.default_backend_name()
+    if template_fields(text):
+        if backend != 'pypdf' or mode != 'xobject':
+            raise ValueError("Stamps with page fields need the pypdf backend and the xobject mode")
+        return stamp_template(base_pdf_path, text, output_pdf_path, font_size, x_pos, y_pos, angle=angle, orientation=orientation,
+                              color=color, underline=underline, progress=progress, bates_start=bates_start, doc_id=doc_id)
+    text = format_template(text)  # just doubled field braces to undo
+    if backend != 'pypdf':
+        if mode != 'xobject':
+            raise ValueError(f"The '{mode}' stamp mode needs the pypdf backend")
+        return backends.get_backend(backend).overlay(
+            base_pdf_path,
+            lambda geometry: get_stamp_pdf(text, font_size, x_pos, y_pos, angle=angle, orientation=orientation,
+                                           color=color, underline=underline, geometry=geometry),
+            output_pdf_path, progress=progress)
+
+    reader_base = open_reader(base_pdf_path)
+    writer = PdfWriter()
+    stamper = FormStamper(writer)
+    stamps = {}
+
+    total = len(reader_base.pages)
+    for page_num, base_page in enumerate(reader_base.pages, 1):
+        geometry = page_geometry(base_page)
+        if geometry not in stamps:
+            stamps[geometry] = get_stamp_page(text, font_size, x_pos, y_pos, angle=angle, orientation=orientation,
+                                              color=color, underline=underline, geometry=geometry)
+        if mode == 'merge':
+            with span('stamp.merge_page'):
+                base_page.merge_page(stamps[geometry])
+            with span('page.add'):
+                writer.add_page(base_page)
+        else:
+            with span('page.add'):
+                page = writer.add_page(base_page)
+            with span('stamp.xobject'):
+                stamper.stamp(page, stamps[geometry], geometry)
+        count('pages')
+        if progress is not None:
+            progress(page_num, total)
+
+    with open_output(output_pdf_path) as f, span('writer.write'):
+        writer.write(f)
+        count('bytes_written', f.tell())
+
+    return total
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def normalize_job(row):
+    """Turn a manifest row into a job dict with typed values and defaults filled in."""
+    job = dict(JOB_DEFAULTS)
+    job.update({k: v for k, v in row.items() if v not in (None, '')})
+    for key in ('input', 'output', 'text'):
+        if not job.get(key):
+            raise ValueError(f"Manifest entry is missing '{key}': {row}")
+    job['size'] = int(job['size'])
+    job['x'] = float(job['x'])
+    job['y'] = float(job['y'])
+    if job['angle'] is not None:
+        job['angle'] = float(job['angle'])
+    if job['orientation'] not in ('portrait', 'landscape'):
+        raise ValueError(f"Invalid orientation: {job['orientation']}")
+    job['underline'] = _parse_bool(job['underline'])
+    job['optimize'] = _parse_bool(job['optimize'])
+    if job['mode'] not in STAMP_MODES:
+        raise ValueError(f"Invalid stamp mode: {job['mode']}")
+    job['bates_start'] = int(job['bates_start'])
+    template_fields(job['text'])
+    return job
+
+
+def _manifest_job(number, row):
+    """normalize_job for one manifest row; a bad row becomes a job that reports its error instead of running."""
+    try:
+        if isinstance(row, Exception):
+            raise row
+        return normalize_job(row)
+    except Exception as e:
+        row = row if isinstance(row, dict) else {}
+        return {'input': row.get('input'), 'output': row.get('output'), 'error': f"Invalid manifest row {number}: {e}"}
+
+
+def _parse_json_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        if manifest_path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            content = f.read().strip()
+            if content.startswith('['):
+                rows = json.loads(content)
+            else:
+                rows = [_parse_json_line(line) for line in content.splitlines() if line.strip()]
+    return [_manifest_job(number, row) for number, row in enumerate(rows, 1)]
+
+
+def run_stamp_job(job):
+    """Run one job, returning a status dict instead of raising so a batch can carry on.
+
+    A job with an 'error' already set failed before it could run and is
+    reported as it is.
+    """
+    start = time.perf_counter()
+    renders_before = overlay_cache.misses
+    result = {'input': job.get('input'), 'output': job.get('output'), 'status': 'ok', 'pages': 0, 'bytes_saved': 0, 'error': None}
+    if job.get('error'):
+        result.update(status='error', error=job['error'], seconds=0.0, overlay_renders=0)
+        return result
+    try:
+        result['pages'] = add_text_to_existing_pdf(
+            job['input'], job['text'], job['output'], job['size'], job['x'], job['y'],
+            angle=job['angle'], orientation=job['orientation'], color=job['color'], underline=job['underline'],
+            mode=job['mode'], backend=job['backend'], bates_start=job['bates_start'], doc_id=job['doc_id']
+        )
+        if job['optimize']:
+            result['optimize'] = optimize.optimize_pdf(job['output'])
+            result['bytes_saved'] = result['optimize']['bytes_saved']
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    result['overlay_renders'] = overlay_cache.misses - renders_before
+    return result
+
+
+def run_batch(jobs, workers=None, on_result=None):
+    """Stamp all jobs on a pool of `workers` processes (inline when workers is 1).
+
+    on_result is called with each job's status dict as soon as it finishes.
+    Returns a summary dict with the per-job results and overall throughput.
+    """
+    start = time.perf_counter()
+    results = []
+
+    def record(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    if workers == 1:
+        for job in jobs:
+            record(run_stamp_job(job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_stamp_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    record(future.result())
+                except Exception as e:
+                    # The worker process itself died; the job never reported back.
+                    job = futures[future]
+                    record({'input': job.get('input'), 'output': job.get('output'), 'status': 'error',
+                            'pages': 0, 'seconds': 0.0, 'overlay_renders': 0, 'bytes_saved': 0, 'error': f"{type(e).__name__}: {e}"})
+
+    elapsed = time.perf_counter() - start
+    pages = sum(r['pages'] for r in results)
+    return {
+        'jobs': len(results),
+        'failed': sum(1 for r in results if r['status'] != 'ok'),
+        'pages': pages,
+        'overlay_renders': sum(r['overlay_renders'] for r in results),
+        'bytes_saved': sum(r['bytes_saved'] for r in results),
+        'seconds': elapsed,
+        'pages_per_second': pages / elapsed if elapsed > 0 else 0.0,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stamp text onto a batch of PDFs.")
+    parser.add_argument('manifest', help="CSV, JSON or JSON lines file describing the stamp jobs")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes (default: CPU count)")
+    parser.add_argument('--report', help="write the per-job results and summary to this JSON file")
+    parser.add_argument('--optimize', action='store_true', help="optimize the size of every output (or set 'optimize' per job)")
+    parser.add_argument('--mode', choices=STAMP_MODES, help="stamp mode for every job (default: per job, else xobject)")
+    parser.add_argument('--backend', help="PDF engine for every job: pypdf, pikepdf or pymupdf (default: per job, else pypdf)")
+    parser.add_argument('--bates-start', type=int, help="number the pages of all jobs in one Bates sequence from this number, in manifest order")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    for job in jobs:
+        if args.optimize:
+            job['optimize'] = True
+        if args.mode:
+            job['mode'] = args.mode
+        if args.backend:
+            job['backend'] = args.backend
+    if args.bates_start is not None:
+        bates = args.bates_start
+        for job in jobs:
+            if job.get('error'):
+                continue
+            job['bates_start'] = bates
+            try:
+                bates += count_pages(open_reader(job['input']))
+            except Exception as e:
+                # Reported as this job's failure; the numbering carries on with the next one
+                job['error'] = f"Couldn't count its pages for --bates-start: {type(e).__name__}: {e}"
+
+    def print_result(result):
+        if result['status'] == 'ok':
+            note = f", {optimize.describe(result['optimize'])}" if 'optimize' in result else ""
+            print(f"ok     {result['input']} -> {result['output']} ({result['pages']} pages, {result['seconds']:.2f}s{note})")
+        else:
+            print(f"FAILED {result['input'] or '(no input)'}: {result['error']}", file=sys.stderr)
+
+    summary = run_batch(jobs, workers=args.workers, on_result=print_result)
+    print(f"{summary['jobs']} jobs, {summary['failed']} failed, {summary['pages']} pages in "
+          f"{summary['seconds']:.2f}s ({summary['pages_per_second']:.1f} pages/s, "
+          f"{summary['overlay_renders']} overlay renders)")
+    if summary['bytes_saved']:
+        print(f"Optimization saved {summary['bytes_saved'] / 1024:.0f} KB in total")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
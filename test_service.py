@@ -0,0 +1,174 @@
+"""Tests for the job service's hot folders and HTTP API, run against temporary directories."""
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+from pdf_backend import PdfWriter
+from service import Service, validate_job
+
+
+def make_pdf(path, pages=3):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return str(path)
+
+
+def write_job(folder, name, spec):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+
+
+async def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.05)
+
+
+async def request(address, method, path, body=None):
+    reader, writer = await asyncio.open_connection(*address)
+    data = b"" if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode('utf-8'))
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), 30)
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def result_of(root, folder, name):
+    with open(os.path.join(root, folder, f"{name}.result.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('queue_name, spec', [
+    ('stamp', {'input': 'a.pdf', 'output': 'b.pdf', 'text': 7}),
+    ('extract', {'input': 'a.pdf', 'output': 'b.pdf', 'pages': 5}),
+    ('stamp', {'input': 'a.pdf', 'output': 'b.pdf', 'text': 'x', 'size': [1]}),
+    ('merge', {'inputs': 'a.pdf', 'output': 'b.pdf'}),
+    ('split', {'source': 'a.pdf', 'spec': ['1-3']}),
+])
+def test_validate_job_rejects_bad_fields(queue_name, spec):
+    with pytest.raises(ValueError):
+        validate_job(queue_name, spec)
+
+
+def test_hot_folder_runs_good_jobs_after_bad_ones(tmp_path):
+    root = str(tmp_path / 'jobs')
+    source = make_pdf(tmp_path / 'in.pdf')
+    write_job(os.path.join(root, 'stamp'), 'a_bad_type.json', {'input': source, 'output': str(tmp_path / 'x.pdf'), 'text': 7})
+    write_job(os.path.join(root, 'extract'), 'b_bad_pages.json', {'input': source, 'output': str(tmp_path / 'x.pdf'), 'pages': 5})
+    write_job(os.path.join(root, 'extract'), 'c_not_json.json', {})
+    with open(os.path.join(root, 'extract', 'c_not_json.json'), 'w') as f:
+        f.write("{not json")
+    write_job(os.path.join(root, 'extract'), 'd_good.json', {'input': source, 'output': str(tmp_path / 'out.pdf'), 'pages': '2-3'})
+
+    async def run():
+        service = await Service(root=root, workers=1, poll_seconds=0.05).start(port=None)
+        try:
+            await wait_for(lambda: os.path.exists(os.path.join(root, 'done', 'd_good.result.json')))
+            # A job file dropped later is still picked up: the watcher survived the bad ones
+            write_job(os.path.join(root, 'extract'), 'e_later.json', {'input': source, 'output': str(tmp_path / 'later.pdf'), 'pages': '1'})
+            await wait_for(lambda: os.path.exists(os.path.join(root, 'done', 'e_later.result.json')))
+        finally:
+            await service.stop()
+
+    asyncio.run(run())
+    for name in ('a_bad_type', 'b_bad_pages', 'c_not_json'):
+        assert os.path.exists(os.path.join(root, 'failed', f"{name}.json"))
+        assert result_of(root, 'failed', name)['error']
+    assert result_of(root, 'done', 'd_good')['result']['pages'] == 2
+    assert not any(os.scandir(os.path.join(root, 'processing', 'extract')))
+    assert not any(os.scandir(os.path.join(root, 'processing', 'stamp')))
+
+
+def test_jobs_left_in_processing_run_again_on_start(tmp_path):
+    root = str(tmp_path / 'jobs')
+    source = make_pdf(tmp_path / 'in.pdf')
+    write_job(os.path.join(root, 'processing', 'extract'), 'left.json', {'input': source, 'output': str(tmp_path / 'out.pdf'), 'pages': '1'})
+    write_job(os.path.join(root, 'processing', 'stamp'), 'left_bad.json', {'input': source, 'output': str(tmp_path / 'x.pdf'), 'text': 7})
+
+    async def run():
+        service = await Service(root=root, workers=1, poll_seconds=0.05).start(port=None)
+        try:
+            await wait_for(lambda: os.path.exists(os.path.join(root, 'done', 'left.result.json'))
+                           and os.path.exists(os.path.join(root, 'failed', 'left_bad.result.json')))
+        finally:
+            await service.stop()
+
+    asyncio.run(run())
+    assert os.path.exists(tmp_path / 'out.pdf')
+    # The bad job is not put back in line by the next start
+    assert not os.path.exists(os.path.join(root, 'processing', 'stamp', 'left_bad.json'))
+    assert not os.path.exists(os.path.join(root, 'stamp', 'left_bad.json'))
+
+
+def test_http_errors_and_jobs(tmp_path):
+    source = make_pdf(tmp_path / 'in.pdf')
+
+    async def run():
+        service = await Service(workers=1, queue_size=1, limits={'extract': 1}).start(port=0)
+        address = service.address()
+        try:
+            for body in ({'input': source, 'output': 'x.pdf', 'text': 7},
+                         {'input': source, 'output': 'x.pdf', 'text': 'x', 'size': [1]},
+                         {'input': source, 'output': 'x.pdf'},
+                         b"{not json", b"[1, 2]"):
+                status, payload = await request(address, 'POST', '/jobs/stamp', body)
+                assert status == 400, payload
+                assert payload['error']
+            status, _ = await request(address, 'POST', '/jobs/extract', {'input': source, 'output': 'x.pdf', 'pages': 5})
+            assert status == 400
+            assert (await request(address, 'POST', '/jobs/nosuch', {}))[0] == 404
+            assert (await request(address, 'GET', '/jobs/nosuch'))[0] == 404
+            assert (await request(address, 'DELETE', '/metrics'))[0] == 405
+
+            status, job = await request(address, 'POST', '/jobs/extract', {'input': source, 'output': str(tmp_path / 'out.pdf'), 'pages': '1,3'})
+            assert status == 202
+            while job['state'] not in ('done', 'failed'):
+                await asyncio.sleep(0.05)
+                status, job = await request(address, 'GET', f"/jobs/{job['id']}")
+                assert status == 200
+            assert job['state'] == 'done', job['error']
+            assert job['result']['pages'] == 2
+
+            status, metrics = await request(address, 'GET', '/metrics')
+            assert status == 200
+            assert metrics['queues']['extract']['completed'] == 1
+        finally:
+            await service.stop()
+
+    asyncio.run(run())
+
+
+def test_http_full_queue_answers_503(tmp_path):
+    source = make_pdf(tmp_path / 'in.pdf')
+
+    async def run():
+        service = await Service(workers=1, queue_size=1, limits={'extract': 1}).start(port=0)
+        address = service.address()
+        try:
+            spec = {'input': source, 'output': str(tmp_path / 'out.pdf'), 'pages': '1'}
+            # One job running and one waiting fill the service; a few more posts must be turned away
+            statuses = []
+            for _ in range(4):
+                status, payload = await request(address, 'POST', '/jobs/extract', spec)
+                statuses.append(status)
+                if status == 503:
+                    break
+            assert statuses[-1] == 503, statuses
+            assert set(statuses[:-1]) <= {202}
+            assert service.metrics()['queues']['extract']['rejected'] >= 1
+            await service.join()
+        finally:
+            await service.stop()
+
+    asyncio.run(run())
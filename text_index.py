@@ -0,0 +1,239 @@
+"""Full-text search over the pages in the editor.
+
+The text of every page of a PDF is extracted once, on a process pool in
+the background, into an inverted index: each word maps to the pages it
+appears on. Indexes are kept in an on-disk cache keyed by the file's
+hash, so a document opened before is searchable straight away, and a
+search is a few dictionary and sorted-list lookups however many pages
+there are:
+
+    python text_index.py invoices.pdf "acme 2024-0117"
+
+Every word of a query must be on a page for it to match; the last word
+also matches longer words it begins, so results follow what is being
+typed. Text is extracted with PyMuPDF when it is installed, and with
+pypdf otherwise.
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from instrument import count, span
+from reader_pool import file_key
+from thumbnails import file_digest
+
+# Checked without importing it: PyMuPDF is only loaded by the worker processes that extract text.
+HAVE_PYMUPDF = importlib.util.find_spec('pymupdf') is not None
+
+INDEX_VERSION = 1
+POLL_INTERVAL_MS = 100
+
+WORD = re.compile(r"\w+")
+
+
+def default_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pdf_editor', 'text_index')
+
+
+def words(text):
+    return WORD.findall(text.casefold())
+
+
+def page_texts(path):
+    """Yield the text of each page of path, in order."""
+    if HAVE_PYMUPDF:
+        import pymupdf
+        with pymupdf.open(path) as document:
+            for page in document:
+                yield page.get_text()
+    else:
+        from pdf_backend import open_reader
+        for page in open_reader(path).pages:
+            yield page.extract_text() or ""
+
+
+def build_postings(path):
+    """{word: sorted page indices} for every word on the pages of path, and the page count."""
+    postings = {}
+    page_count = 0
+    for page_index, text in enumerate(page_texts(path)):
+        for word in set(words(text)):
+            postings.setdefault(word, []).append(page_index)
+        page_count += 1
+    return postings, page_count
+
+
+def index_cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest[:2], f"{digest}.json")
+
+
+def load_index(path, cache_dir):
+    """Return (postings, page count) for path, building and caching them on a miss. Runs in a worker process."""
+    key = file_key(path)
+    cache_path = index_cache_path(cache_dir, file_digest(path))
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == INDEX_VERSION:
+            return data['terms'], data['pages']
+    except (OSError, ValueError):
+        pass
+
+    postings, page_count = build_postings(path)
+    if file_key(path) != key:
+        return postings, page_count  # rewritten while it was read: this may be either version, so don't cache it under the digest
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'pages': page_count, 'terms': postings}, f, separators=(',', ':'))
+    os.replace(temp_path, cache_path)
+    return postings, page_count
+
+
+class PageIndex:
+    """Inverted index of one PDF's pages."""
+
+    def __init__(self, postings, page_count):
+        self.postings = postings
+        self.page_count = page_count
+        self.terms = sorted(postings)
+
+    def pages_with(self, word, prefix=False):
+        """Set of page indices with word on them, or with any word starting with it when prefix is set."""
+        if not prefix:
+            return set(self.postings.get(word, ()))
+        pages = set()
+        for term in self.terms[bisect_left(self.terms, word):]:
+            if not term.startswith(word):
+                break
+            pages.update(self.postings[term])
+        return pages
+
+    def search(self, query):
+        """Set of page indices that have every word of query, the last one as a prefix."""
+        query_words = words(query)
+        if not query_words:
+            return set()
+        # The rarest words first, so the candidate set shrinks quickly
+        exact = sorted(set(query_words[:-1]), key=lambda word: len(self.postings.get(word, ())))
+        pages = None
+        for word in exact:
+            found = self.pages_with(word)
+            pages = found if pages is None else pages & found
+            if not pages:
+                return set()
+        found = self.pages_with(query_words[-1], prefix=True)
+        return found if pages is None else pages & found
+
+
+class TextIndexer:
+    """Indexes PDFs on a process pool in the background and searches those that are ready.
+
+    widget is any Tk widget, used to poll for finished indexes with
+    after(); on_update, when given, is called after each one arrives.
+    """
+
+    def __init__(self, widget, cache_dir=None, workers=2, on_update=None):
+        self.widget = widget
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.workers = workers
+        self.on_update = on_update
+        self.indexes = {}  # path -> PageIndex
+        self.errors = {}  # path -> why it couldn't be indexed
+        self.futures = {}
+        self.versions = {}  # path -> file_key of the contents indexed or being indexed
+        self.results = queue.Queue()
+        self.pool = None
+        self.polling = False
+
+    def add(self, path):
+        """Start indexing path, unless its current contents are indexed or being indexed already.
+
+        A file rewritten since it was indexed, by a save in place for
+        one, is indexed again and its old index dropped.
+        """
+        try:
+            version = file_key(path)
+        except OSError:
+            version = None  # the worker reports why
+        if self.versions.get(path) == version and (path in self.indexes or path in self.futures):
+            return
+        self.versions[path] = version
+        self.indexes.pop(path, None)
+        self.errors.pop(path, None)
+        stale = self.futures.pop(path, None)
+        if stale is not None:
+            stale.cancel()
+        if self.pool is None:
+            # Spawned, not forked: a child forked from the threaded Tk process could inherit a held lock
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        future = self.pool.submit(load_index, path, self.cache_dir)
+        future.add_done_callback(lambda done, path=path: self.results.put((path, done)))
+        self.futures[path] = future
+        if not self.polling:
+            self.polling = True
+            self.widget.after(POLL_INTERVAL_MS, self.poll_results)
+
+    def pending(self):
+        return len(self.futures)
+
+    def poll_results(self):
+        updated = False
+        while True:
+            try:
+                path, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.futures.get(path) is not future:
+                continue  # the file was rewritten and added again since
+            del self.futures[path]
+            if future.cancelled():
+                continue
+            if future.exception() is not None:
+                self.errors[path] = f"{type(future.exception()).__name__}: {future.exception()}"
+            else:
+                self.indexes[path] = PageIndex(*future.result())
+            updated = True
+
+        if updated and self.on_update is not None:
+            self.on_update()
+        self.polling = bool(self.futures)
+        if self.polling:
+            self.widget.after(POLL_INTERVAL_MS, self.poll_results)
+
+    def search(self, query):
+        """{path: set of matching page indices} over the PDFs indexed so far."""
+        with span('index.search'):
+            results = {path: index.search(query) for path, index in self.indexes.items()}
+        count('index_searches')
+        return results
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the pages of a PDF that contain some words.")
+    parser.add_argument('pdf', help="PDF to search; its index is built on first use and cached")
+    parser.add_argument('query', help="words that must all be on a page")
+    parser.add_argument('--cache-dir', default=default_cache_dir())
+    args = parser.parse_args(argv)
+
+    index = PageIndex(*load_index(args.pdf, args.cache_dir))
+    pages = sorted(index.search(args.query))
+    print(f"{len(pages)} of {index.page_count} pages match: {', '.join(str(page + 1) for page in pages)}")
+    return 0 if pages else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""Virtualized thumbnail grid for the page editor.
+
+Only the cells currently scrolled into view exist on the canvas. Their
+thumbnails are rendered on a process pool, handed back to the Tk thread
+through a queue polled with after(), and kept in an on-disk cache keyed
+by the source file's hash and the page index, so a document that has
+been opened before shows its thumbnails straight away.
+
+Rendering needs PyMuPDF; without it the grid shows numbered placeholders.
+"""
+import base64
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import queue
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from tkinter import ttk
+
+from reader_pool import file_key
+
+# Checked without importing it: PyMuPDF is only loaded by the worker processes that render.
+HAVE_PYMUPDF = importlib.util.find_spec('pymupdf') is not None
+
+THUMBNAIL_WIDTH = 120
+THUMBNAIL_HEIGHT = 160
+CELL_PADDING = 10
+LABEL_HEIGHT = 18
+POLL_INTERVAL_MS = 50
+
+
+def default_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pdf_editor', 'thumbnails')
+
+
+_digests = {}
+
+
+def file_digest(path):
+    """SHA-256 of a file's contents, remembered per file_key."""
+    key = file_key(path)
+    if key not in _digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _digests[key] = digest.hexdigest()
+    return _digests[key]
+
+
+_documents = OrderedDict()
+
+
+def _open_document(path, max_open=4):
+    import pymupdf
+    key = file_key(path)
+    document = _documents.pop(key, None)
+    if document is None:
+        # A file rewritten since it was opened is opened again; its old document is closed
+        for stale in [open_key for open_key in _documents if open_key[0] == key[0]]:
+            _documents.pop(stale).close()
+        document = pymupdf.open(path)
+    _documents[key] = document
+    while len(_documents) > max_open:
+        _documents.popitem(last=False)[1].close()
+    return document
+
+
+def render_thumbnail(path, page_index, width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+    """Render one page to PNG bytes, scaled to fit width x height."""
+    import pymupdf
+    page = _open_document(path)[page_index]
+    zoom = min(width / page.rect.width, height / page.rect.height)
+    return page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False).tobytes('png')
+
+
+def thumbnail_cache_path(cache_dir, digest, page_index, width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+    return os.path.join(cache_dir, digest[:2], f"{digest}-{page_index}-{width}x{height}.png")
+
+
+def load_thumbnail(path, page_index, cache_dir, width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+    """Return PNG bytes for a page, rendering and caching it on a miss. Runs in a worker process."""
+    key = file_key(path)
+    cache_path = thumbnail_cache_path(cache_dir, file_digest(path), page_index, width, height)
+    try:
+        with open(cache_path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    data = render_thumbnail(path, page_index, width, height)
+    if file_key(path) != key:
+        return data  # rewritten while rendering: this may be either version, so don't cache it under the digest
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, cache_path)
+    return data
+
+
+class ThumbnailGrid(ttk.Frame):
+    """Scrollable grid of page thumbnails for a PageList, in its current order."""
+
+    def __init__(self, parent, pages, on_select=None, columns=2, cache_dir=None, workers=2, memory_items=256):
+        super().__init__(parent)
+        self.pages = pages
+        self.on_select = on_select
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.workers = workers
+        self.memory_items = memory_items
+        self.cell_width = THUMBNAIL_WIDTH + CELL_PADDING
+        self.cell_height = THUMBNAIL_HEIGHT + LABEL_HEIGHT + CELL_PADDING
+
+        self.images = OrderedDict()  # (path, page index, file version) -> PNG bytes, most recently used last
+        self.photos = []  # PhotoImages of the visible cells; Tk drops images nobody references
+        self.futures = {}
+        self.results = queue.Queue()
+        self.pool = None
+        self.polling = False
+
+        self.canvas = tk.Canvas(self, bg='white', highlightthickness=0,
+                                width=columns * self.cell_width + CELL_PADDING)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.canvas.config(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.canvas.bind('<Configure>', lambda event: self.refresh())
+        self.canvas.bind('<MouseWheel>', lambda event: self.yview('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind('<Button-4>', lambda event: self.yview('scroll', -1, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.yview('scroll', 1, 'units'))
+        self.canvas.bind('<Button-1>', self.on_click)
+
+    def set_pages(self, pages):
+        self.pages = pages
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def columns(self):
+        return max(1, (self.canvas.winfo_width() - CELL_PADDING) // self.cell_width)
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def visible_positions(self):
+        columns = self.columns()
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = int(top // self.cell_height) * columns
+        last = (int(bottom // self.cell_height) + 1) * columns
+        return range(max(first, 0), min(last, len(self.pages)))
+
+    def page_key(self, position):
+        source_id, page_index = self.pages[position]
+        path = self.pages.sources[source_id].path
+        try:
+            version = file_key(path)[1:]
+        except OSError:
+            version = None  # the worker reports it missing
+        # The file's mtime and size are part of the key, so a rewritten file gets new thumbnails
+        return path, page_index, version
+
+    def clear(self):
+        """Forget every thumbnail held in memory, for a document that was loaded again."""
+        self.images.clear()
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+
+    def refresh(self):
+        """Redraw the cells in view and request thumbnails for any not rendered yet."""
+        columns = self.columns()
+        rows = -(-len(self.pages) // columns)
+        self.canvas.config(scrollregion=(0, 0, columns * self.cell_width, rows * self.cell_height))
+        self.canvas.config(yscrollincrement=self.cell_height // 4)
+
+        self.canvas.delete('cell')
+        self.photos = []
+        visible_keys = set()
+        for position in self.visible_positions():
+            x = (position % columns) * self.cell_width + CELL_PADDING
+            y = (position // columns) * self.cell_height + CELL_PADDING
+            key = self.page_key(position)
+            visible_keys.add(key)
+
+            self.canvas.create_rectangle(x, y, x + THUMBNAIL_WIDTH, y + THUMBNAIL_HEIGHT, outline='#d0e8f1', tags='cell')
+            label = f"{position + 1} - Deleted" if self.pages.deleted[position] else str(position + 1)
+            self.canvas.create_text(x + THUMBNAIL_WIDTH // 2, y + THUMBNAIL_HEIGHT + LABEL_HEIGHT // 2,
+                                    text=label, font=("Helvetica", 9), tags='cell')
+            if key in self.images:
+                self.images.move_to_end(key)
+                photo = tk.PhotoImage(data=base64.b64encode(self.images[key]).decode("ascii"))
+                self.photos.append(photo)
+                self.canvas.create_image(x + THUMBNAIL_WIDTH // 2, y + THUMBNAIL_HEIGHT // 2, image=photo, tags='cell')
+            else:
+                self.request(key)
+
+        # Don't render pages that were scrolled past before their turn came
+        for key, future in list(self.futures.items()):
+            if key not in visible_keys and future.cancel():
+                del self.futures[key]
+
+    def request(self, key):
+        if not HAVE_PYMUPDF or key in self.futures:
+            return
+        if self.pool is None:
+            # Spawned, not forked: a child forked from the threaded Tk process could inherit a held lock
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        future = self.pool.submit(load_thumbnail, key[0], key[1], self.cache_dir)
+        future.add_done_callback(lambda done, key=key: self.results.put((key, done)))
+        self.futures[key] = future
+        if not self.polling:
+            self.polling = True
+            self.after(POLL_INTERVAL_MS, self.poll_results)
+
+    def poll_results(self):
+        updated = False
+        while True:
+            try:
+                key, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.futures.get(key) is future:
+                del self.futures[key]
+            if future.cancelled() or future.exception() is not None:
+                continue
+            self.images[key] = future.result()
+            while len(self.images) > self.memory_items:
+                self.images.popitem(last=False)
+            updated = True
+
+        if updated:
+            self.refresh()
+        self.polling = bool(self.futures)
+        if self.polling:
+            self.after(POLL_INTERVAL_MS, self.poll_results)
+
+    def on_click(self, event):
+        columns = self.columns()
+        column = int(self.canvas.canvasx(event.x) // self.cell_width)
+        row = int(self.canvas.canvasy(event.y) // self.cell_height)
+        position = row * columns + column
+        if column < columns and position < len(self.pages) and self.on_select is not None:
+            self.on_select(position)
+
+    def destroy(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        super().destroy()